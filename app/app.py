@@ -1,10 +1,10 @@
 import streamlit as st
 import sys
 import os
-import time
-import pandas as pd
 import json
-from datetime import datetime
+import time
+from contextlib import nullcontext
+from datetime import datetime, timedelta
 
 
 # Workaround for OpenMP error on Windows
@@ -13,11 +13,70 @@ os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 # Allow importing from src folder
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
 
-from agent import generate_advice
-from agent import explain_decision
-from agent import generate_actionable_steps
+from startup import timed, stages, importtime_report, format_report
+import metrics
 
-from calculator import calculate_total_co2
+# Set CFA_STARTUP_REPORT=1 to show startup timings in the sidebar
+SHOW_STARTUP_REPORT = os.environ.get("CFA_STARTUP_REPORT") == "1"
+# Set CFA_PROFILE=1 to cProfile each calculation and show it in the sidebar
+# (per-stage metrics are enabled separately with CFA_METRICS=1, see metrics.py)
+PROFILE_REQUESTS = os.environ.get("CFA_PROFILE") == "1"
+# Set CFA_API_URL to the address of a running src/api.py (as the browser
+# reaches it) to download exports from its streaming GET /export
+API_URL = os.environ.get("CFA_API_URL", "").rstrip("/")
+# Without the API, exports are built here and must fit in memory
+MAX_EXPORT_BYTES = 50 * 1024 * 1024
+
+# -----------------------------------------------------------------------------
+# Shared Resources (loaded lazily, once per process)
+# -----------------------------------------------------------------------------
+@st.cache_resource
+def load_engine():
+    # The calculator and agent modules (and the knowledge-base index) are only
+    # needed once the user calculates; they are loaded then and shared by
+    # every session served by this process.
+    with timed("import calculator"):
+        import calculator
+    with timed("import agent"):
+        import agent
+    with timed("build knowledge index"):
+        agent.get_knowledge_index().refresh()
+    import incremental
+    import result_cache
+    return calculator, agent, incremental, result_cache
+
+@st.cache_resource
+def load_store():
+    # One SQLite report store per process; reports saved as JSON files by
+    # earlier versions are imported the first time it is opened
+    with timed("open report store"):
+        from report_store import ReportStore
+        store = ReportStore()
+        store.migrate_json_reports()
+    return store
+
+@st.cache_resource
+def load_history():
+    # Per-household monthly history shared by every session, written back to
+    # outputs/history.npz periodically and at exit
+    with timed("load household history"):
+        import history
+        path = os.path.join(os.path.dirname(__file__), "..", "outputs", "history.npz")
+        return history.SharedHistory(path)
+
+@st.cache_resource
+def load_pandas():
+    # Only the breakdown chart needs pandas
+    with timed("import pandas"):
+        import pandas as pd
+    return pd
+
+@st.cache_resource
+def load_scenarios():
+    # Only the what-if planner needs the scenario engine
+    with timed("import scenarios"):
+        import scenarios
+    return scenarios
 
 # -----------------------------------------------------------------------------
 # Page Config & Styling
@@ -190,6 +249,13 @@ with st.container(border=True):
         plastic = st.number_input("Plastic Waste (kg/mo)", min_value=0.0, value=5.0)
         ewaste = st.number_input("E-waste (kg/mo)", min_value=0.0, value=0.0)
 
+    # With a household ID, the yearly figure is projected from the trend of
+    # this household's saved months instead of this month x 12
+    with st.expander("📅 Track your footprint over time"):
+        t_col1, t_col2 = st.columns(2)
+        household_id = t_col1.text_input("Household ID", help="Any name; saved months are kept under it.").strip()
+        month = t_col2.text_input("Month (YYYY-MM)", value=datetime.now().strftime("%Y-%m"))
+
 st.markdown("<br>", unsafe_allow_html=True)
 
 # -----------------------------------------------------------------------------
@@ -201,8 +267,6 @@ calculate_clicked = False
 with b_c2:
     if st.button("🚀 Calculate Carbon Footprint", use_container_width=True):
         calculate_clicked = True
-        with st.spinner("Analyzing your lifestyle..."):
-            time.sleep(1)
 
 if calculate_clicked:
     # Prepare Data
@@ -220,22 +284,48 @@ if calculate_clicked:
         "days": 30
     }
 
-    # Calculate
-    breakdown, percentages, highest = calculate_total_co2(user_data)
+    # Reports are shared across sessions through result_cache, so common
+    # inputs (e.g. the defaults) are computed once per process. On a miss
+    # this session's report graph computes it: only the parts that depend on
+    # inputs changed since its last calculation are recomputed, and tips are
+    # only retrieved again when the highest source changes.
+    with (metrics.profiled() if PROFILE_REQUESTS else nullcontext({})) as profile:
+        with metrics.timed("app.calculate"):
+            calculator, agent, incremental, result_cache = load_engine()
+            if 'report_graph' not in st.session_state:
+                st.session_state['report_graph'] = incremental.ReportGraph()
+            report = result_cache.cached_report(user_data, compute=st.session_state['report_graph'].update)
+    if "stats" in profile:
+        st.session_state['profile'] = profile["stats"]
+    breakdown, percentages, highest = report["breakdown"], report["percentages"], report["highest_source"]
     
     # Save results to session state
+    st.session_state['user_data'] = user_data
     st.session_state['breakdown'] = breakdown
     st.session_state['percentages'] = percentages
     st.session_state['highest'] = highest
+    st.session_state['report'] = report
+    st.session_state['tracking'] = None
+    if household_id:
+        try:
+            projection = load_history().preview(household_id, month, breakdown)
+            st.session_state['tracking'] = {"household_id": household_id, "month": month, "projection": projection}
+        except ValueError as e:
+            st.warning(f"Not tracked over time: {e}")
     st.session_state['results_ready'] = True
 
 # -----------------------------------------------------------------------------
 # Results Display
 # -----------------------------------------------------------------------------
 if st.session_state.get('results_ready'):
+    results_start = time.perf_counter()
     breakdown = st.session_state['breakdown']
     percentages = st.session_state['percentages']
     highest = st.session_state['highest']
+    # Reruns reuse the calculated report; nothing is recomputed
+    report = st.session_state['report']
+    tracking = st.session_state.get('tracking')
+    yearly_total = tracking["projection"]["projected_yearly"] if tracking else breakdown["yearly_total"]
 
     st.markdown("---")
     
@@ -246,10 +336,24 @@ if st.session_state.get('results_ready'):
         with m_col1:
             st.metric(label="Monthly Emissions", value=f"{breakdown['monthly_total']} kg CO₂")
         with m_col2:
-            st.metric(label="Yearly Projection", value=f"{breakdown['yearly_total']} kg CO₂")
+            st.metric(label="Yearly Projection", value=f"{yearly_total} kg CO₂")
+            if tracking:
+                months = tracking["projection"]["months_in_window"]
+                st.caption(f"Trend over {months} month{'s' if months != 1 else ''} for {tracking['household_id']}")
         with m_col3:
             st.metric(label="Top Contributor", value=f"{highest.capitalize()}", delta="Highest Impact", delta_color="inverse")
 
+        # Percentiles against every saved report, from the store's streaming
+        # sketches (no report scan)
+        population = load_store().percentiles(breakdown)
+        if population:
+            with st.expander("📈 How do you compare?"):
+                st.caption("Share of saved reports with emissions at or below yours.")
+                p_cols = st.columns(len(population))
+                for p_col, (metric, pct) in zip(p_cols, population.items()):
+                    label = "Monthly Total" if metric == "monthly_total" else metric.capitalize()
+                    p_col.metric(label=label, value=f"{pct}%")
+
     st.markdown("<br>", unsafe_allow_html=True)
 
     # Section 2: Visualizations & Analysis
@@ -258,11 +362,17 @@ if st.session_state.get('results_ready'):
     with row2_col1:
         with st.container(border=True):
             st.markdown("#### 🔍 Emission Breakdown")
-            chart_data = pd.DataFrame({
-                "Category": ["Electricity", "Transport", "Food", "Waste", "Water"],
-                "Emissions (kg)": [breakdown["electricity"], breakdown["transport"], breakdown["food"], breakdown["waste"], breakdown["water"]]
-            })
-            st.bar_chart(chart_data.set_index("Category"), color="#2E7D32")
+            # Rebuilt only when the breakdown changed
+            chart_version = tuple(breakdown.values())
+            if st.session_state.get('chart_version') != chart_version:
+                pd = load_pandas()
+                chart_data = pd.DataFrame({
+                    "Category": ["Electricity", "Transport", "Food", "Waste", "Water"],
+                    "Emissions (kg)": [breakdown["electricity"], breakdown["transport"], breakdown["food"], breakdown["waste"], breakdown["water"]]
+                })
+                st.session_state['chart_data'] = chart_data.set_index("Category")
+                st.session_state['chart_version'] = chart_version
+            st.bar_chart(st.session_state['chart_data'], color="#2E7D32")
 
     with row2_col2:
         with st.container(border=True):
@@ -280,7 +390,7 @@ if st.session_state.get('results_ready'):
             elif highest == "water":
                 st.warning("💧 **Quick Fix:** Fix leaks.")
             
-            explanation = explain_decision(breakdown, percentages, highest)
+            explanation = report["explanation"]
             with st.expander("🧠 Why is this highest?"):
                 st.write(explanation)
 
@@ -289,7 +399,7 @@ if st.session_state.get('results_ready'):
     # Section 3: AI Plan
     with st.container(border=True):
         st.markdown("<h3 style='text-align: center;'>🤖 AI Reduction Strategy</h3>", unsafe_allow_html=True)
-        advice = generate_advice(breakdown, percentages, highest)
+        advice = report["advice"]
         st.info(advice)
 
     st.markdown("<br>", unsafe_allow_html=True)
@@ -297,7 +407,7 @@ if st.session_state.get('results_ready'):
     # Section 4: Actionable Steps
     with st.container(border=True):
         st.markdown("<h3 style='text-align: center;'>🚀 Your Action Plan</h3>", unsafe_allow_html=True)
-        steps = generate_actionable_steps(breakdown, percentages, highest)
+        steps = report["steps"]
         
         # Split steps into columns for better readability if possible, or just markdown
         st.markdown(steps)
@@ -308,16 +418,42 @@ if st.session_state.get('results_ready'):
     with st.container(border=True):
         st.subheader("🌍 Sustainability Status")
 
-        if breakdown["yearly_total"] < 2000:
+        if yearly_total < 2000:
             st.success("✅ **Eco-Warrior:** Your footprint is LOW. Keep it up!")
-        elif breakdown["yearly_total"] < 4000:
+        elif yearly_total < 4000:
             st.warning("⚠️ **Average:** Your footprint is MODERATE. Room for improvement.")
         else:
             st.error("🚨 **High Impact:** Immediate lifestyle changes recommended.")
         
-        reduction_potential = round(breakdown["yearly_total"] * (percentages[highest] / 100) * 0.3, 2)
+        reduction_potential = round(yearly_total * (percentages[highest] / 100) * 0.3, 2)
         st.write(f"📉 **Potential Savings:** Reducing **{highest}** by 30% saves **{reduction_potential} kg CO₂/year**.")
 
+        # Every lever combination is scored in one array computation, so the
+        # planner reruns instantly as the effort slider moves
+        with st.expander("🧪 What-if Planner"):
+            scenarios = load_scenarios()
+            max_effort = st.slider(
+                "How much change are you ready for? (sum of lever levels)",
+                min_value=0.5, max_value=4.0, value=1.0, step=0.5
+            )
+            plans = scenarios.pareto_plans(st.session_state['user_data'], top=5, max_effort=max_effort)
+            if plans:
+                st.dataframe(
+                    [
+                        {
+                            "Plan": ", ".join(f"{name.replace('_', ' ')} {value:.0%}" for name, value in plan["levers"].items()),
+                            "Saves (kg CO₂/year)": plan["yearly_saved"],
+                            "Saves (%)": plan["saved_pct"],
+                            "Effort": plan["effort"],
+                        }
+                        for plan in plans
+                    ],
+                    hide_index=True,
+                    use_container_width=True
+                )
+            else:
+                st.write("No reduction plan applies to your inputs.")
+
         st.markdown("---")
         st.markdown("### 📥 Export Your Report")
         
@@ -331,14 +467,18 @@ if st.session_state.get('results_ready'):
                     "highest_source": highest,
                     "timestamp": str(datetime.now())
                 }
-                output_dir = "outputs/user_reports"
-                if not os.path.exists(output_dir):
-                    os.makedirs(output_dir)
-                report_path = f"{output_dir}/report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
                 try:
-                    with open(report_path, "w") as f:
-                        json.dump(report, f, indent=4)
-                    st.success(f"Saved: `{report_path}`")
+                    store = load_store()
+                    with metrics.timed("app.save_report"):
+                        store.save(report)
+                        # Written through before saying so: a buffered
+                        # report could still be lost if the process stops
+                        store.flush()
+                    st.success(f"Saved to report store: `{os.path.relpath(store.path)}`")
+                    if tracking:
+                        # The month joins the household's history (re-saving
+                        # the latest month replaces it)
+                        load_history().record(tracking["household_id"], tracking["month"], breakdown)
                 except Exception as e:
                     st.error(str(e))
 
@@ -356,3 +496,77 @@ if st.session_state.get('results_ready'):
                 mime="application/json",
                 use_container_width=True
             )
+
+    metrics.observe("stage_duration_seconds", time.perf_counter() - results_start, stage="app.render_results")
+
+# -----------------------------------------------------------------------------
+# Bulk Export (all stored reports in a date range)
+# -----------------------------------------------------------------------------
+with st.sidebar.expander("📦 Export Stored Reports", expanded=False):
+    today = datetime.now().date()
+    export_range = st.date_input("Date range", value=(today.replace(day=1), today))
+    export_format = st.selectbox("Format", ["csv", "ndjson", "parquet"])
+    export_gzip = st.checkbox("Compress (gzip)", value=True)
+
+    export_start = export_range[0] if export_range else None
+    # The end date is inclusive in the picker, exclusive in the query
+    export_end = export_range[-1] + timedelta(days=1) if export_range else None
+
+    if API_URL and export_format != "parquet":
+        # Streamed by the API in batches straight to the browser, so no
+        # export is ever held in memory here
+        from urllib.parse import urlencode
+
+        query = {"format": export_format, "gzip": int(export_gzip)}
+        query.update({name: str(bound) for name, bound in (("start", export_start), ("end", export_end)) if bound})
+        st.link_button("⬇️ Download Export", f"{API_URL}/export?{urlencode(query)}", use_container_width=True)
+    elif st.button("Prepare export", use_container_width=True):
+        import tempfile
+        import export
+
+        filename = export.export_filename(export_format, export_gzip, export_start, export_range[-1] if export_range else None)
+        # Streamed to a temp file in batches, then served from memory (all
+        # st.download_button can do) for this run only: the bytes are not
+        # kept in session state, and exports over MAX_EXPORT_BYTES are
+        # refused - set CFA_API_URL, or use src/export.py, for those.
+        handle = tempfile.NamedTemporaryFile(prefix="cfa-export-", suffix=f"-{filename}", delete=False)
+        handle.close()
+        try:
+            with metrics.timed("app.export_reports"):
+                count = export.export_reports(
+                    handle.name, fmt=export_format, compress=export_gzip, store=load_store(), start=export_start, end=export_end
+                )
+            size = os.path.getsize(handle.name)
+            if size > MAX_EXPORT_BYTES:
+                st.error(f"Export is {size / 1e6:.0f} MB, over the {MAX_EXPORT_BYTES / 1e6:.0f} MB limit here; "
+                         "narrow the date range, or download it through the API (CFA_API_URL)")
+            else:
+                with open(handle.name, "rb") as f:
+                    data = f.read()
+                st.caption(f"{count} reports, {size / 1e6:.1f} MB")
+                st.download_button(
+                    label="⬇️ Download Export",
+                    data=data,
+                    file_name=filename,
+                    mime="application/gzip" if export_gzip and export_format != "parquet" else export.MIME_TYPES[export_format],
+                    use_container_width=True
+                )
+        except Exception as e:
+            st.error(str(e))
+        finally:
+            os.remove(handle.name)
+
+# -----------------------------------------------------------------------------
+# Startup Report (CFA_STARTUP_REPORT=1)
+# -----------------------------------------------------------------------------
+if SHOW_STARTUP_REPORT:
+    with st.sidebar.expander("⏱️ Startup Report", expanded=False):
+        st.markdown("**Lazy loads in this process**")
+        for stage, at, duration in stages():
+            st.write(f"`{stage}`: {duration * 1000:.1f} ms (at +{at:.2f}s)")
+        if st.button("Profile imports (-X importtime)"):
+            st.code(format_report(importtime_report()))
+
+if PROFILE_REQUESTS and st.session_state.get('profile'):
+    with st.sidebar.expander("🔬 Last Calculation Profile", expanded=False):
+        st.code(st.session_state['profile'])
@@ -1,6 +1,10 @@
 import os
 import random
 
+import metrics
+from ingest import SUPPORTED_EXTENSIONS
+from kb_index import KnowledgeIndex
+
 # Keyword Matching RAG Agent (Optimized for Windows Compatibility)
 # This module replaces the heavy LangChain/Torch based engine to avoid DLL load errors on standard Windows environments.
 # It performs direct keyword search on the local knowledge base text files.
@@ -11,28 +15,40 @@ def get_rag_docs_path():
     # Adjust path: src/../rag_docs -> root/rag_docs
     return os.path.join(base_dir, "..", "rag_docs")
 
+# Shared inverted index over rag_docs/, built on first use and rebuilt only
+# when a knowledge-base file changes. With CFA_KB_SNAPSHOT set to a file
+# built by kb_snapshot.py, the prebuilt snapshot is mapped instead.
+_knowledge_index = None
+
+def get_knowledge_index():
+    global _knowledge_index
+    if _knowledge_index is None:
+        snapshot_path = os.environ.get("CFA_KB_SNAPSHOT")
+        if snapshot_path:
+            from kb_snapshot import KnowledgeSnapshot
+
+            _knowledge_index = KnowledgeSnapshot(snapshot_path)
+        else:
+            _knowledge_index = KnowledgeIndex(get_rag_docs_path(), extensions=SUPPORTED_EXTENSIONS)
+    return _knowledge_index
+
+def set_knowledge_index(index):
+    # Replace the shared index (e.g. with one over a synthetic knowledge base
+    # for benchmarking) and return the previous one
+    global _knowledge_index
+    previous, _knowledge_index = _knowledge_index, index
+    return previous
+
+@metrics.instrument("agent.simple_retrieve")
 def simple_retrieve(keywords):
     docs_path = get_rag_docs_path()
-    results = []
     
     if not os.path.exists(docs_path):
         return ["Knowledge base directory not found locally."]
 
-    # Iterate through all text files in the knowledge base
-    for filename in os.listdir(docs_path):
-        if filename.endswith(".txt"):
-            file_path = os.path.join(docs_path, filename)
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    for line in f:
-                        # Check if ANY of the keywords exist in the line (case-insensitive)
-                        if any(k in line.lower() for k in keywords):
-                            clean_line = line.strip()
-                            # Add line if it's not empty and not a duplicate
-                            if clean_line and clean_line not in results:
-                                results.append(clean_line)
-            except Exception as e:
-                print(f"Error reading {filename}: {e}")
+    # Lines containing ANY of the keywords (case-insensitive), deduplicated
+    results = get_knowledge_index().retrieve(keywords)
+    metrics.inc("lines_matched", len(results), stage="simple_retrieve")
                 
     # Return a random sample of tips to keep it dynamic, or all if few tips found
     sample_size = min(len(results), 5)
@@ -41,22 +57,65 @@ def simple_retrieve(keywords):
         
     return random.sample(results, sample_size)
 
-def generate_advice(breakdown, percentages, highest_source):
-    # Mapping broader categories to specific search keywords for better results
-    keyword_map = {
-        "electricity": ["electricity", "energy", "power", "led", "solar", "appliance"],
-        "transport": ["transport", "vehicle", "car", "fuel", "petrol", "diesel", "commute"],
-        "food": ["food", "diet", "meat", "veg", "vegetarian", "eat"],
-        "waste": ["waste", "plastic", "recycle", "compost", "landfill"],
-        "water": ["water", "rainwater", "shower", "tap"]
-    }
-    
-    # Get keywords for the highest emission source
-    search_terms = keyword_map.get(highest_source, [highest_source])
-    
-    # Retrieve tips from knowledge base
-    tips = simple_retrieve(search_terms)
-    
+@metrics.instrument("agent.ranked_retrieve")
+def ranked_retrieve(keywords, k=5):
+    # Deterministic BM25-ranked alternative to simple_retrieve: the top k
+    # matching lines as (tip, score) pairs, best first
+    docs_path = get_rag_docs_path()
+
+    if not os.path.exists(docs_path):
+        return [("Knowledge base directory not found locally.", 0.0)]
+
+    return get_knowledge_index().search(keywords, k=k)
+
+# Optional embedding retriever (see ann_index.py): with CFA_ANN_INDEX set to
+# a built IVF index, generate_advice ranks tips by semantic similarity
+# instead of keyword matching
+_semantic_retriever = None
+
+def get_semantic_retriever():
+    global _semantic_retriever
+    path = os.environ.get("CFA_ANN_INDEX")
+    if _semantic_retriever is None and path:
+        from ann_index import load_retriever
+
+        _semantic_retriever = load_retriever(path)
+    return _semantic_retriever
+
+@metrics.instrument("agent.semantic_retrieve")
+def semantic_retrieve(query, k=5):
+    # Top k lines by embedding similarity to query, as (tip, similarity)
+    return get_semantic_retriever().retrieve(query, k=k)
+
+# Mapping broader categories to specific search keywords for better results
+KEYWORD_MAP = {
+    "electricity": ["electricity", "energy", "power", "led", "solar", "appliance"],
+    "transport": ["transport", "vehicle", "car", "fuel", "petrol", "diesel", "commute"],
+    "food": ["food", "diet", "meat", "veg", "vegetarian", "eat"],
+    "waste": ["waste", "plastic", "recycle", "compost", "landfill"],
+    "water": ["water", "rainwater", "shower", "tap"]
+}
+
+def retrieve_tips(highest_source, top_k=5, ranked=True):
+    # Knowledge-base tips for a category and a note on how they were found.
+    # Depends only on the category (and the knowledge base), so callers that
+    # track what changed can skip it while the highest source stays the same.
+    search_terms = KEYWORD_MAP.get(highest_source, [highest_source])
+
+    # Ranked (stable, cacheable) by default, or the legacy random sample of
+    # matching lines. Ranking is by embedding similarity when a semantic
+    # retriever is configured.
+    if ranked and get_semantic_retriever() is not None:
+        query = f"How to reduce {highest_source} emissions: " + ", ".join(search_terms)
+        tips = [tip for tip, _ in semantic_retrieve(query, k=top_k)]
+        return tips, "Using approximate embedding search over the knowledge base."
+    if ranked:
+        tips = [tip for tip, _ in ranked_retrieve(search_terms, k=top_k)]
+    else:
+        tips = simple_retrieve(search_terms)
+    return tips, "Using optimized keyword search due to environment limits."
+
+def format_advice(tips, percentages, highest_source, note):
     if tips:
         formatted_tips = "\n".join([f"- {tip}" for tip in tips])
     else:
@@ -68,9 +127,15 @@ def generate_advice(breakdown, percentages, highest_source):
 Based on your local knowledge base:
 {formatted_tips}
 
-*(Note: Using optimized keyword search due to environment limits.)*
+*(Note: {note})*
 """
     return response
+
+@metrics.instrument("agent.generate_advice")
+def generate_advice(breakdown, percentages, highest_source, top_k=5, ranked=True):
+    tips, note = retrieve_tips(highest_source, top_k, ranked)
+    return format_advice(tips, percentages, highest_source, note)
+
 def explain_decision(breakdown, percentages, highest_source):
     explanation = f"""
 Why did the AI select {highest_source} as the main problem?
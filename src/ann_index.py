@@ -0,0 +1,282 @@
+# src/ann_index.py
+#
+# Approximate nearest-neighbour search over embedding vectors: an IVF
+# (inverted file) index. Vectors are normalised (cosine similarity), grouped
+# into n_lists clusters by spherical k-means, and stored contiguously by
+# cluster. A query scores the centroids, then only the vectors in its nprobe
+# closest clusters, so the cost is about nprobe / n_lists of an exact scan.
+#
+# Knobs: n_lists (more lists = smaller scans, more clusters to probe), nprobe
+# (per query; higher = better recall, slower) and dtype (float16 halves
+# memory and bandwidth, at a small cost in score precision).
+#
+#   python src/ann_index.py build --snapshot outputs/kb.snapshot    # -> outputs/kb.ivf.npz
+#   python src/ann_index.py report --synthetic 200000 --dim 384     # recall/latency vs exact
+#   python src/ann_index.py report --index outputs/kb.ivf.npz
+#
+# Set CFA_ANN_INDEX=outputs/kb.ivf.npz to have generate_advice retrieve tips
+# through the index instead of keyword matching.
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_INDEX_PATH = os.path.join(BASE_DIR, "outputs", "kb.ivf.npz")
+
+_BLOCK = 65536
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+def _top_k(scores, k):
+    # Indices of the k highest scores, best first; ties go to the lower index
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return top[np.lexsort((top, -scores[top]))]
+
+def _assign(vectors, centroids):
+    # Nearest centroid of every vector, computed in blocks
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _BLOCK):
+        block = np.asarray(vectors[start:start + _BLOCK], dtype=np.float32)
+        labels[start:start + _BLOCK] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+def spherical_kmeans(vectors, n_clusters, n_iter=20, seed=0):
+    # Centroids (unit length) of n_clusters clusters of the normalised vectors
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].astype(np.float32)
+    for _ in range(n_iter):
+        labels = _assign(vectors, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        # Per-cluster sums via one sort + reduceat (np.add.at is far slower)
+        order = np.argsort(labels, kind="stable")
+        empty = counts == 0
+        starts = (np.cumsum(counts) - counts)[~empty]
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(vectors[order], starts, axis=0)
+        if empty.any():
+            # Reseed empty clusters from random vectors
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        updated = normalize(sums)
+        if np.allclose(updated, centroids, atol=1e-5):
+            centroids = updated
+            break
+        centroids = updated
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, centroids, vectors, ids, list_offsets, nprobe=8, meta=None):
+        self.centroids = centroids
+        # vectors[list_offsets[c]:list_offsets[c + 1]] are the members of
+        # cluster c, and ids maps each row back to its original position
+        self.vectors = vectors
+        self.ids = ids
+        self.list_offsets = list_offsets
+        self.nprobe = nprobe
+        self.meta = meta or {}
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, nprobe=8, dtype=np.float32, train_size=None, n_iter=20, seed=0, meta=None):
+        vectors = normalize(vectors)
+        n = len(vectors)
+        if n == 0:
+            raise ValueError("Cannot build an index over no vectors")
+        if n_lists is None:
+            n_lists = max(1, int(math.sqrt(n)))
+        n_lists = min(n_lists, n)
+        # k-means only needs a sample: ~64 points per list is plenty
+        train_size = min(n, train_size or 64 * n_lists)
+        rng = np.random.default_rng(seed)
+        sample = vectors if train_size == n else vectors[rng.choice(n, train_size, replace=False)]
+        centroids = spherical_kmeans(sample, n_lists, n_iter=n_iter, seed=seed)
+
+        labels = _assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=list_offsets[1:])
+        return cls(centroids, vectors[order].astype(dtype), order.astype(np.int64), list_offsets, nprobe, meta)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def search(self, query, k=5, nprobe=None):
+        # (ids, similarities) of the approximate top k, best first
+        query = normalize(query)
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        lists = _top_k(self.centroids @ query, nprobe)
+        rows = np.concatenate([np.arange(self.list_offsets[c], self.list_offsets[c + 1]) for c in lists])
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.vectors[rows].astype(np.float32) @ query
+        top = _top_k(scores, k)
+        return self.ids[rows[top]], scores[top]
+
+    def search_batch(self, queries, k=5, nprobe=None):
+        results = [self.search(query, k, nprobe) for query in queries]
+        return [ids for ids, _ in results], [scores for _, scores in results]
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path, centroids=self.centroids, vectors=self.vectors, ids=self.ids,
+            list_offsets=self.list_offsets, nprobe=self.nprobe, meta=json.dumps(self.meta),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["centroids"], data["vectors"], data["ids"], data["list_offsets"],
+                int(data["nprobe"]), json.loads(str(data["meta"])),
+            )
+
+
+def exact_search(vectors, query, k=5):
+    # Brute-force cosine top k over normalised vectors, as (ids, similarities)
+    scores = np.asarray(vectors, dtype=np.float32) @ normalize(query)
+    top = _top_k(scores, k)
+    return top, scores[top]
+
+def recall_report(index, vectors, queries, k=10, nprobes=(1, 2, 4, 8, 16, 32)):
+    # Recall@k and mean latency of index.search at each nprobe, against exact
+    # search over the same (normalised) vectors
+    vectors = normalize(vectors)
+    start = time.perf_counter()
+    truth = [set(exact_search(vectors, query, k)[0].tolist()) for query in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    rows = []
+    for nprobe in nprobes:
+        if nprobe > index.n_lists:
+            break
+        start = time.perf_counter()
+        found = [index.search(query, k, nprobe)[0] for query in queries]
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        hits = sum(len(expected.intersection(ids.tolist())) for expected, ids in zip(truth, found))
+        expected_total = sum(len(expected) for expected in truth)
+        rows.append({
+            "nprobe": nprobe,
+            "recall": round(hits / expected_total, 4) if expected_total else 1.0,
+            "latency_ms": round(latency_ms, 3),
+            "speedup": round(exact_ms / latency_ms, 1) if latency_ms else None,
+        })
+    return {"vectors": len(vectors), "n_lists": index.n_lists, "k": k, "exact_ms": round(exact_ms, 3), "rows": rows}
+
+
+# -----------------------------------------------------------------------------
+# Retrieval over the knowledge-base snapshot
+# -----------------------------------------------------------------------------
+
+class SemanticRetriever:
+    # Tips by embedding similarity: the query is embedded with the model the
+    # snapshot's vectors came from, searched in the IVF index, and the hits
+    # are mapped back to snapshot lines
+    def __init__(self, index, lines, embed_query):
+        self.index = index
+        self.lines = lines
+        self.embed_query = embed_query
+
+    def retrieve(self, query, k=5, nprobe=None):
+        ids, scores = self.index.search(self.embed_query(query), k, nprobe)
+        return [(self.lines[i], round(float(score), 4)) for i, score in zip(ids.tolist(), scores.tolist())]
+
+def load_retriever(path=DEFAULT_INDEX_PATH):
+    from kb_snapshot import KnowledgeSnapshot
+    from rag_engine import LazyEmbeddings
+
+    index = IVFIndex.load(path)
+    snapshot = KnowledgeSnapshot(index.meta["snapshot"])
+    embeddings = LazyEmbeddings(index.meta["embedding_model"])
+    return SemanticRetriever(index, snapshot.snapshot().lines, embeddings.embed_query)
+
+def build_from_snapshot(snapshot_path, output=DEFAULT_INDEX_PATH, n_lists=None, nprobe=8, dtype=np.float32):
+    from kb_snapshot import KnowledgeSnapshot
+
+    state = KnowledgeSnapshot(snapshot_path).snapshot()
+    if state.embeddings is None:
+        raise ValueError(f"{snapshot_path} has no embeddings; rebuild it with kb_snapshot.py build --embeddings")
+    meta = {"snapshot": os.path.abspath(snapshot_path), "embedding_model": state.meta["embedding_model"]}
+    index = IVFIndex.build(state.embeddings, n_lists=n_lists, nprobe=nprobe, dtype=dtype, meta=meta)
+    index.save(output)
+    return index
+
+
+def _synthetic_vectors(n, dim, clusters=256, seed=0):
+    # Clustered unit vectors, roughly like sentence embeddings
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return normalize(vectors)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or evaluate the IVF embedding index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index the embeddings of a knowledge-base snapshot")
+    build.add_argument("--snapshot", required=True, help="snapshot built with kb_snapshot.py build --embeddings")
+    build.add_argument("--output", default=DEFAULT_INDEX_PATH)
+    build.add_argument("--n-lists", type=int, default=None, help="clusters (default: sqrt(n))")
+    build.add_argument("--nprobe", type=int, default=8, help="default clusters scanned per query")
+    build.add_argument("--float16", action="store_true", help="store vectors as float16")
+    report = commands.add_parser("report", help="recall and latency against exact search")
+    source = report.add_mutually_exclusive_group(required=True)
+    source.add_argument("--index", help="saved index to evaluate")
+    source.add_argument("--synthetic", type=int, metavar="N", help="build over N synthetic vectors")
+    report.add_argument("--dim", type=int, default=384)
+    report.add_argument("--n-lists", type=int, default=None)
+    report.add_argument("--float16", action="store_true")
+    report.add_argument("--queries", type=int, default=200)
+    report.add_argument("-k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    dtype = np.float16 if args.float16 else np.float32
+    if args.command == "build":
+        start = time.perf_counter()
+        index = build_from_snapshot(args.snapshot, args.output, args.n_lists, args.nprobe, dtype)
+        print(f"Indexed {len(index)} vectors in {index.n_lists} lists in {time.perf_counter() - start:.2f}s "
+              f"-> {args.output}", file=sys.stderr)
+        return
+
+    rng = np.random.default_rng(1)
+    if args.index:
+        index = IVFIndex.load(args.index)
+        vectors = np.empty_like(index.vectors, dtype=np.float32)
+        vectors[index.ids] = index.vectors
+    else:
+        vectors = _synthetic_vectors(args.synthetic, args.dim)
+        start = time.perf_counter()
+        index = IVFIndex.build(vectors, n_lists=args.n_lists, dtype=dtype)
+        print(f"Built {index.n_lists} lists in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+    # Queries: perturbed copies of indexed vectors
+    picks = rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+    queries = normalize(vectors[picks] + 0.3 * rng.standard_normal(vectors[picks].shape).astype(np.float32))
+    result = recall_report(index, vectors, queries, k=args.k)
+
+    print(f"{result['vectors']} vectors, {result['n_lists']} lists, recall@{result['k']}, "
+          f"exact search {result['exact_ms']:.3f} ms/query")
+    print(f"{'nprobe':>7} {'recall':>8} {'ms/query':>9} {'speedup':>8}")
+    for row in result["rows"]:
+        print(f"{row['nprobe']:>7} {row['recall']:>8.4f} {row['latency_ms']:>9.3f} {row['speedup']:>7}x")
+
+if __name__ == "__main__":
+    main()
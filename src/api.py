@@ -0,0 +1,467 @@
+# src/api.py
+#
+# Headless HTTP/1.1 service for the calculator and agent, built on asyncio
+# streams only (no web framework), so it runs entirely locally:
+#
+#   python src/api.py --port 8080
+#
+#   GET  /health
+#   GET  /metrics                            -> Prometheus text (CFA_METRICS=1, see metrics.py)
+#   POST /calculate   {household}            -> breakdown, percentages, highest_source
+#   POST /report      {household}            -> the above + explanation, advice, steps
+#   POST /save        {household}            -> saves its report to the report store (as the app's
+#                                               "Save to System" does)
+#   POST /batch       JSON array or NDJSON   -> NDJSON stream, one result per line
+#                     (?advice=1 adds explanation/advice/steps to every line)
+#   GET  /export      ?start=&end=&highest_source=&format=csv|ndjson&gzip=1
+#                                            -> stored reports as a chunked download (see export.py)
+#
+# /calculate and /report accept ?profile=1 to run uncoalesced under cProfile
+# and return the profile report in a "profile" field.
+#
+# Identical in-flight /calculate and /report requests are coalesced onto one
+# computation, and all calculator/retrieval work runs on a worker thread pool
+# so the event loop never blocks on the knowledge-base file I/O.
+
+import argparse
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+import result_cache
+from records import HouseholdInputs
+from stream_calculator import records_to_columns, score_columns
+
+MAX_BODY_BYTES = 64 * 1024 * 1024
+BATCH_CHUNK_SIZE = 1000
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request:
+    def __init__(self, method, target, version, headers, reader):
+        url = urlsplit(target)
+        self.method = method
+        self.path = url.path
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.version = version
+        self.headers = headers
+        self.reader = reader
+        try:
+            self.remaining = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            self.remaining = -1
+        if self.remaining < 0:
+            raise HTTPError(400, "Content-Length must be a non-negative integer")
+        if self.remaining > MAX_BODY_BYTES:
+            raise HTTPError(413, f"Body larger than {MAX_BODY_BYTES} bytes")
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    async def read_body(self):
+        body = await self.reader.readexactly(self.remaining) if self.remaining else b""
+        self.remaining = 0
+        return body
+
+    async def json(self):
+        try:
+            return json.loads(await self.read_body() or b"null")
+        except ValueError as e:
+            raise HTTPError(400, f"Invalid JSON: {e}")
+
+    async def iter_lines(self):
+        # Body lines read incrementally, so an NDJSON upload is never held
+        # in memory as a whole
+        while self.remaining > 0:
+            line = await self.reader.readline()
+            if not line:
+                break
+            self.remaining -= len(line)
+            if line.strip():
+                yield line
+
+    async def drain(self):
+        # Discard an unread body so the connection can be reused
+        while self.remaining > 0:
+            chunk = await self.reader.read(min(self.remaining, 65536))
+            if not chunk:
+                break
+            self.remaining -= len(chunk)
+
+
+class StreamResponse:
+    # Chunked response body: an async iterator of byte chunks and its headers
+    def __init__(self, chunks, content_type="application/x-ndjson", headers=None):
+        self.chunks = chunks
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+def _household(payload, allow_extra=False):
+    # Validates one household at the boundary: unknown or misspelt keys and
+    # bad values are a 400. Batch records may carry extra columns such as
+    # household_id, which are passed through.
+    if not isinstance(payload, dict):
+        raise HTTPError(400, "Expected a JSON object with household inputs")
+    try:
+        HouseholdInputs.from_dict(payload, allow_extra=allow_extra)
+    except (TypeError, ValueError) as e:
+        raise HTTPError(400, f"Invalid household inputs: {e}")
+    return payload
+
+def _calculate(household):
+    breakdown, percentages, highest_source = result_cache.cached_calculate(household)
+    return {"breakdown": breakdown, "percentages": percentages, "highest_source": highest_source}
+
+def _save_report(store, household):
+    # The report the app saves: breakdown, percentages and highest source
+    report = result_cache.cached_report(household)
+    saved = {
+        "breakdown": report["breakdown"],
+        "percentages": report["percentages"],
+        "highest_source": report["highest_source"],
+        "timestamp": str(datetime.now()),
+    }
+    store.save(saved)
+    return {"saved": True, "timestamp": saved["timestamp"]}
+
+def _profiled(fn, household):
+    # Runs on the worker pool, so the profile covers the actual work
+    with metrics.profiled() as profile:
+        result = fn(household)
+    return dict(result, profile=profile["stats"])
+
+def _score_chunk(records, with_advice):
+    # Runs on the worker pool: scores a chunk of households in one vectorized
+    # pass and serialises it as NDJSON
+    names, rows = score_columns(records_to_columns(records), len(records))
+    lines = []
+    for record, values in zip(records, rows):
+        result = dict(zip(names, values))
+        if with_advice:
+            report = result_cache.cached_report(record)
+            result.update(explanation=report["explanation"], advice=report["advice"], steps=report["steps"])
+        lines.append(json.dumps(result))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class CarbonAPI:
+    def __init__(self, workers=4, db_path=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cfa-api")
+        self.coalesced = 0
+        self.db_path = db_path
+        self._inflight = {}
+        # Open client connection -> the task serving it
+        self._connections = {}
+        self._store = None
+        self._store_lock = threading.Lock()
+        self.routes = {
+            ("GET", "/health"): self.health,
+            ("GET", "/metrics"): self.metrics_text,
+            ("POST", "/calculate"): self.calculate,
+            ("POST", "/report"): self.report,
+            ("POST", "/batch"): self.batch,
+            ("POST", "/save"): self.save,
+            ("GET", "/export"): self.export,
+        }
+
+    async def run_in_pool(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def coalesce(self, kind, fn, household):
+        # Requests for the same normalized inputs share one in-flight future
+        key = (kind, result_cache.input_key(result_cache.normalize_inputs(household)))
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.run_in_pool(fn, household))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # shield: one client disconnecting must not cancel it for the others
+        return await asyncio.shield(future)
+
+    async def health(self, request):
+        return {"status": "ok", "coalesced": self.coalesced, "cache": result_cache.cache_stats()}
+
+    async def metrics_text(self, request):
+        return metrics.render()
+
+    async def run_request(self, request, kind, fn):
+        household = _household(await request.json())
+        with metrics.timed(f"api.{kind}"):
+            if request.query.get("profile") in ("1", "true"):
+                return await self.run_in_pool(_profiled, fn, household)
+            return await self.coalesce(kind, fn, household)
+
+    async def calculate(self, request):
+        return await self.run_request(request, "calculate", _calculate)
+
+    async def report(self, request):
+        return await self.run_request(request, "report", result_cache.cached_report)
+
+    def store(self):
+        # The report store is opened on the first save, on a pool thread:
+        # opening SQLite (and backfilling its sketches) can block
+        with self._store_lock:
+            if self._store is None:
+                from report_store import DEFAULT_DB_PATH, ReportStore
+
+                self._store = ReportStore(self.db_path or DEFAULT_DB_PATH)
+            return self._store
+
+    async def save(self, request):
+        household = _household(await request.json())
+        with metrics.timed("api.save"):
+            return await self.run_in_pool(lambda: _save_report(self.store(), household))
+
+    async def batch(self, request):
+        with_advice = request.query.get("advice") in ("1", "true")
+        content_type = request.headers.get("content-type", "")
+
+        if "ndjson" in content_type or "jsonl" in content_type:
+            async def records():
+                chunk = []
+                async for line in request.iter_lines():
+                    try:
+                        chunk.append(_household(json.loads(line), allow_extra=True))
+                    except ValueError as e:
+                        raise HTTPError(400, f"Invalid JSON line: {e}")
+                    if len(chunk) >= BATCH_CHUNK_SIZE:
+                        yield chunk
+                        chunk = []
+                if chunk:
+                    yield chunk
+        else:
+            payload = await request.json()
+            if not isinstance(payload, list):
+                raise HTTPError(400, "Expected a JSON array of households (or an NDJSON body)")
+            households = [_household(record, allow_extra=True) for record in payload]
+
+            async def records():
+                for start in range(0, len(households), BATCH_CHUNK_SIZE):
+                    yield households[start:start + BATCH_CHUNK_SIZE]
+
+        async def stream():
+            async for chunk in records():
+                metrics.inc("api_batch_households", len(chunk))
+                with metrics.timed("api.batch_chunk"):
+                    lines = await self.run_in_pool(_score_chunk, chunk, with_advice)
+                yield lines
+
+        return StreamResponse(stream())
+
+    async def export(self, request):
+        # Streams the export one batch at a time: each chunk is queried and
+        # encoded on the pool, so memory stays constant whatever the range
+        import export
+
+        fmt = request.query.get("format", "csv")
+        compress = request.query.get("gzip") in ("1", "true")
+        start, end = request.query.get("start"), request.query.get("end")
+        highest_source = request.query.get("highest_source")
+        if fmt not in ("csv", "ndjson"):
+            raise HTTPError(400, "format must be csv or ndjson (write parquet with src/export.py)")
+        if highest_source is not None and highest_source not in export.CATEGORIES:
+            raise HTTPError(400, f"Unknown highest_source {highest_source!r}")
+        store = await self.run_in_pool(self.store)
+        chunks = export.iter_export(fmt, compress, store=store, start=start, end=end, highest_source=highest_source)
+
+        async def stream():
+            try:
+                while True:
+                    chunk = await self.run_in_pool(next, chunks, None)
+                    if chunk is None:
+                        return
+                    metrics.inc("api_export_bytes", len(chunk))
+                    yield chunk
+            finally:
+                await self.run_in_pool(chunks.close)
+
+        filename = export.export_filename(fmt, compress, start, end)
+        return StreamResponse(
+            stream(),
+            content_type="application/gzip" if compress else export.MIME_TYPES[fmt],
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+    async def handle(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    return
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line in (b"\r\n", b"\n", b""):
+                            break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                    request = Request(method, target, version, headers, reader)
+                except HTTPError as e:
+                    await self.respond(writer, e.status, {"error": e.message}, keep_alive=False)
+                    return
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "Malformed request"}, keep_alive=False)
+                    return
+
+                if not await self.dispatch(request, writer):
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def close_connections(self):
+        # Closes every client connection and waits for their handlers: idle
+        # keep-alive handlers see end-of-stream and return, busy ones finish
+        # their request first
+        tasks = list(self._connections.values())
+        for writer in list(self._connections):
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def dispatch(self, request, writer):
+        # Returns whether the connection can serve another request
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            known = any(path == request.path for _, path in self.routes)
+            status = 405 if known else 404
+            await request.drain()
+            await self.respond(writer, status, {"error": STATUS_TEXT[status]}, request.keep_alive)
+            return request.keep_alive
+
+        if request.method == "POST" and "content-length" not in request.headers:
+            await self.respond(writer, 411, {"error": "Content-Length required"}, keep_alive=False)
+            return False
+
+        try:
+            result = await handler(request)
+            if isinstance(result, StreamResponse):
+                return await self.stream(writer, result, request)
+            await request.drain()
+            await self.respond(writer, 200, result, request.keep_alive)
+        except HTTPError as e:
+            await request.drain()
+            await self.respond(writer, e.status, {"error": e.message}, request.keep_alive)
+        except Exception as e:
+            await self.respond(writer, 500, {"error": str(e)}, keep_alive=False)
+            return False
+        return request.keep_alive
+
+    async def respond(self, writer, status, payload, keep_alive=True):
+        # Handlers return JSON-serialisable objects, or a str for plain text
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    async def stream(self, writer, response, request):
+        # Chunked response. The first chunk is computed before the headers go
+        # out so input errors can still become a 400.
+        iterator = response.chunks.__aiter__()
+        try:
+            try:
+                first = await iterator.__anext__()
+            except StopAsyncIteration:
+                first = b""
+            except HTTPError as e:
+                await request.drain()
+                await self.respond(writer, e.status, {"error": e.message}, request.keep_alive)
+                return request.keep_alive
+
+            headers = {
+                "Content-Type": response.content_type,
+                **response.headers,
+                "Transfer-Encoding": "chunked",
+                "Connection": "keep-alive" if request.keep_alive else "close",
+            }
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                + "".join(f"{name}: {value}\r\n" for name, value in headers.items()).encode("latin-1")
+                + b"\r\n"
+            )
+            try:
+                chunk = first
+                while True:
+                    if chunk:
+                        writer.write(f"{len(chunk):x}\r\n".encode("latin-1") + chunk + b"\r\n")
+                        await writer.drain()
+                    try:
+                        chunk = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+            except Exception as e:
+                # Too late for a status code: report the error in-band and stop
+                line = (json.dumps({"error": getattr(e, "message", str(e))}) + "\n").encode("utf-8")
+                writer.write(f"{len(line):x}\r\n".encode("latin-1") + line + b"\r\n")
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+                return False
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+            return request.keep_alive
+        finally:
+            # A client that disconnects mid-stream must not leave the
+            # source (e.g. an export's query cursor) open
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+
+
+async def serve(host="127.0.0.1", port=8080, workers=4, db_path=None):
+    api = CarbonAPI(workers=workers, db_path=db_path)
+    server = await asyncio.start_server(api.handle, host, port)
+    print(f"Carbon Footprint API listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local HTTP API for the carbon calculator and agent.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=4, help="worker threads for calculation and retrieval")
+    parser.add_argument("--db", help="report store for POST /save and GET /export (default: outputs/reports.db)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.db))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
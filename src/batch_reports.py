@@ -0,0 +1,219 @@
+# src/batch_reports.py
+#
+# Full reports (breakdown, explanation, advice and actionable steps) for every
+# household in a CSV/NDJSON file, spread over a process pool. The input is
+# read in chunks; each chunk becomes one output shard, written by the worker
+# under a temporary name and renamed into place, so a shard on disk is always
+# complete. checkpoint.json in the output directory records finished shards,
+# and rerunning the same command after a crash or Ctrl-C skips them.
+#
+# The knowledge-base index is built in the parent before the pool starts;
+# with the fork start method the workers inherit it copy-on-write instead of
+# each reading rag_docs/ (set CFA_KB_SNAPSHOT to share a mapped snapshot
+# where fork is unavailable).
+#
+#   python src/batch_reports.py data/sample_inputs.csv outputs/reports/
+#   python src/batch_reports.py households.ndjson.gz outputs/reports/ --workers 8 --compress
+#   python src/batch_reports.py households.csv outputs/reports/ --restart
+
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import agent
+from calculator import CATEGORIES
+from stream_calculator import RESULT_COLUMNS, detect_format, iter_chunks, open_text, rows_to_columns, score_columns
+
+DEFAULT_CHUNK_SIZE = 5000
+CHECKPOINT_NAME = "checkpoint.json"
+_BREAKDOWN_KEYS = CATEGORIES + ["monthly_total", "yearly_total"]
+
+
+def shard_name(index, compress=False):
+    return f"reports-{index:05d}.ndjson" + (".gz" if compress else "")
+
+def build_report(breakdown, percentages, highest_source):
+    return {
+        "breakdown": breakdown,
+        "percentages": percentages,
+        "highest_source": highest_source,
+        "explanation": agent.explain_decision(breakdown, percentages, highest_source),
+        "advice": agent.generate_advice(breakdown, percentages, highest_source),
+        "steps": agent.generate_actionable_steps(breakdown, percentages, highest_source),
+    }
+
+def report_rows(fmt, header, rows):
+    # Scores a chunk in one vectorized pass, then builds each household's
+    # report. Passthrough columns (e.g. household_id) are kept at the top level.
+    names, results = score_columns(rows_to_columns(fmt, header, rows), len(rows))
+    position = {name: i for i, name in enumerate(names)}
+    passthrough = names[:len(names) - len(RESULT_COLUMNS)]
+    for values in results:
+        breakdown = {key: values[position[key]] for key in _BREAKDOWN_KEYS}
+        percentages = {category: values[position[f"{category}_pct"]] for category in CATEGORIES}
+        report = {name: values[position[name]] for name in passthrough}
+        report.update(build_report(breakdown, percentages, values[position["highest_source"]]))
+        yield report
+
+def write_shard(index, fmt, header, rows, output_dir, compress):
+    # Worker entry point: renders one chunk to its shard. Returns
+    # (index, rows written).
+    path = os.path.join(output_dir, shard_name(index, compress))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(tmp_path, "wt", encoding="utf-8") as f:
+        for report in report_rows(fmt, header, rows):
+            f.write(json.dumps(report))
+            f.write("\n")
+            count += 1
+    os.replace(tmp_path, path)
+    return index, count
+
+
+def _input_signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def load_checkpoint(output_dir, settings):
+    # Finished shard index -> row count, or {} for a fresh run. A checkpoint
+    # left by a run with a different input or chunking cannot be resumed.
+    path = os.path.join(output_dir, CHECKPOINT_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if checkpoint.get("settings") != settings:
+        raise ValueError(
+            f"{path} belongs to a different run (input, chunk size or compression changed); "
+            "use --restart to start over"
+        )
+    return {int(index): count for index, count in checkpoint["done"].items()}
+
+def save_checkpoint(output_dir, settings, done, finished=False):
+    path = os.path.join(output_dir, CHECKPOINT_NAME)
+    checkpoint = {
+        "settings": settings,
+        "done": {str(index): count for index, count in sorted(done.items())},
+        "rows": sum(done.values()),
+        "finished": finished,
+    }
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+def _init_worker():
+    # Under fork this finds the parent's index already built; under spawn
+    # each worker builds (or maps) its own once
+    agent.get_knowledge_index().snapshot()
+
+def _pool_context():
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+def generate_reports(input_path, output_dir, chunk_size=DEFAULT_CHUNK_SIZE, workers=None, compress=False,
+                     restart=False, checkpoint_interval=5.0, progress=None):
+    # Writes one shard per chunk of input_path into output_dir and returns
+    # (rows written by this run, rows skipped as already done).
+    # progress(rows_done, rows_skipped, shards_done) is called as shards finish.
+    fmt = detect_format(input_path)
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    settings = {
+        "input": os.path.abspath(input_path),
+        "signature": _input_signature(input_path),
+        "chunk_size": chunk_size,
+        "compress": compress,
+    }
+    if restart:
+        for name in os.listdir(output_dir):
+            if name == CHECKPOINT_NAME or name.startswith("reports-"):
+                os.remove(os.path.join(output_dir, name))
+    done = load_checkpoint(output_dir, settings)
+    skipped = sum(done.values())
+    written = 0
+    last_checkpoint = time.monotonic()
+
+    def finished(index, count):
+        nonlocal written, last_checkpoint
+        done[index] = count
+        written += count
+        if time.monotonic() - last_checkpoint >= checkpoint_interval:
+            save_checkpoint(output_dir, settings, done)
+            last_checkpoint = time.monotonic()
+        if progress:
+            progress(written, skipped, len(done))
+
+    agent.get_knowledge_index().snapshot()
+    with open_text(input_path, "r") as src:
+        chunks = (
+            (index, header, rows)
+            for index, (header, rows) in enumerate(iter_chunks(src, fmt, chunk_size))
+            if index not in done
+        )
+        try:
+            if workers <= 1:
+                for index, header, rows in chunks:
+                    finished(*write_shard(index, fmt, header, rows, output_dir, compress))
+            else:
+                # At most 2 chunks per worker in flight; shards are
+                # independent, so they are recorded in completion order
+                with ProcessPoolExecutor(workers, mp_context=_pool_context(), initializer=_init_worker) as pool:
+                    pending = set()
+                    for index, header, rows in chunks:
+                        pending.add(pool.submit(write_shard, index, fmt, header, rows, output_dir, compress))
+                        if len(pending) >= workers * 2:
+                            completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in completed:
+                                finished(*future.result())
+                    for future in wait(pending).done:
+                        finished(*future.result())
+        finally:
+            # Also on failure or KeyboardInterrupt, so a rerun resumes from
+            # every shard that did complete
+            save_checkpoint(output_dir, settings, done)
+    save_checkpoint(output_dir, settings, done, finished=True)
+    return written, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate full reports for every household in a file.")
+    parser.add_argument("input", help="household file (.csv, .ndjson or .jsonl, optionally .gz)")
+    parser.add_argument("output_dir", help="directory for reports-NNNNN.ndjson shards and checkpoint.json")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="households per shard")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    parser.add_argument("--compress", action="store_true", help="gzip the shards")
+    parser.add_argument("--restart", action="store_true", help="discard existing shards and checkpoint")
+    parser.add_argument("--checkpoint-interval", type=float, default=5.0, help="seconds between checkpoints")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+
+    def report(written, skipped, shards):
+        elapsed = time.perf_counter() - start
+        print(
+            f"\r{written + skipped} reports ({skipped} resumed), {shards} shards, "
+            f"{written / max(elapsed, 1e-9):.0f} reports/s",
+            end="", file=sys.stderr,
+        )
+
+    written, skipped = generate_reports(
+        args.input, args.output_dir, args.chunk_size, args.workers, args.compress,
+        args.restart, args.checkpoint_interval, progress=report,
+    )
+    print(
+        f"\nWrote {written} reports in {time.perf_counter() - start:.2f}s "
+        f"({skipped} already done) -> {args.output_dir}",
+        file=sys.stderr,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+# src/benchmark.py
+#
+# Benchmark suite for the hot paths: calculate_total_co2 (scalar and batch),
+# simple_retrieve / generate_advice over synthetic knowledge bases of
+# 10, 1k and 100k lines, and saving reports to the report store.
+#
+# Results are written as JSON. Given a baseline (an earlier results file),
+# any benchmark whose median time per operation is slower than the baseline
+# by more than --threshold is reported and the run exits with status 1.
+#
+#   python src/benchmark.py --output outputs/benchmarks.json
+#   python src/benchmark.py --save-baseline            # record a baseline
+#   python src/benchmark.py --baseline outputs/benchmark_baseline.json
+#   python src/benchmark.py --filter retrieve --quick
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime
+
+import numpy as np
+
+import agent
+import calculator
+from kb_index import KnowledgeIndex
+from report_store import ReportStore
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_OUTPUT = os.path.join(BASE_DIR, "outputs", "benchmarks.json")
+DEFAULT_BASELINE = os.path.join(BASE_DIR, "outputs", "benchmark_baseline.json")
+DEFAULT_THRESHOLD = 0.25
+
+KB_SIZES = (10, 1000, 100000)
+KB_LINES_PER_FILE = 10000
+BATCH_SIZE = 100000
+REPORT_COUNT = 20000
+
+SAMPLE_INPUTS = {
+    "electricity_kwh": 250,
+    "petrol_liters": 40,
+    "diesel_liters": 0,
+    "bus_km": 120,
+    "train_km": 60,
+    "flight_km": 300,
+    "diet": "nonveg",
+    "plastic_kg": 3,
+    "ewaste_kg": 0.5,
+    "water_m3": 12,
+    "days": 30,
+}
+
+FILLER_WORDS = (
+    "reduce save switch home daily weekly monthly habit simple small change use less more "
+    "local season energy-efficient family community cost bill impact footprint carbon green"
+).split()
+
+
+def synthetic_households(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        "electricity_kwh": rng.uniform(50, 600, n),
+        "petrol_liters": rng.uniform(0, 120, n),
+        "diesel_liters": rng.uniform(0, 40, n),
+        "bus_km": rng.uniform(0, 400, n),
+        "train_km": rng.uniform(0, 600, n),
+        "flight_km": rng.uniform(0, 2000, n),
+        "diet": np.where(rng.random(n) < 0.5, "veg", "nonveg"),
+        "plastic_kg": rng.uniform(0, 10, n),
+        "ewaste_kg": rng.uniform(0, 2, n),
+        "water_m3": rng.uniform(2, 30, n),
+        "days": np.full(n, 30.0),
+    }
+
+def write_synthetic_kb(directory, lines, seed=0):
+    # Tip-like lines mixing the agent's search keywords with filler words,
+    # split across files of at most KB_LINES_PER_FILE lines
+    rng = random.Random(seed)
+    keywords = [keyword for terms in agent.KEYWORD_MAP.values() for keyword in terms]
+    for start in range(0, lines, KB_LINES_PER_FILE):
+        count = min(KB_LINES_PER_FILE, lines - start)
+        with open(os.path.join(directory, f"kb_{start // KB_LINES_PER_FILE:04d}.txt"), "w", encoding="utf-8") as f:
+            for i in range(count):
+                words = rng.sample(FILLER_WORDS, rng.randint(6, 14)) + rng.sample(keywords, rng.randint(1, 3))
+                rng.shuffle(words)
+                f.write(f"Tip {start + i}: {' '.join(words).capitalize()}.\n")
+
+
+def measure(fn, repeat, min_time=0.2):
+    # Per-operation timings (seconds) over `repeat` runs of a loop sized so
+    # each run takes at least min_time
+    timer = timeit.Timer(fn)
+    number, elapsed = 1, 0.0
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    runs = [elapsed] + timer.repeat(repeat - 1, number)
+    per_op = [run / number for run in runs]
+    return {
+        "number": number,
+        "repeat": repeat,
+        "best_s": min(per_op),
+        "median_s": statistics.median(per_op),
+    }
+
+def measure_once(fn, repeat):
+    # For benchmarks with expensive per-run setup: fn() does the setup and
+    # returns (elapsed seconds, operations) for the timed part
+    per_op = []
+    for _ in range(repeat):
+        elapsed, operations = fn()
+        per_op.append(elapsed / operations)
+    return {
+        "number": operations,
+        "repeat": repeat,
+        "best_s": min(per_op),
+        "median_s": statistics.median(per_op),
+    }
+
+
+def bench_calculator(quick):
+    batch_size = BATCH_SIZE // 10 if quick else BATCH_SIZE
+    households = synthetic_households(batch_size)
+    scalar_inputs = [
+        {key: (values[i].item() if key != "diet" else str(values[i])) for key, values in households.items()}
+        for i in range(1000)
+    ]
+
+    yield "calculate_total_co2", {}, lambda: calculator.calculate_total_co2(SAMPLE_INPUTS), None
+    yield (
+        "calculate_total_co2_loop",
+        {"households": len(scalar_inputs)},
+        lambda: [calculator.calculate_total_co2(inputs) for inputs in scalar_inputs],
+        len(scalar_inputs),
+    )
+    yield (
+        "calculate_total_co2_batch",
+        {"households": batch_size},
+        lambda: calculator.calculate_total_co2_batch(households),
+        batch_size,
+    )
+
+def bench_knowledge_base(workdir, quick):
+    sizes = KB_SIZES[:2] if quick else KB_SIZES
+    previous = agent.get_knowledge_index()
+    breakdown, percentages, highest = calculator.calculate_total_co2(SAMPLE_INPUTS)
+    try:
+        for lines in sizes:
+            directory = os.path.join(workdir, f"kb_{lines}")
+            os.makedirs(directory)
+            write_synthetic_kb(directory, lines)
+
+            def build(directory=directory):
+                start = time.perf_counter()
+                KnowledgeIndex(directory).refresh(force=True)
+                return time.perf_counter() - start, 1
+
+            yield "knowledge_index_build", {"lines": lines}, build, "once"
+
+            index = KnowledgeIndex(directory, check_interval=float("inf"))
+            index.refresh(force=True)
+            agent.set_knowledge_index(index)
+            terms = agent.KEYWORD_MAP["transport"]
+            yield "simple_retrieve", {"lines": lines}, lambda: agent.simple_retrieve(terms), None
+            yield "ranked_retrieve", {"lines": lines}, lambda: agent.ranked_retrieve(terms), None
+            yield (
+                "generate_advice",
+                {"lines": lines},
+                lambda: agent.generate_advice(breakdown, percentages, highest),
+                None,
+            )
+            yield (
+                "generate_advice_sampled",
+                {"lines": lines},
+                lambda: agent.generate_advice(breakdown, percentages, highest, ranked=False),
+                None,
+            )
+    finally:
+        agent.set_knowledge_index(previous)
+
+def bench_report_store(workdir, quick):
+    count = REPORT_COUNT // 10 if quick else REPORT_COUNT
+    households = synthetic_households(count, seed=1)
+    breakdown, percentages, highest = calculator.calculate_total_co2_batch(households)
+    timestamp = str(datetime.now())
+    reports = [
+        {
+            "breakdown": {key: float(values[i]) for key, values in breakdown.items()},
+            "percentages": {key: float(values[i]) for key, values in percentages.items()},
+            "highest_source": str(highest[i]),
+            "timestamp": timestamp,
+        }
+        for i in range(count)
+    ]
+    runs = [0]
+
+    def save_all():
+        runs[0] += 1
+        store = ReportStore(os.path.join(workdir, f"reports_{runs[0]}.db"), flush_interval=60)
+        try:
+            start = time.perf_counter()
+            for report in reports:
+                store.save(report)
+            store.flush(force=True)
+            return time.perf_counter() - start, count
+        finally:
+            store.close()
+
+    yield "report_store_save", {"reports": count}, save_all, "once"
+
+    store = ReportStore(os.path.join(workdir, "reports_query.db"), flush_interval=60)
+    for report in reports:
+        store.save(report)
+    store.flush(force=True)
+    yield "report_store_percentiles", {"reports": count}, lambda: store.percentiles(reports[0]["breakdown"]), None
+    yield (
+        "report_store_query",
+        {"reports": count, "highest_source": "transport"},
+        lambda: sum(1 for _ in store.query(highest_source="transport", limit=1000)),
+        None,
+    )
+    store.close()
+
+
+def benchmark_key(result):
+    params = ",".join(f"{key}={value}" for key, value in sorted(result["params"].items()))
+    return f"{result['name']}[{params}]" if params else result["name"]
+
+def run(name_filter=None, repeat=5, quick=False, log=None):
+    workdir = tempfile.mkdtemp(prefix="cfa-bench-")
+    results = []
+    try:
+        suites = (
+            bench_calculator(quick),
+            bench_knowledge_base(workdir, quick),
+            bench_report_store(workdir, quick),
+        )
+        for suite in suites:
+            for name, params, fn, operations in suite:
+                if name_filter and name_filter not in name:
+                    continue
+                if operations == "once":
+                    timing = measure_once(fn, repeat)
+                else:
+                    timing = measure(fn, repeat)
+                    # Loops over many items are reported per item
+                    if operations:
+                        timing["best_s"] /= operations
+                        timing["median_s"] /= operations
+                result = {"name": name, "params": params, **timing}
+                result["ops_per_s"] = 1.0 / result["median_s"] if result["median_s"] else None
+                results.append(result)
+                if log:
+                    log(result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "numpy": np.__version__,
+        },
+        "quick": quick,
+        "results": results,
+    }
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    # Benchmarks slower than the baseline by more than threshold, as
+    # (key, baseline median, current median, relative change)
+    previous = {benchmark_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        key = benchmark_key(result)
+        if key not in previous:
+            continue
+        before, after = previous[key]["median_s"], result["median_s"]
+        change = (after - before) / before if before else 0.0
+        if change > threshold:
+            regressions.append((key, before, after, change))
+    return regressions
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f} {unit}"
+    return f"{seconds / 1e-9:.1f} ns"
+
+def write_json(path, payload):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the calculator, retrieval, advice and report store.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="results JSON file")
+    parser.add_argument("--baseline", help="compare against this results file (default: the saved baseline, if any)")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown vs. the baseline (0.25 = 25%%)")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="smaller inputs, skips the 100k-line knowledge base")
+    args = parser.parse_args(argv)
+
+    def log(result):
+        print(f"{benchmark_key(result):60} {format_time(result['median_s']):>12}  (best {format_time(result['best_s'])})")
+
+    results = run(args.filter, args.repeat, args.quick, log)
+    write_json(args.output, results)
+    print(f"\nResults written to {args.output}")
+
+    baseline_path = args.baseline or (DEFAULT_BASELINE if os.path.exists(DEFAULT_BASELINE) else None)
+    if args.save_baseline:
+        write_json(DEFAULT_BASELINE if args.baseline is None else args.baseline, results)
+        print("Baseline saved")
+        return 0
+    if baseline_path is None:
+        return 0
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline.get("quick") != results["quick"]:
+        print(f"Baseline {baseline_path} was recorded with quick={baseline.get('quick')}; not comparing")
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    if not regressions:
+        print(f"No regressions beyond {args.threshold:.0%} against {baseline_path}")
+        return 0
+    print(f"Regressions beyond {args.threshold:.0%} against {baseline_path}:")
+    for key, before, after, change in regressions:
+        print(f"  {key}: {format_time(before)} -> {format_time(after)} (+{change:.0%})")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,84 +1,324 @@
 # src/calculator.py
 
-EMISSION_FACTORS = {
-    "electricity_kwh": 0.82,   # kg CO2 per kWh (India)
-    "petrol_liter": 2.31,
-    "diesel_liter": 2.68,
-    "lpg_kg": 2.98,
-    "cng_kg": 2.75,
-    "bus_km": 0.05,
-    "train_km": 0.01,
-    "flight_km": 0.15,
-    "veg_day": 2.0,
-    "nonveg_day": 5.0,
-    "plastic_kg": 6.0,
-    "ewaste_kg": 20.0,
-    "water_m3": 0.34
+import numpy as np
+
+import metrics
+
+# Emission factors are versioned per region in
+# data/emission_factors/<REGION>/<YYYY-MM-DD>.json and served by
+# factor_registry.py, which reloads changed files without a restart. Scoring
+# uses the default region's table in effect today unless a region (and date)
+# is given; calculator.EMISSION_FACTORS reads as a copy of that table.
+
+def active_table(region=None, on=None):
+    # The registry's FactorTable for region (default: the default region) in
+    # effect on the given date (default: today)
+    import factor_registry
+    return factor_registry.get_registry().get(region or factor_registry.DEFAULT_REGION, on)
+
+def __getattr__(name):
+    if name == "EMISSION_FACTORS":
+        return dict(active_table().factors)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Keys understood by calculate_total_co2 and the defaults it applies when a
+# key is missing
+INPUT_DEFAULTS = {
+    "electricity_kwh": 0,
+    "petrol_liters": 0,
+    "diesel_liters": 0,
+    "bus_km": 0,
+    "train_km": 0,
+    "flight_km": 0,
+    "diet": "veg",
+    "plastic_kg": 0,
+    "ewaste_kg": 0,
+    "water_m3": 0,
+    "days": 30
 }
 
-def calculate_electricity_co2(kwh):
-    return kwh * EMISSION_FACTORS["electricity_kwh"]
+# Each helper takes an optional factor dict (default: the active table)
 
-def calculate_transport_co2(petrol=0, diesel=0, bus_km=0, train_km=0, flight_km=0):
+def calculate_electricity_co2(kwh, factors=None):
+    factors = factors or active_table().factors
+    return kwh * factors["electricity_kwh"]
+
+def calculate_transport_co2(petrol=0, diesel=0, bus_km=0, train_km=0, flight_km=0, factors=None):
+    factors = factors or active_table().factors
     return (
-        petrol * EMISSION_FACTORS["petrol_liter"]
-        + diesel * EMISSION_FACTORS["diesel_liter"]
-        + bus_km * EMISSION_FACTORS["bus_km"]
-        + train_km * EMISSION_FACTORS["train_km"]
-        + flight_km * EMISSION_FACTORS["flight_km"]
+        petrol * factors["petrol_liter"]
+        + diesel * factors["diesel_liter"]
+        + bus_km * factors["bus_km"]
+        + train_km * factors["train_km"]
+        + flight_km * factors["flight_km"]
     )
 
-def calculate_food_co2(diet_type, days=30):
+def calculate_food_co2(diet_type, days=30, factors=None):
+    factors = factors or active_table().factors
     if diet_type.lower() == "veg":
-        return days * EMISSION_FACTORS["veg_day"]
+        return days * factors["veg_day"]
     else:
-        return days * EMISSION_FACTORS["nonveg_day"]
+        return days * factors["nonveg_day"]
 
-def calculate_waste_co2(plastic_kg=0, ewaste_kg=0):
+def calculate_waste_co2(plastic_kg=0, ewaste_kg=0, factors=None):
+    factors = factors or active_table().factors
     return (
-        plastic_kg * EMISSION_FACTORS["plastic_kg"]
-        + ewaste_kg * EMISSION_FACTORS["ewaste_kg"]
+        plastic_kg * factors["plastic_kg"]
+        + ewaste_kg * factors["ewaste_kg"]
     )
 
-def calculate_water_co2(water_m3=0):
-    return water_m3 * EMISSION_FACTORS["water_m3"]
+def calculate_water_co2(water_m3=0, factors=None):
+    factors = factors or active_table().factors
+    return water_m3 * factors["water_m3"]
 
-def calculate_total_co2(user_inputs):
-    electricity = calculate_electricity_co2(user_inputs.get("electricity_kwh", 0))
+def score_household(electricity_kwh=0, petrol_liters=0, diesel_liters=0, bus_km=0, train_km=0,
+                    flight_km=0, diet="veg", plastic_kg=0, ewaste_kg=0, water_m3=0, days=30, factors=None):
+    # Core of calculate_total_co2 on plain values. Returns the breakdown values
+    # in BREAKDOWN_KEYS order, the percentages in CATEGORIES order and the
+    # highest source; calculate_total_co2 and records.calculate wrap it.
+    factors = factors or active_table().factors
+    electricity = calculate_electricity_co2(electricity_kwh, factors)
     transport = calculate_transport_co2(
-        petrol=user_inputs.get("petrol_liters", 0),
-        diesel=user_inputs.get("diesel_liters", 0),
-        bus_km=user_inputs.get("bus_km", 0),
-        train_km=user_inputs.get("train_km", 0),
-        flight_km=user_inputs.get("flight_km", 0)
-    )
-    food = calculate_food_co2(user_inputs.get("diet", "veg"), user_inputs.get("days", 30))
-    waste = calculate_waste_co2(
-        plastic_kg=user_inputs.get("plastic_kg", 0),
-        ewaste_kg=user_inputs.get("ewaste_kg", 0)
+        petrol=petrol_liters,
+        diesel=diesel_liters,
+        bus_km=bus_km,
+        train_km=train_km,
+        flight_km=flight_km,
+        factors=factors
     )
-    water = calculate_water_co2(user_inputs.get("water_m3", 0))
+    food = calculate_food_co2(diet, days, factors)
+    waste = calculate_waste_co2(plastic_kg=plastic_kg, ewaste_kg=ewaste_kg, factors=factors)
+    water = calculate_water_co2(water_m3, factors)
 
     monthly_total = electricity + transport + food + waste + water
     yearly_total = monthly_total * 12
 
-    breakdown = {
-        "electricity": round(electricity, 2),
-        "transport": round(transport, 2),
-        "food": round(food, 2),
-        "waste": round(waste, 2),
-        "water": round(water, 2),
-        "monthly_total": round(monthly_total, 2),
-        "yearly_total": round(yearly_total, 2)
-    }
-
-    percentages = {}
-    for key in ["electricity", "transport", "food", "waste", "water"]:
-        if monthly_total > 0:
-            percentages[key] = round((breakdown[key] / monthly_total) * 100, 2)
+    values = (
+        round(electricity, 2),
+        round(transport, 2),
+        round(food, 2),
+        round(waste, 2),
+        round(water, 2),
+        round(monthly_total, 2),
+        round(yearly_total, 2)
+    )
+
+    if monthly_total > 0:
+        shares = [round((value / monthly_total) * 100, 2) for value in values[:5]]
+    else:
+        shares = [0, 0, 0, 0, 0]
+
+    # First category with the largest share, as max() over the dict did
+    highest = shares.index(max(shares))
+
+    return values, shares, CATEGORIES[highest]
+
+@metrics.instrument("calculator.calculate_total_co2")
+def calculate_total_co2(user_inputs, region=None, on=None):
+    # region/on select the factor table (default: default region, today)
+    values, shares, highest_source = score_household(
+        user_inputs.get("electricity_kwh", 0),
+        user_inputs.get("petrol_liters", 0),
+        user_inputs.get("diesel_liters", 0),
+        user_inputs.get("bus_km", 0),
+        user_inputs.get("train_km", 0),
+        user_inputs.get("flight_km", 0),
+        user_inputs.get("diet", "veg"),
+        user_inputs.get("plastic_kg", 0),
+        user_inputs.get("ewaste_kg", 0),
+        user_inputs.get("water_m3", 0),
+        user_inputs.get("days", 30),
+        active_table(region, on).factors
+    )
+    breakdown = dict(zip(BREAKDOWN_KEYS, values))
+    percentages = dict(zip(CATEGORIES, shares))
+    return breakdown, percentages, highest_source
+
+# -----------------------------------------------------------------------------
+# Batch (columnar) API
+# -----------------------------------------------------------------------------
+# The scalar helpers above are applied one household at a time. For large runs
+# the same factors are laid out as a coefficient matrix: one row per input
+# feature, one column per category, so scoring N households is a single
+# (N x features) @ (features x categories) product.
+
+CATEGORIES = ["electricity", "transport", "food", "waste", "water"]
+BREAKDOWN_KEYS = CATEGORIES + ["monthly_total", "yearly_total"]
+
+# (feature, factor key, category) - feature order defines the matrix rows.
+# Diet is split into veg/non-veg day counts so food becomes linear as well.
+FEATURES = [
+    ("electricity_kwh", "electricity_kwh", "electricity"),
+    ("petrol_liters", "petrol_liter", "transport"),
+    ("diesel_liters", "diesel_liter", "transport"),
+    ("bus_km", "bus_km", "transport"),
+    ("train_km", "train_km", "transport"),
+    ("flight_km", "flight_km", "transport"),
+    ("veg_days", "veg_day", "food"),
+    ("nonveg_days", "nonveg_day", "food"),
+    ("plastic_kg", "plastic_kg", "waste"),
+    ("ewaste_kg", "ewaste_kg", "waste"),
+    ("water_m3", "water_m3", "water"),
+]
+
+FEATURE_NAMES = [name for name, _, _ in FEATURES]
+
+def build_coefficient_matrix(factors=None):
+    if factors is None:
+        # A copy: the active table's own matrix is shared and read-only
+        return active_table().coefficients.copy()
+    matrix = np.zeros((len(FEATURES), len(CATEGORIES)))
+    for row, (_, factor_key, category) in enumerate(FEATURES):
+        matrix[row, CATEGORIES.index(category)] = factors[factor_key]
+    return matrix
+
+def _column(user_inputs, key, n, default):
+    if key not in user_inputs:
+        return np.full(n, default, dtype=float)
+    return np.broadcast_to(np.asarray(user_inputs[key], dtype=float), (n,))
+
+def _is_veg(diet, n):
+    diet = np.asarray(diet)
+    if diet.ndim == 0:
+        return np.full(n, str(diet).lower() == "veg")
+    # diet.lower() == "veg" without lower-casing every row: look at the UCS-4
+    # code points directly, folding ASCII case with | 0x20 ("V" | 0x20 == "v")
+    diet = diet.astype(str)
+    width = diet.dtype.itemsize // 4
+    if width < 3:
+        return np.zeros(n, dtype=bool)
+    codes = diet.view(np.uint32).reshape(n, width)
+    is_veg = (codes[:, 0] | 0x20) == ord("v")
+    is_veg &= (codes[:, 1] | 0x20) == ord("e")
+    is_veg &= (codes[:, 2] | 0x20) == ord("g")
+    if width > 3:
+        is_veg &= codes[:, 3] == 0
+    return is_veg
+
+def _batch_length(user_inputs):
+    for value in user_inputs.values():
+        shape = np.shape(value)
+        if shape:
+            return shape[0]
+    return 1
+
+def build_feature_matrix(user_inputs):
+    # Accepts a DataFrame or a mapping of column name -> array/list/scalar using
+    # the same keys (and defaults) as calculate_total_co2.
+    if hasattr(user_inputs, "columns"):
+        frame = user_inputs
+        user_inputs = {col: frame[col].to_numpy() for col in frame.columns if col != "diet"}
+        if "diet" in frame.columns:
+            # Hash-factorize the (object dtype) diet column rather than
+            # converting every row to a fixed-width string
+            codes, labels = frame["diet"].factorize()
+            user_inputs["diet"] = np.append(np.asarray(labels, dtype=str), "")[codes]
+
+    n = _batch_length(user_inputs)
+    days = _column(user_inputs, "days", n, 30)
+    is_veg = _is_veg(user_inputs["diet"], n) if "diet" in user_inputs else np.ones(n, dtype=bool)
+
+    # Column-major so each feature column is contiguous for the scoring loop
+    features = np.empty((n, len(FEATURES)), order="F")
+    for col, name in enumerate(FEATURE_NAMES):
+        if name == "veg_days":
+            features[:, col] = np.where(is_veg, days, 0.0)
+        elif name == "nonveg_days":
+            features[:, col] = np.where(is_veg, 0.0, days)
         else:
-            percentages[key] = 0
+            features[:, col] = _column(user_inputs, name, n, 0)
+    return features
+
+def _round2(values):
+    # np.round computes rint(x * 100) / 100, which disagrees with the built-in
+    # round() when x * 100 only lands on .5 through binary rounding error
+    # (round(1249.845, 2) == 1249.85 but np.round gives 1249.84). For those
+    # entries the exact product is recovered with a Veltkamp split, and the
+    # sign of its rounding error decides the direction, so the batch path
+    # matches the scalar path bit for bit.
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    half = scaled - np.floor(scaled) == 0.5
+    if half.any():
+        x = values[half]
+        t = 134217729.0 * x
+        hi = t - (t - x)
+        a, b = hi * 100, (x - hi) * 100
+        p = a + b
+        bb = p - a
+        error = (a - (p - bb)) + (b - bb)
+        whole = np.where(error > 0, np.ceil(p), np.where(error < 0, np.floor(p), np.rint(p)))
+        rounded[half] = whole / 100
+    return rounded
+
+# Rows are scored in blocks so the temporaries stay cache-resident
+BATCH_BLOCK_SIZE = 16384
 
-    highest_source = max(percentages, key=percentages.get)
+def score_feature_matrix(features, coefficients):
+    # Shared tail of the batch path: rounding, percentages and highest source
+    # follow calculate_total_co2 exactly (percentages use the rounded category
+    # value over the unrounded monthly total, and are 0 when the total is 0).
+    n = features.shape[0]
+    n_categories = coefficients.shape[1]
+    terms = list(zip(*np.nonzero(coefficients)))
+
+    rounded = np.empty((n_categories, n))
+    shares = np.empty((n_categories, n))
+    monthly_total = np.empty(n)
+    yearly_total = np.empty(n)
+    highest_index = np.empty(n, dtype=np.intp)
+
+    for start in range(0, n, BATCH_BLOCK_SIZE):
+        block = slice(start, min(start + BATCH_BLOCK_SIZE, n))
+
+        # Accumulate feature by feature (rather than features @ coefficients)
+        # so the floating point summation order matches the scalar helpers.
+        # Zero coefficients add nothing and are skipped.
+        per_category = np.zeros((n_categories, block.stop - block.start))
+        for row, col in terms:
+            per_category[col] += features[block, row] * coefficients[row, col]
+
+        total = per_category[0].copy()
+        for col in range(1, n_categories):
+            total += per_category[col]
+
+        rounded[:, block] = _round2(per_category)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            share = _round2(rounded[:, block] / total * 100)
+        share[:, ~(total > 0)] = 0.0
+        shares[:, block] = share
+
+        monthly_total[block] = _round2(total)
+        yearly_total[block] = _round2(total * 12)
+        # Strictly-greater comparisons keep the first maximum, matching max()
+        # over the ordered percentages dict
+        best = share[0].copy()
+        index = np.zeros(best.shape[0], dtype=np.intp)
+        for col in range(1, n_categories):
+            better = share[col] > best
+            index[better] = col
+            np.maximum(best, share[col], out=best)
+        highest_index[block] = index
+
+    breakdown = {category: rounded[i] for i, category in enumerate(CATEGORIES)}
+    breakdown["monthly_total"] = monthly_total
+    breakdown["yearly_total"] = yearly_total
+
+    percentages = {category: shares[i] for i, category in enumerate(CATEGORIES)}
+    highest_source = np.array(CATEGORIES)[highest_index]
 
     return breakdown, percentages, highest_source
+
+@metrics.instrument("calculator.calculate_total_co2_batch")
+def calculate_total_co2_batch(user_inputs, factors=None, region=None, on=None):
+    # Scores with an explicit factor dict, else the registry's table for
+    # region (one region name, or one per household: mixed-region batches
+    # are scored region by region, each in one vectorized pass)
+    features = build_feature_matrix(user_inputs)
+    metrics.inc("households_scored", features.shape[0])
+    if factors is not None:
+        return score_feature_matrix(features, build_coefficient_matrix(factors))
+    if np.ndim(region):
+        import factor_registry
+        return factor_registry.get_registry().score_features(features, region, on)
+    return active_table(region, on).score(features)
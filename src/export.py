@@ -0,0 +1,269 @@
+# src/export.py
+#
+# Bulk export of stored reports to CSV, NDJSON or Parquet, optionally
+# gzipped. Reports stream through a generator pipeline
+#
+#   source (report store query or legacy JSON directory)
+#     -> flatten (one tuple per report, EXPORT_COLUMNS order)
+#     -> batches of batch_size rows
+#     -> writer
+#
+# so memory stays constant whatever the date range. Parquet needs pyarrow
+# (optional) and is written one row group per batch.
+#
+#   python src/export.py outputs/reports_2024.csv.gz --start 2024-01-01 --end 2025-01-01
+#   python src/export.py reports.parquet --highest-source transport
+#   python src/export.py legacy.ndjson --legacy-dir outputs/user_reports
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+import zlib
+from itertools import islice
+
+from report_store import CATEGORIES, LEGACY_REPORTS_DIR, ReportStore
+
+EXPORT_COLUMNS = (
+    ["id", "timestamp", "highest_source", "monthly_total", "yearly_total"]
+    + CATEGORIES
+    + [f"{category}_pct" for category in CATEGORIES]
+)
+FORMATS = ("csv", "ndjson", "parquet")
+MIME_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+DEFAULT_BATCH_SIZE = 10000
+
+
+def detect_format(path):
+    # (format, gzip) from a file name such as reports.csv.gz
+    compressed = path.endswith(".gz")
+    name = path[:-3] if compressed else path
+    for fmt, extensions in (("csv", (".csv",)), ("ndjson", (".ndjson", ".jsonl")), ("parquet", (".parquet",))):
+        if name.endswith(extensions):
+            return fmt, compressed
+    raise ValueError(f"Unsupported export file: {path} (expected .csv, .ndjson, .jsonl or .parquet, optionally .gz)")
+
+
+# -----------------------------------------------------------------------------
+# Sources
+# -----------------------------------------------------------------------------
+
+def store_reports(store, start=None, end=None, highest_source=None, batch_size=DEFAULT_BATCH_SIZE):
+    return store.query(start=start, end=end, highest_source=highest_source, batch_size=batch_size)
+
+def legacy_reports(directory=LEGACY_REPORTS_DIR, start=None, end=None, highest_source=None):
+    # report_*.json files from before the report store, filtered like
+    # ReportStore.query (start <= timestamp < end)
+    if not os.path.isdir(directory):
+        return
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, filename), "r") as f:
+                report = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Skipping {filename}: {e}", file=sys.stderr)
+            continue
+        timestamp = str(report.get("timestamp", ""))
+        if start is not None and timestamp < str(start):
+            continue
+        if end is not None and timestamp >= str(end):
+            continue
+        if highest_source is not None and report.get("highest_source") != highest_source:
+            continue
+        report.setdefault("id", filename)
+        yield report
+
+
+# -----------------------------------------------------------------------------
+# Pipeline
+# -----------------------------------------------------------------------------
+
+_BREAKDOWN_COLUMNS = EXPORT_COLUMNS[3:3 + 2 + len(CATEGORIES)]
+
+def flatten(reports):
+    for report in reports:
+        yield (
+            report.get("id"),
+            report.get("timestamp"),
+            report.get("highest_source"),
+            *map(report.get("breakdown", {}).get, _BREAKDOWN_COLUMNS),
+            *map(report.get("percentages", {}).get, CATEGORIES),
+        )
+
+def batched(rows, batch_size=DEFAULT_BATCH_SIZE):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def encode_batches(batches, fmt, with_header=True):
+    # CSV or NDJSON batches -> encoded text chunks, one per batch. An empty
+    # CSV export still gets its header row.
+    header = with_header and fmt == "csv"
+    for batch in batches:
+        out = io.StringIO()
+        if fmt == "csv":
+            writer = csv.writer(out, lineterminator="\n")
+            if header:
+                writer.writerow(EXPORT_COLUMNS)
+                header = False
+            writer.writerows(batch)
+        else:
+            for row in batch:
+                out.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))))
+                out.write("\n")
+        yield out.getvalue().encode("utf-8")
+    if header:
+        yield (",".join(EXPORT_COLUMNS) + "\n").encode("utf-8")
+
+def gzip_chunks(chunks, level=6):
+    # Incremental gzip of a byte-chunk stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _parquet_schema():
+    import pyarrow as pa
+
+    fields = [pa.field("id", pa.string()), pa.field("timestamp", pa.string()), pa.field("highest_source", pa.string())]
+    fields += [pa.field(name, pa.float64()) for name in EXPORT_COLUMNS[3:]]
+    return pa.schema(fields)
+
+def write_parquet(batches, target, compression="snappy"):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    schema = _parquet_schema()
+    with pq.ParquetWriter(target, schema, compression=compression) as writer:
+        for batch in batches:
+            columns = list(zip(*batch))
+            columns[0] = [None if value is None else str(value) for value in columns[0]]
+            writer.write_table(pa.table(columns, schema=schema))
+
+
+def export_reports(target, fmt=None, compress=None, reports=None, store=None, start=None, end=None,
+                   highest_source=None, batch_size=DEFAULT_BATCH_SIZE):
+    # Streams reports to `target` (a path, or a binary file object with fmt
+    # given) and returns the number exported. Reports come from `reports` if
+    # given, else from `store` (default: the report store) queried by
+    # start/end/highest_source.
+    if fmt is None:
+        fmt, detected = detect_format(target)
+        compress = detected if compress is None else compress
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format {fmt!r} (expected one of {', '.join(FORMATS)})")
+
+    owns_store = False
+    if reports is None:
+        if store is None:
+            store, owns_store = ReportStore(), True
+        reports = store_reports(store, start, end, highest_source, batch_size)
+
+    count = 0
+
+    def counted(batches):
+        nonlocal count
+        for batch in batches:
+            count += len(batch)
+            yield batch
+
+    try:
+        batches = counted(batched(flatten(reports), batch_size))
+        if isinstance(target, str):
+            directory = os.path.dirname(target)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+        if fmt == "parquet":
+            # Parquet compresses internally; gzip selects its gzip codec
+            write_parquet(batches, target, compression="gzip" if compress else "snappy")
+            return count
+
+        f = open(target, "wb") if isinstance(target, str) else target
+        try:
+            chunks = encode_batches(batches, fmt)
+            if compress:
+                chunks = gzip_chunks(chunks)
+            for chunk in chunks:
+                f.write(chunk)
+        finally:
+            if f is not target:
+                f.close()
+        return count
+    finally:
+        if owns_store:
+            store.close()
+
+def iter_export(fmt="csv", compress=False, reports=None, store=None, start=None, end=None,
+                highest_source=None, batch_size=DEFAULT_BATCH_SIZE):
+    # CSV/NDJSON export as a stream of byte chunks (one per batch), e.g. for
+    # a chunked HTTP response
+    if fmt not in ("csv", "ndjson"):
+        raise ValueError("Only csv and ndjson can be streamed; write parquet with export_reports")
+    return _export_chunks(fmt, compress, reports, store, start, end, highest_source, batch_size)
+
+def _export_chunks(fmt, compress, reports, store, start, end, highest_source, batch_size):
+    # A store opened here is closed when the stream is exhausted or closed
+    owns_store = reports is None and store is None
+    if owns_store:
+        store = ReportStore()
+    try:
+        if reports is None:
+            reports = store_reports(store, start, end, highest_source, batch_size)
+        chunks = encode_batches(batched(flatten(reports), batch_size), fmt)
+        yield from gzip_chunks(chunks) if compress else chunks
+    finally:
+        if owns_store:
+            store.close()
+
+def export_filename(fmt, compress, start=None, end=None):
+    span = "_".join(str(bound)[:10] for bound in (start, end) if bound) or "all"
+    return f"carbon_reports_{span}.{fmt}" + (".gz" if compress and fmt != "parquet" else "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export stored reports to CSV, NDJSON or Parquet.")
+    parser.add_argument("output", help="output file: .csv, .ndjson/.jsonl or .parquet, optionally .gz")
+    parser.add_argument("--start", help="first timestamp to include (e.g. 2024-01-01)")
+    parser.add_argument("--end", help="timestamp to stop before (exclusive)")
+    parser.add_argument("--highest-source", choices=CATEGORIES)
+    parser.add_argument("--legacy-dir", help="read report_*.json files from this directory instead of the store")
+    parser.add_argument("--db", help="report store database (default: outputs/reports.db)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    start_time = time.perf_counter()
+    reports = store = None
+    if args.legacy_dir:
+        reports = legacy_reports(args.legacy_dir, args.start, args.end, args.highest_source)
+    elif args.db:
+        store = ReportStore(args.db)
+
+    try:
+        count = export_reports(
+            args.output, reports=reports, store=store, start=args.start, end=args.end,
+            highest_source=args.highest_source, batch_size=args.batch_size,
+        )
+    finally:
+        if store is not None:
+            store.close()
+    elapsed = time.perf_counter() - start_time
+    size = os.path.getsize(args.output)
+    print(f"Exported {count} reports ({size / 1e6:.1f} MB) in {elapsed:.2f}s -> {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
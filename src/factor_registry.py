@@ -0,0 +1,180 @@
+# src/factor_registry.py
+#
+# Versioned, region-aware emission factor tables loaded from
+#
+#   data/emission_factors/<REGION>/<YYYY-MM-DD>.json
+#
+# where the file name is the date the table takes effect and the contents use
+# the same keys as calculator.EMISSION_FACTORS. These files are the only
+# source of factors: the calculator's scalar and batch paths, the result
+# cache key and the scenario engine all read the table in effect from here.
+# Each table is compiled once into the calculator's coefficient matrix (plus
+# a total vector, so a household's monthly total is a single dot product).
+# Files are re-checked at most every check_interval seconds and changed ones
+# are reloaded in place, so factor updates need no restart.
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from calculator import (
+    CATEGORIES,
+    FEATURES,
+    build_coefficient_matrix,
+    score_feature_matrix,
+)
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_FACTORS_DIR = os.path.join(BASE_DIR, "data", "emission_factors")
+DEFAULT_REGION = "IN"
+
+REQUIRED_FACTORS = sorted({factor_key for _, factor_key, _ in FEATURES})
+
+
+class FactorTable:
+    def __init__(self, region, effective, factors, signature=None):
+        missing = [key for key in REQUIRED_FACTORS if key not in factors]
+        if missing:
+            raise ValueError(f"Factor table {region}/{effective} is missing: {', '.join(missing)}")
+        self.region = region
+        self.effective = effective
+        self.factors = dict(factors)
+        self.signature = signature
+        payload = json.dumps(self.factors, sort_keys=True).encode("utf-8")
+        self.version = f"{region}/{effective.isoformat()}/{hashlib.sha256(payload).hexdigest()[:12]}"
+        # features x categories; total_vector maps features straight to the
+        # monthly total. Shared by every request, so read-only: a caller
+        # editing them in place would change factors for everyone.
+        self.coefficients = build_coefficient_matrix(self.factors)
+        self.total_vector = self.coefficients.sum(axis=1)
+        self.coefficients.setflags(write=False)
+        self.total_vector.setflags(write=False)
+
+    def score(self, features):
+        return score_feature_matrix(features, self.coefficients)
+
+
+class FactorRegistry:
+    def __init__(self, directory=DEFAULT_FACTORS_DIR, check_interval=5.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._tables = {}    # region -> [FactorTable] sorted by effective date
+        self._files = {}     # path -> FactorTable
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        signatures = {}
+        if not os.path.isdir(self.directory):
+            return signatures
+        for region in os.listdir(self.directory):
+            region_dir = os.path.join(self.directory, region)
+            if not os.path.isdir(region_dir):
+                continue
+            for filename in os.listdir(region_dir):
+                if filename.endswith(".json"):
+                    path = os.path.join(region_dir, filename)
+                    stat = os.stat(path)
+                    signatures[path] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def refresh(self, force=False):
+        # Reloads added/changed tables and drops deleted ones. A table that
+        # fails to load keeps its previous version. Returns True on change.
+        now = time.monotonic()
+        if not force and self._last_check is not None and now - self._last_check < self.check_interval:
+            return False
+
+        with self._lock:
+            # The check time is recorded only once the tables are in place, so
+            # a caller racing the first load waits for it on the lock
+            signatures = self._scan()
+            if not force and signatures == {path: t.signature for path, t in self._files.items()}:
+                self._last_check = now
+                return False
+
+            files = {}
+            for path, signature in signatures.items():
+                table = self._files.get(path)
+                if table is None or table.signature != signature or force:
+                    try:
+                        table = self._load(path, signature)
+                    except Exception as e:
+                        print(f"Error loading emission factors {path}: {e}")
+                if table is not None:
+                    files[path] = table
+
+            tables = {}
+            for table in files.values():
+                tables.setdefault(table.region, []).append(table)
+            for region_tables in tables.values():
+                region_tables.sort(key=lambda t: t.effective)
+
+            self._files = files
+            self._tables = tables
+            self._last_check = now
+            return True
+
+    @staticmethod
+    def _load(path, signature):
+        region = os.path.basename(os.path.dirname(path))
+        effective = datetime.date.fromisoformat(os.path.basename(path)[:-len(".json")])
+        with open(path, "r", encoding="utf-8") as f:
+            factors = json.load(f)
+        return FactorTable(region, effective, factors, signature)
+
+    def regions(self):
+        self.refresh()
+        return sorted(self._tables)
+
+    def get(self, region=DEFAULT_REGION, on=None):
+        # The table for region in effect on the given date (default today)
+        self.refresh()
+        on = on or datetime.date.today()
+        tables = self._tables.get(region)
+        if not tables:
+            raise KeyError(f"No emission factors for region {region!r}")
+        current = None
+        for table in tables:
+            if table.effective <= on:
+                current = table
+        if current is None:
+            raise KeyError(f"No emission factors for region {region!r} effective on {on}")
+        return current
+
+    def score_features(self, features, regions=DEFAULT_REGION, on=None):
+        # score_feature_matrix for a mixed-region batch: rows are grouped by
+        # region and each group is scored in one vectorized pass with that
+        # region's compiled coefficients
+        n = features.shape[0]
+        regions = np.broadcast_to(np.asarray(regions, dtype=str), (n,))
+
+        breakdown = {key: np.empty(n) for key in CATEGORIES + ["monthly_total", "yearly_total"]}
+        percentages = {key: np.empty(n) for key in CATEGORIES}
+        highest_source = np.empty(n, dtype=f"<U{max(len(c) for c in CATEGORIES)}")
+
+        labels, inverse = np.unique(regions, return_inverse=True)
+        for group, region in enumerate(labels):
+            rows = np.flatnonzero(inverse == group)
+            g_breakdown, g_percentages, g_highest = self.get(str(region), on).score(features[rows])
+            for key, values in g_breakdown.items():
+                breakdown[key][rows] = values
+            for key, values in g_percentages.items():
+                percentages[key][rows] = values
+            highest_source[rows] = g_highest
+
+        return breakdown, percentages, highest_source
+
+
+_registry = None
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = FactorRegistry()
+    return _registry
@@ -0,0 +1,351 @@
+# src/history.py
+#
+# Per-household monthly emission history in compact columns.
+#
+# Every recorded month is appended to a columnar log (household row, month,
+# one float32 per category) rather than kept as a dict per month. Each
+# household also has a 12-slot float32 ring buffer of its latest months, from
+# which the rolling 3/12-month aggregates and a least-squares trend projection
+# are refreshed on every new month - O(window) work per update, however long
+# the history grows. About 300 bytes per household plus 28 bytes per month.
+#
+#   python src/history.py add outputs/history.npz outputs/scored.csv --month 2024-05
+#   python src/history.py show outputs/history.npz H001
+
+import argparse
+import atexit
+import csv
+import os
+import threading
+from datetime import date, datetime
+
+import numpy as np
+
+from calculator import CATEGORIES
+
+WINDOW = 12
+SHORT_WINDOW = 3
+# Households with fewer months than this are projected from their mean
+MIN_TREND_MONTHS = 3
+
+_NO_MONTH = np.iinfo(np.int32).min
+REFRESH_BLOCK_SIZE = 65536
+
+# _SKIPPED_BITS[start, count]: ring bits of `count` consecutive months
+# starting at slot `start`
+_SKIPPED_BITS = np.zeros((WINDOW, WINDOW + 1), dtype=np.uint16)
+for _start in range(WINDOW):
+    for _count in range(1, WINDOW + 1):
+        _SKIPPED_BITS[_start, _count] = _SKIPPED_BITS[_start, _count - 1] | (1 << ((_start + _count - 1) % WINDOW))
+
+
+def month_index(value):
+    # "YYYY-MM", date/datetime or (year, month) -> months since year 0
+    if isinstance(value, (date, datetime)):
+        year, month = value.year, value.month
+    elif isinstance(value, str):
+        year, month = (int(part) for part in value[:7].split("-"))
+    else:
+        year, month = value
+    if not 1 <= month <= 12:
+        raise ValueError(f"Invalid month: {value!r}")
+    return year * 12 + month - 1
+
+def month_label(index):
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def breakdown_matrix(breakdown):
+    # Breakdown dict (scalars or arrays, e.g. from calculate_total_co2_batch)
+    # -> (households x categories) float32
+    return np.column_stack([np.atleast_1d(np.asarray(breakdown[c], dtype=np.float32)) for c in CATEGORIES])
+
+
+class Column:
+    # Growable array with amortized O(1) appends
+    __slots__ = ("data", "size")
+
+    def __init__(self, dtype, shape=(), capacity=1024):
+        self.data = np.zeros((capacity,) + shape, dtype=dtype)
+        self.size = 0
+
+    def reserve(self, n):
+        if n > len(self.data):
+            grown = np.zeros((max(n, 2 * len(self.data)),) + self.data.shape[1:], dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        self.reserve(self.size + len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    @property
+    def values(self):
+        return self.data[:self.size]
+
+
+class HouseholdHistory:
+    def __init__(self, capacity=1024):
+        self.ids = []
+        self._rows = {}
+
+        # Append-only log of every recorded month
+        self.log_household = Column(np.int32, capacity=capacity)
+        self.log_month = Column(np.int32, capacity=capacity)
+        self.log_values = Column(np.float32, (len(CATEGORIES),), capacity=capacity)
+
+        # Per-household state, one row per household
+        self.last_month = Column(np.int32, capacity=capacity)
+        self.ring = Column(np.float32, (WINDOW, len(CATEGORIES)), capacity=capacity)
+        # Bit s set = ring slot s holds a month inside the current window
+        self.ring_valid = Column(np.uint16, capacity=capacity)
+        self.rolling_3 = Column(np.float32, (len(CATEGORIES),), capacity=capacity)
+        self.rolling_12 = Column(np.float32, (len(CATEGORIES),), capacity=capacity)
+        self.months_12 = Column(np.int8, capacity=capacity)
+        self.trend = Column(np.float32, capacity=capacity)
+        self.projected_yearly = Column(np.float32, capacity=capacity)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _household_rows(self, household_ids):
+        household_ids = [str(household_id) for household_id in household_ids]
+        lookup = self._rows.get
+        found = [lookup(household_id) for household_id in household_ids]
+        first_new = len(self.ids)
+        for i, row in enumerate(found):
+            if row is None:
+                household_id = household_ids[i]
+                row = self._rows.get(household_id)
+                if row is None:
+                    row = self._rows[household_id] = len(self.ids)
+                    self.ids.append(household_id)
+                found[i] = row
+        rows = np.asarray(found, dtype=np.int64)
+        if len(self.ids) > first_new:
+            n = len(self.ids) - first_new
+            self.last_month.extend(np.full(n, _NO_MONTH))
+            self.ring.extend(np.zeros((n, WINDOW, len(CATEGORIES))))
+            self.ring_valid.extend(np.zeros(n))
+            for column in (self.rolling_3, self.rolling_12):
+                column.extend(np.zeros((n, len(CATEGORIES))))
+            for column in (self.months_12, self.trend, self.projected_yearly):
+                column.extend(np.zeros(n))
+        return rows
+
+    def record(self, household_id, month, breakdown):
+        self.record_batch([household_id], month, breakdown)
+
+    def record_batch(self, household_ids, month, breakdown):
+        # Records one month for many households at once. breakdown is a
+        # breakdown dict or a (households x categories) array. Re-recording a
+        # household's latest month replaces it; earlier months are rejected.
+        m = month_index(month)
+        values = breakdown_matrix(breakdown) if isinstance(breakdown, dict) else np.asarray(breakdown, np.float32)
+        values = values.reshape(-1, len(CATEGORIES))
+        if len(values) != len(household_ids):
+            raise ValueError(f"{len(household_ids)} households but {len(values)} breakdowns")
+
+        household_ids = [str(household_id) for household_id in household_ids]
+        if len(set(household_ids)) != len(household_ids):
+            raise ValueError("A household appears more than once in the same month")
+        # The whole batch is checked before any household is registered, so
+        # a rejected batch leaves nothing behind
+        known = np.array([row for row in map(self._rows.get, household_ids) if row is not None], dtype=np.int64)
+        stale = self.last_month.values[known] > m
+        if stale.any():
+            household_id = self.ids[known[np.argmax(stale)]]
+            raise ValueError(
+                f"{month_label(m)} is older than the latest month recorded for household {household_id!r}"
+            )
+        rows = self._household_rows(household_ids)
+
+        self.log_household.extend(rows)
+        self.log_month.extend(np.full(len(rows), m))
+        self.log_values.extend(values)
+
+        # Month m lives in slot m % WINDOW. Slots of the months skipped since
+        # each household's last record now hold data older than the window.
+        last = self.last_month.data[rows].astype(np.int64)
+        skipped = np.clip(m - last - 1, 0, WINDOW)
+        valid = self.ring_valid.data[rows] & ~_SKIPPED_BITS[(last + 1) % WINDOW, skipped]
+        slot = m % WINDOW
+        self.ring.data[rows, slot] = values
+        self.ring_valid.data[rows] = valid | (1 << slot)
+        self.last_month.data[rows] = m
+        for start in range(0, len(rows), REFRESH_BLOCK_SIZE):
+            self._refresh(rows[start:start + REFRESH_BLOCK_SIZE], m)
+
+    def preview(self, household_id, month, breakdown):
+        # aggregates() as they would be after recording this month, without
+        # recording it: the household's ring state is copied into a scratch
+        # history and the month recorded there
+        scratch = HouseholdHistory(capacity=1)
+        scratch._household_rows([household_id])
+        row = self._rows.get(str(household_id))
+        if row is not None:
+            for name in ("last_month", "ring", "ring_valid"):
+                getattr(scratch, name).data[0] = getattr(self, name).data[row]
+        scratch.record(household_id, month, breakdown)
+        return scratch.aggregates(household_id)
+
+    def _refresh(self, rows, m):
+        # Rolling sums and the trend fit from each household's ring buffer.
+        # All households share m, so slot ages are the same for every row and
+        # only the validity masks differ.
+        ring = self.ring.data[rows]
+        valid = ((self.ring_valid.data[rows, None] >> np.arange(WINDOW, dtype=np.uint16)) & 1).astype(np.float32)
+        age = (m - np.arange(WINDOW)) % WINDOW
+        self.rolling_12.data[rows] = np.matmul(valid[:, None, :], ring)[:, 0]
+        self.rolling_3.data[rows] = np.matmul((valid * (age < SHORT_WINDOW))[:, None, :], ring)[:, 0]
+        n = valid.sum(axis=1)
+        self.months_12.data[rows] = n
+
+        # Least-squares line through monthly totals, x = months before m
+        # (negative), then summed over the next 12 months
+        valid = valid.astype(np.float64)
+        x = -age.astype(np.float64)
+        y = ring.sum(axis=2, dtype=np.float64) * valid
+        sx, sxx = valid @ x, valid @ (x * x)
+        sy, sxy = y.sum(axis=1), y @ x
+        safe_n = np.maximum(n, 1).astype(np.float64)
+        denominator = safe_n * sxx - sx * sx
+        use_trend = (n >= MIN_TREND_MONTHS) & (denominator > 0)
+        slope = np.where(use_trend, (safe_n * sxy - sx * sy) / np.where(denominator > 0, denominator, 1), 0.0)
+        intercept = (sy - slope * sx) / safe_n
+        # sum over k = 1..12 of intercept + slope * k
+        projected = WINDOW * intercept + slope * (WINDOW * (WINDOW + 1) / 2)
+
+        self.trend.data[rows] = slope
+        self.projected_yearly.data[rows] = np.maximum(projected, 0.0)
+
+    def aggregates(self, household_id):
+        row = self._rows.get(str(household_id))
+        if row is None:
+            raise KeyError(household_id)
+        rolling_3 = self.rolling_3.data[row]
+        rolling_12 = self.rolling_12.data[row]
+        return {
+            "latest_month": month_label(int(self.last_month.data[row])),
+            "months_in_window": int(self.months_12.data[row]),
+            "rolling_3": dict(zip(CATEGORIES, np.round(rolling_3.astype(float), 2).tolist()),
+                              total=round(float(rolling_3.sum()), 2)),
+            "rolling_12": dict(zip(CATEGORIES, np.round(rolling_12.astype(float), 2).tolist()),
+                               total=round(float(rolling_12.sum()), 2)),
+            "trend_per_month": round(float(self.trend.data[row]), 2),
+            "projected_yearly": round(float(self.projected_yearly.data[row]), 2),
+        }
+
+    def history(self, household_id):
+        # Recorded months for one household, oldest first; a re-recorded
+        # month keeps its latest value
+        row = self._rows.get(str(household_id))
+        if row is None:
+            raise KeyError(household_id)
+        entries = np.flatnonzero(self.log_household.values == row)
+        months = {}
+        for entry in entries:
+            months[int(self.log_month.data[entry])] = self.log_values.data[entry]
+        return [
+            dict(zip(CATEGORIES, np.round(values.astype(float), 2).tolist()), month=month_label(month))
+            for month, values in sorted(months.items())
+        ]
+
+    def nbytes(self):
+        columns = [value for value in vars(self).values() if isinstance(value, Column)]
+        return sum(column.values.nbytes for column in columns)
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        columns = {name: value.values for name, value in vars(self).items() if isinstance(value, Column)}
+        # Written beside the file and swapped in, so a crash or another
+        # process mid-write never leaves a truncated history
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, ids=np.asarray(self.ids, dtype=str), **columns)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        history = cls(capacity=1)
+        with np.load(path) as data:
+            history.ids = data["ids"].tolist()
+            history._rows = {household_id: row for row, household_id in enumerate(history.ids)}
+            for name, column in vars(history).items():
+                if isinstance(column, Column):
+                    column.data = data[name].copy()
+                    column.size = len(column.data)
+        return history
+
+
+class SharedHistory:
+    # A HouseholdHistory file shared by request threads. Recorded months are
+    # written back at most save_interval seconds after the first unsaved one,
+    # and at exit, rather than rewriting the whole file on every record.
+    def __init__(self, path, save_interval=30.0):
+        self.path = path
+        self.save_interval = save_interval
+        self.history = HouseholdHistory.load(path) if os.path.exists(path) else HouseholdHistory()
+        self._lock = threading.Lock()
+        self._timer = None
+        self._dirty = False
+        atexit.register(self.save)
+
+    def preview(self, household_id, month, breakdown):
+        with self._lock:
+            return self.history.preview(household_id, month, breakdown)
+
+    def record(self, household_id, month, breakdown):
+        with self._lock:
+            self.history.record(household_id, month, breakdown)
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.save_interval, self.save)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def save(self):
+        # Writes the history if anything was recorded since the last save
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return False
+            self.history.save(self.path)
+            self._dirty = False
+            return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-household monthly emission history.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="record one month from a scored CSV (see stream_calculator.py)")
+    add.add_argument("history", help="history file (.npz), created if missing")
+    add.add_argument("scored", help="scored CSV with household_id and category columns")
+    add.add_argument("--month", required=True, help="YYYY-MM")
+
+    show = commands.add_parser("show", help="print one household's aggregates")
+    show.add_argument("history")
+    show.add_argument("household_id")
+    args = parser.parse_args(argv)
+
+    if args.command == "add":
+        history = HouseholdHistory.load(args.history) if os.path.exists(args.history) else HouseholdHistory()
+        with open(args.scored, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        values = np.array([[float(row[c]) for c in CATEGORIES] for row in rows], dtype=np.float32)
+        history.record_batch([row["household_id"] for row in rows], args.month, values)
+        history.save(args.history)
+        print(f"Recorded {len(rows)} households for {args.month}; "
+              f"{len(history)} households, {history.nbytes() / 1e6:.1f} MB")
+    else:
+        history = HouseholdHistory.load(args.history)
+        print(history.aggregates(args.household_id))
+
+if __name__ == "__main__":
+    main()
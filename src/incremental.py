@@ -0,0 +1,207 @@
+# src/incremental.py
+#
+# Dependency-tracked incremental evaluation. A Graph holds input nodes and
+# derived nodes (a function of other nodes). Setting inputs only bumps the
+# ones whose value changed; reading a node recomputes it only if one of its
+# dependencies changed since it was last computed, and a node whose
+# recomputed value is equal to the old one does not count as changed, so
+# nothing downstream of it runs either ("early cutoff").
+#
+# ReportGraph wires the calculator and agent into such a graph: each
+# category's emissions, the totals, every percentage, the highest source,
+# the explanation, the retrieved tips and the formatted advice are nodes.
+# Changing only water_m3 recomputes water, the totals and the percentages;
+# if the highest source stays the same, tips are not retrieved again.
+#
+#   graph = ReportGraph()
+#   report = graph.update(user_inputs)          # same dict as result_cache.cached_report
+#   report = graph.update(dict(user_inputs, water_m3=12))
+#   graph.last_recomputed                       # ['water', 'monthly_raw', ...]
+
+import agent
+import calculator
+import metrics
+from calculator import BREAKDOWN_KEYS, CATEGORIES, INPUT_DEFAULTS
+
+
+class _Node:
+    __slots__ = ("name", "deps", "fn", "value", "changed_at", "verified_at")
+
+    def __init__(self, name, deps, fn):
+        self.name = name
+        self.deps = deps
+        self.fn = fn
+        self.value = None
+        # Revision at which the value last changed, and at which it was last
+        # confirmed up to date (-1: never computed)
+        self.changed_at = -1
+        self.verified_at = -1
+
+
+class Graph:
+    def __init__(self):
+        self.revision = 0
+        self._nodes = {}
+        # Derived nodes recomputed since the last set_inputs, in order
+        self.last_recomputed = []
+
+    def input(self, name, value=None):
+        node = self._add(name, (), None)
+        node.value = value
+        node.changed_at = node.verified_at = self.revision
+        return name
+
+    def node(self, name, deps, fn):
+        # fn(*values of deps) -> value; deps must already exist
+        for dep in deps:
+            if dep not in self._nodes:
+                raise KeyError(f"Unknown dependency {dep!r} of {name!r}")
+        self._add(name, tuple(deps), fn)
+        return name
+
+    def _add(self, name, deps, fn):
+        if name in self._nodes:
+            raise ValueError(f"Node {name!r} already exists")
+        node = self._nodes[name] = _Node(name, deps, fn)
+        return node
+
+    def set_inputs(self, values):
+        # Updates input nodes; returns the names whose value changed
+        self.revision += 1
+        self.last_recomputed = []
+        changed = []
+        for name, value in values.items():
+            node = self._nodes[name]
+            if node.fn is not None:
+                raise ValueError(f"{name!r} is not an input node")
+            if node.value != value or type(node.value) is not type(value):
+                node.value = value
+                node.changed_at = self.revision
+                changed.append(name)
+        return changed
+
+    def get(self, name):
+        return self._refresh(self._nodes[name]).value
+
+    def version(self, name):
+        # Revision at which the node's value last changed; equal versions
+        # mean equal values, so callers can key their own caches on it
+        return self._refresh(self._nodes[name]).changed_at
+
+    def _refresh(self, node):
+        if node.verified_at == self.revision or node.fn is None:
+            return node
+        deps = [self._refresh(self._nodes[dep]) for dep in node.deps]
+        if node.verified_at < 0 or any(dep.changed_at > node.verified_at for dep in deps):
+            value = node.fn(*(dep.value for dep in deps))
+            self.last_recomputed.append(node.name)
+            metrics.inc("graph_nodes_recomputed", node=node.name)
+            if node.verified_at < 0 or value != node.value:
+                node.value = value
+                node.changed_at = self.revision
+        node.verified_at = self.revision
+        return node
+
+
+# -----------------------------------------------------------------------------
+# Carbon report graph
+# -----------------------------------------------------------------------------
+
+# Category -> (inputs it depends on, calculator function taking them in order)
+_CATEGORY_INPUTS = {
+    "electricity": (("electricity_kwh",), calculator.calculate_electricity_co2),
+    "transport": (
+        ("petrol_liters", "diesel_liters", "bus_km", "train_km", "flight_km"),
+        calculator.calculate_transport_co2,
+    ),
+    "food": (("diet", "days"), calculator.calculate_food_co2),
+    "waste": (("plastic_kg", "ewaste_kg"), calculator.calculate_waste_co2),
+    "water": (("water_m3",), calculator.calculate_water_co2),
+}
+
+
+def _with_factors(fn):
+    # Category node function: the calculator helper on its inputs, under the
+    # factor table given as the last dependency
+    return lambda *values: fn(*values[:-1], factors=values[-1])
+
+def _highest(*shares):
+    # First category with the largest share, as score_household picks it
+    return CATEGORIES[shares.index(max(shares))]
+
+
+class ReportGraph(Graph):
+    # calculate_total_co2 + explain_decision + generate_advice +
+    # generate_actionable_steps as a graph. Values match calculate_total_co2
+    # exactly: categories are rounded individually, totals come from the
+    # unrounded sum, and percentages divide rounded categories by it.
+    def __init__(self, top_k=5, ranked=True):
+        super().__init__()
+        for name, default in INPUT_DEFAULTS.items():
+            self.input(name, default)
+        # Bumped when the knowledge base changes, so tips are re-retrieved
+        self.input("kb_generation", 0)
+        # The active emission factors; a reloaded factor file that changes
+        # them recomputes every category
+        self.input("factors", None)
+
+        for category, (inputs, fn) in _CATEGORY_INPUTS.items():
+            self.node(f"{category}_raw", inputs + ("factors",), _with_factors(fn))
+            self.node(category, (f"{category}_raw",), lambda value: round(value, 2))
+        raw = [f"{category}_raw" for category in CATEGORIES]
+        # Summed in the calculator's order so the float result is identical
+        self.node("monthly_raw", raw, lambda *values: sum(values[1:], values[0]))
+        self.node("monthly_total", ("monthly_raw",), lambda total: round(total, 2))
+        self.node("yearly_total", ("monthly_raw",), lambda total: round(total * 12, 2))
+        for category in CATEGORIES:
+            self.node(
+                f"{category}_pct", (category, "monthly_raw"),
+                lambda value, total: round((value / total) * 100, 2) if total > 0 else 0,
+            )
+        self.node("highest_source", [f"{category}_pct" for category in CATEGORIES], _highest)
+
+        self.node("breakdown", BREAKDOWN_KEYS, lambda *values: dict(zip(BREAKDOWN_KEYS, values)))
+        self.node("percentages", [f"{c}_pct" for c in CATEGORIES], lambda *values: dict(zip(CATEGORIES, values)))
+        # The highest category's value and share are all the text nodes need,
+        # so a change elsewhere does not re-render them
+        self.node("highest_value", ("breakdown", "highest_source"), lambda breakdown, highest: breakdown[highest])
+        self.node("highest_pct", ("percentages", "highest_source"), lambda shares, highest: shares[highest])
+
+        self.node(
+            "explanation", ("highest_source", "highest_value", "highest_pct"),
+            lambda highest, value, pct: agent.explain_decision({highest: value}, {highest: pct}, highest),
+        )
+        self.node(
+            "tips", ("highest_source", "kb_generation"),
+            lambda highest, _: agent.retrieve_tips(highest, top_k, ranked),
+        )
+        self.node(
+            "advice", ("tips", "highest_source", "highest_pct"),
+            lambda tips, highest, pct: agent.format_advice(tips[0], {highest: pct}, highest, tips[1]),
+        )
+        self.node("steps", ("highest_source",), lambda highest: agent.generate_actionable_steps({}, {}, highest))
+
+    def set_household(self, user_inputs):
+        # Sets the inputs (missing keys take calculate_total_co2's defaults)
+        # without computing anything yet; returns the changed input names
+        values = {name: user_inputs.get(name, default) for name, default in INPUT_DEFAULTS.items()}
+        index = agent.get_knowledge_index()
+        index.refresh()
+        values["kb_generation"] = index.generation
+        values["factors"] = calculator.active_table().factors
+        return self.set_inputs(values)
+
+    def update(self, user_inputs):
+        # set_household, then the report for the new inputs
+        self.set_household(user_inputs)
+        return self.report()
+
+    def report(self):
+        return {
+            "breakdown": dict(self.get("breakdown")),
+            "percentages": dict(self.get("percentages")),
+            "highest_source": self.get("highest_source"),
+            "explanation": self.get("explanation"),
+            "advice": self.get("advice"),
+            "steps": self.get("steps"),
+        }
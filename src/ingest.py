@@ -0,0 +1,194 @@
+# src/ingest.py
+#
+# Streaming extraction of knowledge documents (.txt and .pdf) for the
+# indexers. Everything is a generator: PDFs are read one page at a time with
+# pypdf, text files one block of lines at a time, and chunking keeps only a
+# window of about chunk_size + one page in memory, so a 500-page PDF never
+# sits in memory whole.
+#
+#   iter_pages(path)        (page number, text) pairs
+#   iter_lines(path)        one knowledge-base "line" per tip: stripped lines
+#                           of a .txt file, sentences of a PDF (KnowledgeIndex)
+#   iter_chunks(pages)      overlapping ~chunk_size character chunks (rag_engine)
+#   map_files(fn, paths)    fn over files in a process pool, in completion order
+#
+#   python src/ingest.py rag_docs/ --workers 8      # extraction stats per file
+
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+SUPPORTED_EXTENSIONS = (".txt", ".pdf")
+TEXT_PAGE_CHARS = 4096
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_CHUNK_OVERLAP = 50
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+_WHITESPACE = re.compile(r"\s+")
+# A PDF "sentence" longer than this (e.g. a table) is yielded as it stands
+MAX_SENTENCE_CHARS = 2000
+# Preferred chunk boundaries, best first (as RecursiveCharacterTextSplitter)
+_SEPARATORS = ("\n\n", "\n", " ")
+
+
+def discover(directory, extensions=SUPPORTED_EXTENSIONS):
+    # Supported documents directly inside directory, sorted by name
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.endswith(extensions) and os.path.isfile(os.path.join(directory, name))
+    )
+
+def iter_pages(path):
+    # (1-based page number, text). Text files are split into "pages" of about
+    # TEXT_PAGE_CHARS characters on line boundaries.
+    if path.endswith(".pdf"):
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise RuntimeError(f"Reading {path} needs pypdf (pip install pypdf)")
+
+        reader = PdfReader(path)
+        for number, page in enumerate(reader.pages, 1):
+            yield number, page.extract_text() or ""
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        number, block, size = 1, [], 0
+        for line in f:
+            block.append(line)
+            size += len(line)
+            if size >= TEXT_PAGE_CHARS:
+                yield number, "".join(block)
+                number, block, size = number + 1, [], 0
+        if block:
+            yield number, "".join(block)
+
+def iter_lines(path):
+    # Knowledge-base lines of a document. A .txt file's non-empty stripped
+    # lines (one tip per line, as rag_docs/ is written); PDF text wraps lines
+    # mid-sentence, so a PDF yields whole sentences instead, joined across
+    # line and page breaks.
+    if not path.endswith(".pdf"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                clean_line = line.strip()
+                if clean_line:
+                    yield clean_line
+        return
+
+    pending = ""
+    for _, text in iter_pages(path):
+        # Hyphenated line breaks rejoin the word
+        text = _WHITESPACE.sub(" ", (pending + " " + text.replace("-\n", "")).strip())
+        sentences = _SENTENCE_END.split(text)
+        pending = sentences.pop()
+        for sentence in sentences:
+            yield sentence
+        if len(pending) > MAX_SENTENCE_CHARS:
+            yield pending
+            pending = ""
+    if pending:
+        yield pending
+
+def _cut(text, limit):
+    # End of the first chunk of text: the last preferred separator at or
+    # before limit, or limit itself if none
+    for separator in _SEPARATORS:
+        position = text.rfind(separator, 0, limit + 1)
+        if position > 0:
+            return position
+    return limit
+
+def iter_chunks(pages, chunk_size=DEFAULT_CHUNK_SIZE, chunk_overlap=DEFAULT_CHUNK_OVERLAP):
+    # (chunk text, page the chunk starts on) from (page number, text) pairs.
+    # Consecutive chunks overlap by up to chunk_overlap characters; only the
+    # unemitted tail of the text is buffered.
+    buffer, base = "", 0
+    # (absolute offset, page number) of the pages overlapping the buffer
+    starts = []
+
+    def page_of(offset):
+        page = starts[0][1]
+        for start, number in starts:
+            if start > offset:
+                break
+            page = number
+        return page
+
+    for number, text in pages:
+        starts.append((base + len(buffer), number))
+        buffer += text
+        while len(buffer) > chunk_size:
+            end = _cut(buffer, chunk_size)
+            chunk = buffer[:end]
+            stripped = chunk.strip()
+            if stripped:
+                yield stripped, page_of(base + len(chunk) - len(chunk.lstrip()))
+            # The next chunk starts chunk_overlap characters before the cut,
+            # on a word boundary
+            keep = end - chunk_overlap
+            if keep <= 0:
+                keep = end
+            else:
+                space = buffer.find(" ", keep, end)
+                keep = space + 1 if space != -1 else end
+            buffer, base = buffer[keep:], base + keep
+            while len(starts) > 1 and starts[1][0] <= base:
+                starts.pop(0)
+
+    chunk = buffer.strip()
+    if chunk:
+        yield chunk, page_of(base + len(buffer) - len(buffer.lstrip()))
+
+
+def map_files(fn, paths, workers=None):
+    # (path, fn(path)) for every path, in completion order. Files are spread
+    # over a process pool; with one worker (or one file) they run inline.
+    paths = list(paths)
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        for path in paths:
+            yield path, fn(path)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fn, path): path for path in paths}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def _file_stats(path):
+    # Worker for the CLI: one streaming pass counting pages, lines and chunks
+    pages = lines = chunks = characters = 0
+    for _ in iter_lines(path):
+        lines += 1
+    for _, text in iter_pages(path):
+        pages += 1
+        characters += len(text)
+    for _ in iter_chunks(iter_pages(path)):
+        chunks += 1
+    return {"pages": pages, "lines": lines, "chunks": chunks, "characters": characters}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract knowledge documents and report what the indexers will see.")
+    parser.add_argument("paths", nargs="+", help="documents, or directories of .txt/.pdf files")
+    parser.add_argument("--workers", type=int, default=None, help="extraction processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    paths = []
+    for path in args.paths:
+        paths.extend(discover(path) if os.path.isdir(path) else [path])
+
+    start = time.perf_counter()
+    totals = {"pages": 0, "lines": 0, "chunks": 0, "characters": 0}
+    for path, stats in map_files(_file_stats, paths, args.workers):
+        print(f"{path}: {stats['pages']} pages, {stats['lines']} lines, {stats['chunks']} chunks")
+        for key in totals:
+            totals[key] += stats[key]
+    print(f"{len(paths)} files, {totals['pages']} pages, {totals['lines']} lines, {totals['chunks']} chunks "
+          f"({totals['characters'] / 1e6:.1f} M chars) in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
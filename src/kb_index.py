@@ -0,0 +1,260 @@
+# src/kb_index.py
+#
+# In-memory inverted index over the local knowledge base (rag_docs/*.txt, and
+# *.pdf when the index is given that extension; see ingest.py). Each file is
+# read and tokenized once; the index is only rebuilt when a file's mtime or
+# size changes (or files are added/removed), and unchanged files are never
+# re-read. Lookups cost roughly the size of the postings for the query terms
+# rather than the size of the corpus.
+
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+import ingest
+import metrics
+
+TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def _read_file(path):
+    # (lines, tokens) of one knowledge-base document, .txt or .pdf. Module
+    # level so process pool workers can run it.
+    lines, tokens = [], []
+    try:
+        for clean_line in ingest.iter_lines(path):
+            lines.append(clean_line)
+            tokens.append(tokenize(clean_line))
+    except Exception as e:
+        print(f"Error reading {os.path.basename(path)}: {e}")
+    return lines, tokens
+
+
+class _FileEntry:
+    # Parsed contents of one knowledge-base file
+    __slots__ = ("signature", "lines", "tokens")
+
+    def __init__(self, signature, lines, tokens):
+        self.signature = signature
+        self.lines = lines
+        self.tokens = tokens
+
+
+class _IndexState:
+    # Immutable snapshot of the merged index; swapped in as a whole so readers
+    # never see a half-built index.
+    __slots__ = (
+        "lines", "line_docs", "line_lengths", "postings", "frequencies",
+        "vocabulary", "docs", "average_length", "term_cache",
+    )
+
+    def __init__(self, lines, line_docs, line_lengths, postings, frequencies, docs):
+        self.lines = lines
+        self.line_docs = line_docs
+        self.line_lengths = line_lengths
+        # term -> ascending line ids, and the term's count in each of them
+        self.postings = postings
+        self.frequencies = frequencies
+        self.vocabulary = list(postings)
+        self.docs = docs
+        self.average_length = sum(line_lengths) / len(line_lengths) if line_lengths else 0.0
+        # keyword -> index terms containing it, filled lazily
+        self.term_cache = {}
+
+
+class KnowledgeIndex:
+    def __init__(self, docs_path, extensions=(".txt",), check_interval=1.0):
+        self.docs_path = docs_path
+        self.extensions = extensions
+        # Minimum seconds between directory scans for changed files
+        self.check_interval = check_interval
+        self.generation = 0
+
+        self._files = {}
+        self._state = _IndexState([], [], [], {}, {}, [])
+        self._last_check = None
+        # _refresh_lock serialises rebuilds; _lock only guards swapping the
+        # rebuilt files/state/generation in, so readers never wait on a parse
+        self._refresh_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        signatures = {}
+        with os.scandir(self.docs_path) as entries:
+            for entry in entries:
+                if entry.name.endswith(self.extensions) and entry.is_file():
+                    stat = entry.stat()
+                    signatures[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def _parse(self, filename, signature):
+        lines, tokens = _read_file(os.path.join(self.docs_path, filename))
+        return _FileEntry(signature, lines, tokens)
+
+    def _parse_changed(self, names, signatures):
+        # name -> parsed entry. PDFs are slow to extract, so several changed
+        # PDFs are parsed in parallel across processes; text files inline.
+        parsed = {}
+        pdfs = [name for name in names if name.endswith(".pdf")]
+        if len(pdfs) > 1:
+            paths = {os.path.join(self.docs_path, name): name for name in pdfs}
+            for path, (lines, tokens) in ingest.map_files(_read_file, paths):
+                parsed[paths[path]] = _FileEntry(signatures[paths[path]], lines, tokens)
+        for name in names:
+            if name not in parsed:
+                parsed[name] = self._parse(name, signatures[name])
+        return parsed
+
+    def refresh(self, force=False):
+        # Re-stat the knowledge base and rebuild if anything changed. Returns
+        # True when the index was rebuilt. Request threads that find another
+        # thread already rebuilding carry on with the current state rather
+        # than waiting for the parse - except before the first build, when
+        # there is no state to carry on with; force=True always waits its turn.
+        now = time.monotonic()
+        if not force and self._last_check is not None and now - self._last_check < self.check_interval:
+            return False
+        built = self.generation
+        if not self._refresh_lock.acquire(blocking=force or not built):
+            return False
+
+        try:
+            if not force and self.generation != built:
+                # The first build landed while this thread waited for it
+                return False
+            signatures = self._scan()
+            metrics.inc("kb_files_scanned", len(signatures))
+            current = {name: entry.signature for name, entry in self._files.items()}
+            if signatures == current and not force and self.generation:
+                self._last_check = now
+                return False
+
+            changed = [
+                name for name, signature in signatures.items()
+                if force or name not in self._files or self._files[name].signature != signature
+            ]
+            parsed = self._parse_changed(changed, signatures)
+            for entry in parsed.values():
+                metrics.inc("kb_files_parsed")
+                metrics.inc("kb_lines_read", len(entry.lines))
+            files = {name: parsed.get(name) or self._files[name] for name in signatures}
+            with metrics.timed("kb_index.merge"):
+                state = self._merge(files)
+
+            with self._lock:
+                self._files = files
+                self._state = state
+                self.generation += 1
+            self._last_check = now
+            return True
+        finally:
+            self._refresh_lock.release()
+
+    def _merge(self, files):
+        # Assign global line ids in (file name, line number) order. Duplicate
+        # lines across the corpus are kept once, at their first occurrence.
+        lines, line_docs, line_lengths, postings, frequencies = [], [], [], {}, {}
+        seen = set()
+        docs = sorted(files)
+        for doc_id, name in enumerate(docs):
+            entry = files[name]
+            for clean_line, tokens in zip(entry.lines, entry.tokens):
+                if clean_line in seen:
+                    continue
+                seen.add(clean_line)
+                line_id = len(lines)
+                lines.append(clean_line)
+                line_docs.append(doc_id)
+                line_lengths.append(len(tokens))
+                for term, count in Counter(tokens).items():
+                    postings.setdefault(term, []).append(line_id)
+                    frequencies.setdefault(term, []).append(count)
+        return _IndexState(lines, line_docs, line_lengths, postings, frequencies, docs)
+
+    def snapshot(self):
+        # Current index state, refreshed first if the knowledge base changed
+        self.refresh()
+        return self._state
+
+    @staticmethod
+    def matching_terms(state, keyword):
+        # Index terms containing keyword. simple_retrieve has always matched
+        # keywords as substrings of the lowercased line ("car" matches
+        # "carbon"); a keyword made only of word characters can only occur
+        # inside a single token, so scanning the vocabulary is equivalent.
+        terms = state.term_cache.get(keyword)
+        if terms is None:
+            terms = [term for term in state.vocabulary if keyword in term]
+            state.term_cache[keyword] = terms
+        return terms
+
+    def lookup(self, state, keywords):
+        # Sorted ids of lines containing any of the keywords
+        matched = set()
+        for keyword in keywords:
+            if TOKEN_RE.fullmatch(keyword):
+                for term in self.matching_terms(state, keyword):
+                    matched.update(state.postings[term])
+            else:
+                # Keywords with spaces or punctuation can span tokens
+                matched.update(i for i, line in enumerate(state.lines) if keyword in line.lower())
+        return sorted(matched)
+
+    def retrieve(self, keywords):
+        # Matching lines in corpus order, without duplicates
+        state = self.snapshot()
+        return [state.lines[i] for i in self.lookup(state, keywords)]
+
+    def _keyword_frequencies(self, state, keyword):
+        # line id -> occurrences of keyword in that line, summed over every
+        # index term the keyword matches
+        counts = {}
+        if TOKEN_RE.fullmatch(keyword):
+            for term in self.matching_terms(state, keyword):
+                for line_id, count in zip(state.postings[term], state.frequencies[term]):
+                    counts[line_id] = counts.get(line_id, 0) + count
+        else:
+            for line_id, line in enumerate(state.lines):
+                count = line.lower().count(keyword)
+                if count:
+                    counts[line_id] = count
+        return counts
+
+    def search(self, keywords, k=5, k1=1.2, b=0.75):
+        # BM25-ranked top-k lines as (line, score) pairs. Each keyword is one
+        # query term whose frequency in a line is the number of tokens it
+        # matches. Only lines in the keywords' postings are scored, and the
+        # top k are picked with a heap; ties go to the earlier line, so the
+        # output is deterministic.
+        state = self.snapshot()
+        n_lines = len(state.lines)
+        if n_lines == 0 or k <= 0:
+            return []
+        # Every line empty of tokens (only possible for punctuation-only
+        # lines, which non-word keywords can still match): no length
+        # normalisation
+        average_length = state.average_length or 1.0
+
+        scores = {}
+        for keyword in dict.fromkeys(keywords):
+            counts = self._keyword_frequencies(state, keyword)
+            if not counts:
+                continue
+            df = len(counts)
+            idf = math.log(1 + (n_lines - df + 0.5) / (df + 0.5))
+            for line_id, tf in counts.items():
+                norm = k1 * (1 - b + b * state.line_lengths[line_id] / average_length)
+                scores[line_id] = scores.get(line_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+        top = heapq.nsmallest(k, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(state.lines[line_id], round(score, 4)) for line_id, score in top]
+
+    def __len__(self):
+        return len(self._state.lines)
@@ -0,0 +1,357 @@
+# src/kb_snapshot.py
+#
+# Precompiled knowledge-base snapshot: the KnowledgeIndex over rag_docs/
+# serialised once into a single versioned binary file, and mapped read-only
+# at runtime. Every worker that maps the same file shares its pages through
+# the OS page cache, and opening it costs a few small reads instead of
+# parsing and indexing the corpus.
+#
+# Layout (little-endian): a header (magic, format version, section count),
+# a section table (name, offset, length) and 8-byte aligned sections:
+#
+#   line_offsets u64[n+1] / lines      UTF-8 line table
+#   line_docs u32[n] / line_lengths u32[n]
+#   term_offsets u64[t+1] / terms      sorted terms, "\n"-separated
+#   post_offsets u64[t+1]              postings range of each term
+#   postings u32[] / frequencies u32[] line ids and in-line counts
+#   meta                               JSON: docs, sources, model, ...
+#   embeddings f32[n, dim]             optional, one vector per line
+#
+#   python src/kb_snapshot.py build                       # -> outputs/kb.snapshot
+#   python src/kb_snapshot.py build --embeddings          # + sentence embeddings
+#   python src/kb_snapshot.py info outputs/kb.snapshot
+#
+# Set CFA_KB_SNAPSHOT=outputs/kb.snapshot to make the agent use it.
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from ingest import SUPPORTED_EXTENSIONS
+from kb_index import TOKEN_RE, KnowledgeIndex
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_DOCS_PATH = os.path.join(BASE_DIR, "rag_docs")
+DEFAULT_SNAPSHOT_PATH = os.path.join(BASE_DIR, "outputs", "kb.snapshot")
+
+MAGIC = b"CFAKBSN\x00"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sII")
+_SECTION = struct.Struct("<16sQQ")
+_ALIGN = 8
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _string_table(strings, separator=b""):
+    # (u64 offsets, blob): string i is blob[offsets[i]:offsets[i + 1] - len(separator)]
+    encoded = [s.encode("utf-8") + separator for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return offsets, b"".join(encoded)
+
+def build_snapshot(docs_path=DEFAULT_DOCS_PATH, output=DEFAULT_SNAPSHOT_PATH, embeddings=False):
+    # Compiles the knowledge base into `output` (replaced atomically, so
+    # running workers keep their old mapping until they refresh). Returns the
+    # metadata written.
+    index = KnowledgeIndex(docs_path, extensions=SUPPORTED_EXTENSIONS)
+    index.refresh(force=True)
+    state = index.snapshot()
+
+    terms = sorted(state.postings)
+    post_offsets = np.zeros(len(terms) + 1, dtype="<u8")
+    np.cumsum([len(state.postings[term]) for term in terms], out=post_offsets[1:])
+    postings = np.fromiter(
+        (line_id for term in terms for line_id in state.postings[term]), dtype="<u4", count=int(post_offsets[-1])
+    )
+    frequencies = np.fromiter(
+        (count for term in terms for count in state.frequencies[term]), dtype="<u4", count=int(post_offsets[-1])
+    )
+    line_offsets, line_blob = _string_table(state.lines)
+    term_offsets, term_blob = _string_table(terms, separator=b"\n")
+
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "built": datetime.now().isoformat(timespec="seconds"),
+        "docs_path": os.path.abspath(docs_path),
+        "docs": state.docs,
+        "sources": {name: list(entry.signature) for name, entry in index._files.items()},
+        "lines": len(state.lines),
+        "terms": len(terms),
+        "average_length": state.average_length,
+    }
+
+    sections = [
+        ("line_offsets", line_offsets.tobytes()),
+        ("lines", line_blob),
+        ("line_docs", np.asarray(state.line_docs, dtype="<u4").tobytes()),
+        ("line_lengths", np.asarray(state.line_lengths, dtype="<u4").tobytes()),
+        ("term_offsets", term_offsets.tobytes()),
+        ("terms", term_blob),
+        ("post_offsets", post_offsets.tobytes()),
+        ("postings", postings.tobytes()),
+        ("frequencies", frequencies.tobytes()),
+    ]
+    if embeddings:
+        from rag_engine import MODEL_NAME, LazyEmbeddings
+
+        vectors = np.asarray(LazyEmbeddings(MODEL_NAME).embed_documents(list(state.lines)), dtype="<f4")
+        meta["embedding_model"] = MODEL_NAME
+        meta["embedding_dim"] = int(vectors.shape[1]) if vectors.ndim == 2 else 0
+        sections.append(("embeddings", vectors.tobytes()))
+    sections.append(("meta", json.dumps(meta).encode("utf-8")))
+
+    directory = os.path.dirname(output)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = f"{output}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        table_size = _HEADER.size + _SECTION.size * len(sections)
+        offset = -(-table_size // _ALIGN) * _ALIGN
+        entries = []
+        for name, data in sections:
+            entries.append((name, offset, len(data)))
+            offset = -(-(offset + len(data)) // _ALIGN) * _ALIGN
+
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(sections)))
+        for name, start, length in entries:
+            f.write(_SECTION.pack(name.encode("ascii"), start, length))
+        for (name, data), (_, start, _) in zip(sections, entries):
+            f.write(b"\0" * (start - f.tell()))
+            f.write(data)
+    os.replace(tmp_path, output)
+    return meta
+
+
+class _Lines:
+    # Read-only sequence of lines, decoded from the mapping on access
+    __slots__ = ("_buffer", "_offsets")
+
+    def __init__(self, buffer, offsets):
+        self._buffer = buffer
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        return str(self._buffer[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class _PostingsView:
+    # term id -> slice of a postings-aligned array
+    __slots__ = ("_values", "_offsets")
+
+    def __init__(self, values, offsets):
+        self._values = values
+        self._offsets = offsets
+
+    def __getitem__(self, term_id):
+        return self._values[self._offsets[term_id]:self._offsets[term_id + 1]]
+
+
+class _MappedState:
+    # The _IndexState protocol over a mapped snapshot. Terms are addressed by
+    # id (their position in the sorted term table) rather than by string.
+    __slots__ = (
+        "lines", "line_docs", "line_lengths", "postings", "frequencies", "docs",
+        "average_length", "term_cache", "embeddings", "meta",
+        "_mm", "_terms", "_term_offsets",
+    )
+
+    def __init__(self, mm):
+        magic, version, count = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise SnapshotError("Not a knowledge-base snapshot")
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f"Snapshot format {version} is not supported (expected {FORMAT_VERSION})")
+        sections = {}
+        for i in range(count):
+            name, offset, length = _SECTION.unpack_from(mm, _HEADER.size + i * _SECTION.size)
+            sections[name.rstrip(b"\0").decode("ascii")] = (offset, length)
+
+        def array(name, dtype):
+            offset, length = sections[name]
+            return np.frombuffer(mm, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+        def blob(name):
+            offset, length = sections[name]
+            return memoryview(mm)[offset:offset + length]
+
+        self._mm = mm
+        self.meta = json.loads(bytes(blob("meta")))
+        self.lines = _Lines(blob("lines"), array("line_offsets", "<u8"))
+        self.line_docs = array("line_docs", "<u4")
+        # A memoryview rather than an ndarray so BM25 scoring sees plain ints
+        self.line_lengths = blob("line_lengths").cast("I")
+        self._terms = sections["terms"]
+        self._term_offsets = array("term_offsets", "<u8")
+        post_offsets = array("post_offsets", "<u8")
+        self.postings = _PostingsView(array("postings", "<u4"), post_offsets)
+        self.frequencies = _PostingsView(array("frequencies", "<u4"), post_offsets)
+        self.docs = self.meta["docs"]
+        self.average_length = self.meta["average_length"]
+        self.term_cache = {}
+        self.embeddings = None
+        if "embeddings" in sections:
+            self.embeddings = array("embeddings", "<f4").reshape(len(self.lines), self.meta["embedding_dim"])
+
+    def terms_containing(self, keyword):
+        # Ids of terms containing keyword, found by scanning the "\n"-separated
+        # term blob in place; terms never contain "\n", so a match cannot span
+        # two terms
+        start, length = self._terms
+        end = start + length
+        needle = keyword.encode("utf-8")
+        found = []
+        position = self._mm.find(needle, start, end) if needle else -1
+        while position != -1:
+            term_id = int(np.searchsorted(self._term_offsets, position - start, side="right")) - 1
+            found.append(term_id)
+            next_term = start + int(self._term_offsets[term_id + 1])
+            position = self._mm.find(needle, next_term, end)
+        return found
+
+
+class KnowledgeSnapshot(KnowledgeIndex):
+    # Drop-in replacement for KnowledgeIndex backed by a snapshot file.
+    # refresh() remaps the file when it has been rebuilt.
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH, check_interval=1.0):
+        self.path = path
+        self.docs_path = None
+        self.check_interval = check_interval
+        self.generation = 0
+        self._signature = None
+        self._state = None
+        self._last_check = None
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._last_check is not None and now - self._last_check < self.check_interval:
+            return False
+
+        with self._lock:
+            self._last_check = now
+            stat = os.stat(self.path)
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if signature == self._signature and not force:
+                return False
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # The previous mapping is left to the garbage collector: readers
+            # may still hold its state
+            self._state = _MappedState(mm)
+            self._signature = signature
+            self.docs_path = self._state.meta.get("docs_path")
+            self.generation += 1
+            return True
+
+    @staticmethod
+    def matching_terms(state, keyword):
+        terms = state.term_cache.get(keyword)
+        if terms is None:
+            terms = state.terms_containing(keyword)
+            state.term_cache[keyword] = terms
+        return terms
+
+    def lookup(self, state, keywords):
+        arrays = []
+        for keyword in keywords:
+            if TOKEN_RE.fullmatch(keyword):
+                arrays.extend(state.postings[term] for term in self.matching_terms(state, keyword))
+            else:
+                arrays.append(np.array(
+                    [i for i, line in enumerate(state.lines) if keyword in line.lower()], dtype="<u4"
+                ))
+        if not arrays:
+            return []
+        return np.unique(np.concatenate(arrays)).tolist()
+
+    def _keyword_frequencies(self, state, keyword):
+        if not TOKEN_RE.fullmatch(keyword):
+            return super()._keyword_frequencies(state, keyword)
+        terms = self.matching_terms(state, keyword)
+        if not terms:
+            return {}
+        line_ids = np.concatenate([state.postings[term] for term in terms])
+        counts = np.concatenate([state.frequencies[term] for term in terms])
+        unique, inverse = np.unique(line_ids, return_inverse=True)
+        totals = np.bincount(inverse, weights=counts).astype(np.int64)
+        return dict(zip(unique.tolist(), totals.tolist()))
+
+    def nearest(self, vector, k=5):
+        # Lines whose embeddings are most cosine-similar to `vector`, as
+        # (line, similarity); needs a snapshot built with --embeddings
+        state = self.snapshot()
+        if state.embeddings is None:
+            raise SnapshotError("Snapshot was built without embeddings")
+        matrix = state.embeddings
+        query = np.asarray(vector, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        similarity = (matrix @ query) / np.where(norms == 0, 1.0, norms)
+        k = min(k, len(similarity))
+        top = np.argpartition(-similarity, k - 1)[:k] if k else []
+        top = sorted(top, key=lambda i: (-similarity[i], i))
+        return [(state.lines[i], round(float(similarity[i]), 4)) for i in top]
+
+    def is_stale(self):
+        # Whether the source files changed since the snapshot was built
+        state = self.snapshot()
+        docs_path = state.meta.get("docs_path")
+        if not docs_path or not os.path.isdir(docs_path):
+            return False
+        current = {}
+        for name in os.listdir(docs_path):
+            if name.endswith(SUPPORTED_EXTENSIONS):
+                stat = os.stat(os.path.join(docs_path, name))
+                current[name] = [stat.st_mtime_ns, stat.st_size]
+        return current != state.meta.get("sources")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect the knowledge-base snapshot.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile rag_docs/ into a snapshot file")
+    build.add_argument("--docs", default=DEFAULT_DOCS_PATH)
+    build.add_argument("--output", default=DEFAULT_SNAPSHOT_PATH)
+    build.add_argument("--embeddings", action="store_true", help="also store one sentence embedding per line")
+    info = commands.add_parser("info", help="print a snapshot's metadata")
+    info.add_argument("path", nargs="?", default=DEFAULT_SNAPSHOT_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        meta = build_snapshot(args.docs, args.output, args.embeddings)
+        size = os.path.getsize(args.output)
+        print(f"Built {args.output}: {meta['lines']} lines, {meta['terms']} terms, "
+              f"{size / 1e6:.2f} MB in {time.perf_counter() - start:.2f}s")
+    else:
+        start = time.perf_counter()
+        snapshot = KnowledgeSnapshot(args.path)
+        opened = time.perf_counter() - start
+        meta = dict(snapshot.snapshot().meta)
+        meta.pop("sources", None)
+        print(json.dumps(meta, indent=2))
+        print(f"Opened in {opened * 1000:.2f} ms; stale: {snapshot.is_stale()}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
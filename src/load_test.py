@@ -0,0 +1,404 @@
+# src/load_test.py
+#
+# Local load generator: N concurrent sessions, each repeating what a user of
+# app/app.py does - calculate, read the advice, sometimes save the report and
+# sometimes download it - and per-stage throughput, latency percentiles and
+# error rates at the end. No external services are involved.
+#
+# Targets:
+#   inprocess   sessions are threads calling the same code as the app (one
+#               ReportGraph per session, a shared ReportStore), like the
+#               sessions of one Streamlit process
+#   http        sessions are keep-alive clients of the local API (api.py):
+#               --url http://127.0.0.1:8080, or no --url to start one
+#               in-process on a free port
+#
+# Inputs are drawn from a CSV of households (data/sample_inputs.csv by
+# default): "sample" replays rows, "jitter" scales every numeric value by
+# lognormal noise, "uniform" draws each value between the column's min and
+# max. Saves go to a temporary report store unless --db is given.
+#
+#   python src/load_test.py --sessions 50 --duration 30
+#   python src/load_test.py --target http --sessions 20 --iterations 100 --distribution jitter
+#   python src/load_test.py --target http --url http://127.0.0.1:8080 --json outputs/load.json
+
+import argparse
+import asyncio
+import csv
+import http.client
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from calculator import INPUT_DEFAULTS
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_INPUTS = os.path.join(BASE_DIR, "data", "sample_inputs.csv")
+
+STAGES = ("calculate", "advice", "save", "download")
+DISTRIBUTIONS = ("sample", "jitter", "uniform")
+
+
+class InputSampler:
+    def __init__(self, path=DEFAULT_INPUTS, distribution="sample", sigma=0.3):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown distribution {distribution!r} (expected one of {', '.join(DISTRIBUTIONS)})")
+        self.distribution = distribution
+        self.sigma = sigma
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            self.rows = [self._household(row) for row in csv.DictReader(f)]
+        if not self.rows:
+            raise ValueError(f"No households in {path}")
+        numeric = [name for name in INPUT_DEFAULTS if name not in ("diet", "days")]
+        self.ranges = {name: (min(r[name] for r in self.rows), max(r[name] for r in self.rows)) for name in numeric}
+
+    @staticmethod
+    def _household(row):
+        household = {}
+        for name, default in INPUT_DEFAULTS.items():
+            value = row.get(name, "")
+            if value in ("", None):
+                value = default
+            household[name] = str(value).lower() if name == "diet" else float(value)
+        return household
+
+    def sample(self, rng):
+        household = dict(rng.choice(self.rows))
+        if self.distribution == "jitter":
+            for name in self.ranges:
+                household[name] = round(household[name] * rng.lognormvariate(0, self.sigma), 2)
+        elif self.distribution == "uniform":
+            for name, (low, high) in self.ranges.items():
+                household[name] = round(rng.uniform(low, high), 2)
+            household["diet"] = rng.choice(("veg", "nonveg"))
+        return household
+
+
+# -----------------------------------------------------------------------------
+# Targets: each session object runs the four stages for one simulated user
+# -----------------------------------------------------------------------------
+
+def _saved_report(report):
+    return {
+        "breakdown": report["breakdown"],
+        "percentages": report["percentages"],
+        "highest_source": report["highest_source"],
+        "timestamp": str(datetime.now()),
+    }
+
+def _download(report):
+    # What the app's download button serialises
+    return json.dumps(_saved_report(report), indent=4)
+
+
+class InProcessTarget:
+    name = "inprocess"
+
+    def __init__(self, db_path):
+        import incremental
+        from report_store import ReportStore
+
+        self._incremental = incremental
+        self.store = ReportStore(db_path)
+
+    def session(self):
+        return _InProcessSession(self._incremental.ReportGraph(), self.store)
+
+    def close(self):
+        self.store.close()
+
+
+class _InProcessSession:
+    def __init__(self, graph, store):
+        self.graph = graph
+        self.store = store
+
+    def calculate(self, household):
+        self.graph.set_household(household)
+        return {name: self.graph.get(name) for name in ("breakdown", "percentages", "highest_source")}
+
+    def advice(self, household):
+        return self.graph.report()
+
+    def save(self, household, report):
+        self.store.save(_saved_report(report))
+
+    def download(self, report):
+        return _download(report)
+
+    def close(self):
+        pass
+
+
+class HTTPTarget:
+    name = "http"
+
+    def __init__(self, url=None, db_path=None, workers=4):
+        # Without a url, serves api.py from a background event loop
+        self._loop = None
+        if url is None:
+            url = self._start_server(db_path, workers)
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.url = url
+
+    def _start_server(self, db_path, workers):
+        from api import CarbonAPI
+
+        self._api = CarbonAPI(workers=workers, db_path=db_path)
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._api.handle, "127.0.0.1", 0))
+        port = self._server.sockets[0].getsockname()[1]
+        threading.Thread(target=self._loop.run_forever, name="cfa-load-api", daemon=True).start()
+        return f"http://127.0.0.1:{port}"
+
+    def session(self):
+        return _HTTPSession(http.client.HTTPConnection(self.host, self.port, timeout=60))
+
+    async def _shutdown(self):
+        # Stop accepting, let the handlers exit on their closed connections,
+        # and only then cancel anything still pending (e.g. pool futures)
+        self._server.close()
+        await self._api.close_connections()
+        await self._server.wait_closed()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._api.executor.shutdown()
+            if self._api._store is not None:
+                self._api._store.close()
+
+
+class _HTTPSession:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def _post(self, path, payload):
+        body = json.dumps(payload).encode("utf-8")
+        try:
+            self.connection.request("POST", path, body, {"Content-Type": "application/json"})
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnect on the next request
+            self.connection.close()
+            raise
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+        return json.loads(data)
+
+    def calculate(self, household):
+        return self._post("/calculate", household)
+
+    def advice(self, household):
+        return self._post("/report", household)
+
+    def save(self, household, report):
+        # The service recomputes (from its cache) and saves the report
+        return self._post("/save", household)
+
+    def download(self, report):
+        return _download(report)
+
+    def close(self):
+        self.connection.close()
+
+
+# -----------------------------------------------------------------------------
+# Runner
+# -----------------------------------------------------------------------------
+
+class LoadResults:
+    def __init__(self):
+        self.latencies = {stage: [] for stage in STAGES}
+        self.errors = {stage: Counter() for stage in STAGES}
+        self.iterations = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latencies, errors, iterations):
+        # Merges one session's results
+        with self._lock:
+            for stage in STAGES:
+                self.latencies[stage].extend(latencies[stage])
+                self.errors[stage].update(errors[stage])
+            self.iterations += iterations
+
+    def summary(self):
+        stages = {}
+        for stage in STAGES:
+            latencies = np.asarray(self.latencies[stage]) * 1000
+            errors = sum(self.errors[stage].values())
+            attempts = len(latencies) + errors
+            if not attempts:
+                continue
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0.0, 0.0, 0.0)
+            stages[stage] = {
+                "requests": attempts,
+                "errors": errors,
+                "error_rate": round(errors / attempts, 4),
+                "error_types": dict(self.errors[stage]),
+                "throughput": round(attempts / self.elapsed, 1) if self.elapsed else 0.0,
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+                "max_ms": round(float(latencies.max()), 3) if len(latencies) else 0.0,
+            }
+        return {
+            "iterations": self.iterations,
+            "elapsed_s": round(self.elapsed, 3),
+            "iterations_per_s": round(self.iterations / self.elapsed, 1) if self.elapsed else 0.0,
+            "stages": stages,
+        }
+
+
+def _run_session(target, sampler, results, deadline, iterations, save_rate, download_rate, think_time, seed):
+    rng = random.Random(seed)
+    latencies = {stage: [] for stage in STAGES}
+    errors = {stage: Counter() for stage in STAGES}
+    done = 0
+
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            errors[stage][type(e).__name__] += 1
+            return None
+        latencies[stage].append(time.perf_counter() - start)
+        return result
+
+    session = target.session()
+    try:
+        while (iterations is None or done < iterations) and (deadline is None or time.perf_counter() < deadline):
+            household = sampler.sample(rng)
+            # The app calculates, then renders the advice on the same run
+            if timed("calculate", session.calculate, household) is not None:
+                report = timed("advice", session.advice, household)
+                if report is not None:
+                    if rng.random() < save_rate:
+                        timed("save", session.save, household, report)
+                    if rng.random() < download_rate:
+                        timed("download", session.download, report)
+            done += 1
+            if think_time:
+                time.sleep(rng.expovariate(1 / think_time))
+    finally:
+        session.close()
+        results.record(latencies, errors, done)
+
+def run_load(target, sampler, sessions=10, duration=None, iterations=None, save_rate=0.2, download_rate=0.2,
+             think_time=0.0, ramp_up=0.0, seed=0):
+    # Runs `sessions` concurrent sessions for `duration` seconds or
+    # `iterations` iterations each (whichever ends first) and returns the
+    # LoadResults. Sessions start evenly spread over ramp_up seconds.
+    if duration is None and iterations is None:
+        raise ValueError("Give a duration, a number of iterations, or both")
+    results = LoadResults()
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else None
+    threads = []
+    for i in range(sessions):
+        thread = threading.Thread(
+            target=_run_session, name=f"cfa-load-{i}",
+            args=(target, sampler, results, deadline, iterations, save_rate, download_rate, think_time, seed + i),
+        )
+        threads.append(thread)
+        thread.start()
+        if ramp_up and sessions > 1:
+            time.sleep(ramp_up / sessions)
+    for thread in threads:
+        thread.join()
+    results.elapsed = time.perf_counter() - start
+    return results
+
+
+def format_summary(summary, sessions, target_name):
+    lines = [
+        f"{sessions} sessions against {target_name}: {summary['iterations']} iterations in "
+        f"{summary['elapsed_s']:.2f}s ({summary['iterations_per_s']:.1f}/s)",
+        f"{'stage':<10} {'requests':>9} {'req/s':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}",
+    ]
+    for stage, row in summary["stages"].items():
+        lines.append(
+            f"{stage:<10} {row['requests']:>9} {row['throughput']:>8.1f} {row['error_rate']:>6.1%} "
+            f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['max_ms']:>8.2f}"
+        )
+        if row["error_types"]:
+            lines.append("           errors: " + ", ".join(f"{name} x{n}" for name, n in row["error_types"].items()))
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent app sessions and report per-stage latency.")
+    parser.add_argument("--target", choices=("inprocess", "http"), default="inprocess")
+    parser.add_argument("--url", help="running api.py instance (http target; default: start one in-process)")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=None, help="seconds to run (default 10 without --iterations)")
+    parser.add_argument("--iterations", type=int, default=None, help="calculations per session")
+    parser.add_argument("--inputs", default=DEFAULT_INPUTS, help="household CSV to draw inputs from")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="sample")
+    parser.add_argument("--sigma", type=float, default=0.3, help="lognormal noise for --distribution jitter")
+    parser.add_argument("--save-rate", type=float, default=0.2, help="share of iterations that save the report")
+    parser.add_argument("--download-rate", type=float, default=0.2, help="share of iterations that download it")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean seconds between a session's iterations")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="seconds over which sessions start")
+    parser.add_argument("--workers", type=int, default=4, help="API worker threads when the http target starts one")
+    parser.add_argument("--db", help="report store for saves (default: a temporary database)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the summary to this JSON file")
+    args = parser.parse_args(argv)
+
+    duration = args.duration
+    if duration is None and args.iterations is None:
+        duration = 10.0
+
+    temp_dir = None
+    db_path = args.db
+    if db_path is None and args.url is None:
+        temp_dir = tempfile.mkdtemp(prefix="cfa-load-")
+        db_path = os.path.join(temp_dir, "reports.db")
+
+    sampler = InputSampler(args.inputs, args.distribution, args.sigma)
+    target = InProcessTarget(db_path) if args.target == "inprocess" else HTTPTarget(args.url, db_path, args.workers)
+    target_name = target.name if args.target == "inprocess" else target.url
+    try:
+        results = run_load(
+            target, sampler, args.sessions, duration, args.iterations, args.save_rate,
+            args.download_rate, args.think_time, args.ramp_up, args.seed,
+        )
+    finally:
+        target.close()
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    summary = results.summary()
+    print(format_summary(summary, args.sessions, target_name))
+    if args.json:
+        directory = os.path.dirname(args.json)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(args.json, "w") as f:
+            json.dump(dict(summary, sessions=args.sessions, target=target_name), f, indent=2)
+        print(f"Wrote {args.json}", file=sys.stderr)
+    failed = sum(row["errors"] for row in summary["stages"].values())
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# src/metrics.py
+#
+# Per-stage latency histograms and counters, exported in the Prometheus text
+# format, plus an optional cProfile capture of a single request.
+#
+# Off by default. Set CFA_METRICS=1 to record, and CFA_METRICS_FILE=<path> to
+# also write the metrics to a file (for node_exporter's textfile collector)
+# every CFA_METRICS_INTERVAL seconds and at exit. The HTTP API serves them at
+# GET /metrics.
+#
+# When disabled, instrument() returns the function unchanged, timed() returns
+# a shared no-op context manager and inc()/observe() return after one flag
+# check, so instrumented code pays next to nothing.
+#
+#   CFA_METRICS=1 python src/api.py
+#   curl localhost:8080/metrics
+
+import atexit
+import bisect
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+METRICS_FILE = os.environ.get("CFA_METRICS_FILE")
+ENABLED = os.environ.get("CFA_METRICS") == "1" or bool(METRICS_FILE)
+EXPORT_INTERVAL = float(os.environ.get("CFA_METRICS_INTERVAL", "15"))
+
+PREFIX = "cfa_"
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL = nullcontext()
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_collectors = []
+
+
+def enabled():
+    return ENABLED
+
+def enable(flag=True):
+    # Turns recording on or off at runtime. Functions decorated with
+    # instrument() while disabled stay uninstrumented.
+    global ENABLED
+    ENABLED = flag
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    # Adds to the counter <name>_total
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    # Records one observation in the histogram <name>
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+@contextmanager
+def _timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_duration_seconds", time.perf_counter() - start, stage=stage)
+
+def timed(stage):
+    # with metrics.timed("agent.generate_advice"): ...
+    return _timer(stage) if ENABLED else _NULL
+
+def instrument(stage):
+    # Decorator timing every call of a function as `stage`. Decided once at
+    # import time: when metrics are disabled the function is returned as is.
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe("stage_duration_seconds", time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorator
+
+def register_collector(fn):
+    # fn() -> iterable of (name, value, labels) gauges, read at render time
+    # (e.g. cache sizes that are already tracked elsewhere)
+    _collectors.append(fn)
+    return fn
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def render():
+    # All metrics in the Prometheus text exposition format (version 0.0.4)
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(buckets), total, count) for key, (buckets, total, count) in _histograms.items()}
+
+    out = io.StringIO()
+    for name in sorted({name for name, _ in counters}):
+        out.write(f"# TYPE {PREFIX}{name}_total counter\n")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                out.write(f"{PREFIX}{name}_total{_format_labels(labels)} {value}\n")
+
+    for name in sorted({name for name, _ in histograms}):
+        out.write(f"# TYPE {PREFIX}{name} histogram\n")
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                out.write(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}\n")
+            out.write(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}\n")
+            out.write(f"{PREFIX}{name}_sum{_format_labels(labels)} {total:.9f}\n")
+            out.write(f"{PREFIX}{name}_count{_format_labels(labels)} {count}\n")
+
+    gauges = {}
+    for collector in _collectors:
+        try:
+            for name, value, labels in collector():
+                gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+        except Exception:
+            continue
+    for name in sorted(gauges):
+        out.write(f"# TYPE {PREFIX}{name} gauge\n")
+        for labels, value in gauges[name]:
+            out.write(f"{PREFIX}{name}{_format_labels(labels)} {value}\n")
+    return out.getvalue()
+
+def write_file(path=None):
+    # Atomic write, so a scraper never reads a half-written file
+    path = path or METRICS_FILE
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def profiled(path=None, top=30):
+    # cProfile capture of the enclosed block (one request). Yields a dict
+    # whose "stats" entry holds the text report afterwards; the raw profile
+    # is also written to `path` if given. Profiles the calling thread only.
+    profiler = cProfile.Profile()
+    result = {}
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+        result["stats"] = out.getvalue()
+
+
+def _export_loop():
+    while True:
+        time.sleep(EXPORT_INTERVAL)
+        try:
+            write_file()
+        except OSError:
+            pass
+
+if METRICS_FILE:
+    threading.Thread(target=_export_loop, name="cfa-metrics-export", daemon=True).start()
+    atexit.register(write_file)
@@ -1,25 +1,207 @@
-from langchain_community.document_loaders import TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-
-def load_rag():
-    loaders = [
-        TextLoader("rag_docs/emission_factors.txt"),
-        TextLoader("rag_docs/carbon_reduction.txt"),
-        TextLoader("rag_docs/sustainability_standards.txt"),
-        TextLoader("rag_docs/climate_policy.txt")
-    ]
-
-    documents = []
-    for loader in loaders:
-        documents.extend(loader.load())
-
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    chunks = splitter.split_documents(documents)
-
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    vectordb = Chroma.from_documents(chunks, embeddings, persist_directory="embeddings/chroma_db")
-    vectordb.persist()
+import functools
+import hashlib
+import json
+import os
+import tempfile
+
+import ingest
+import metrics
+
+# The langchain / sentence-transformers / chromadb stack takes seconds to
+# import, so it is imported inside the functions that need it rather than
+# when this module is imported.
+
+RAG_DOCS = [
+    "rag_docs/emission_factors.txt",
+    "rag_docs/carbon_reduction.txt",
+    "rag_docs/sustainability_standards.txt",
+    "rag_docs/climate_policy.txt"
+]
+
+# Any other .txt or .pdf dropped into this directory is picked up as well
+RAG_DOCS_DIR = "rag_docs"
+
+PERSIST_DIRECTORY = "embeddings/chroma_db"
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+# Chunks embedded and added to Chroma per call
+ADD_BATCH_SIZE = 256
+
+# Per-file record of what is in the Chroma collection: the file signature it
+# was built from and the content-hash ids of its chunks
+MANIFEST_NAME = "manifest.json"
+
+
+class LazyEmbeddings:
+    # Defers loading the sentence-transformers model until something actually
+    # needs embedding, so opening an up-to-date index never loads it. Chroma
+    # only calls embed_documents / embed_query, so no base class is needed.
+    def __init__(self, model_name=MODEL_NAME):
+        self.model_name = model_name
+        self._model = None
+
+    def _get_model(self):
+        if self._model is None:
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+
+            self._model = HuggingFaceEmbeddings(model_name=self.model_name)
+        return self._model
+
+    def embed_documents(self, texts):
+        with metrics.timed("rag_engine.embed_documents"):
+            return self._get_model().embed_documents(texts)
+
+    def embed_query(self, text):
+        with metrics.timed("rag_engine.embed_query"):
+            return self._get_model().embed_query(text)
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def _chunk_id(source, text):
+    return hashlib.sha256(f"{source}\0{text}".encode("utf-8")).hexdigest()
+
+def _load_manifest(persist_directory):
+    try:
+        with open(os.path.join(persist_directory, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_manifest(persist_directory, manifest):
+    os.makedirs(persist_directory, exist_ok=True)
+    path = os.path.join(persist_directory, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def _spool_chunks(path, spool_dir):
+    # Process pool worker: streams one document's chunks to an NDJSON file in
+    # spool_dir and returns its path, so neither the worker nor the parent
+    # ever holds a whole document
+    spool_path = os.path.join(spool_dir, _chunk_id(path, "spool") + ".ndjson")
+    with open(spool_path, "w", encoding="utf-8") as f:
+        pages = ingest.iter_pages(path)
+        for text, page in ingest.iter_chunks(pages, CHUNK_SIZE, CHUNK_OVERLAP):
+            f.write(json.dumps([text, page]))
+            f.write("\n")
+    return spool_path
+
+def _chunk_batches(path, spool_path, batch_size=ADD_BATCH_SIZE):
+    # (texts, metadatas, ids) batches of a spooled document, without
+    # duplicate chunks
+    seen = set()
+    texts, metadatas, ids = [], [], []
+    with open(spool_path, "r", encoding="utf-8") as f:
+        for line in f:
+            text, page = json.loads(line)
+            chunk_id = _chunk_id(path, text)
+            if chunk_id in seen:
+                continue
+            seen.add(chunk_id)
+            texts.append(text)
+            metadatas.append({"source": path, "page": page, "chunk_hash": chunk_id})
+            ids.append(chunk_id)
+            if len(ids) >= batch_size:
+                yield texts, metadatas, ids
+                texts, metadatas, ids = [], [], []
+    if ids:
+        yield texts, metadatas, ids
+
+def _add_document(vectordb, path, spool_path, old_ids):
+    # Adds a changed document's new chunks batch by batch and returns the ids
+    # of all its chunks
+    all_ids = []
+    for texts, metadatas, ids in _chunk_batches(path, spool_path):
+        all_ids.extend(ids)
+        # Skip chunks already in the collection, e.g. after an interrupted run
+        new = [i for i, chunk_id in enumerate(ids) if chunk_id not in old_ids]
+        if new:
+            present = set(vectordb.get(ids=[ids[i] for i in new], include=[])["ids"])
+            new = [i for i in new if ids[i] not in present]
+        if new:
+            metrics.inc("rag_chunks_embedded", len(new))
+            vectordb.add_texts(
+                [texts[i] for i in new],
+                metadatas=[metadatas[i] for i in new],
+                ids=[ids[i] for i in new],
+            )
+    return all_ids
+
+def _clear_collection(vectordb, batch_size=5000):
+    # Deletes every chunk in the collection, whichever run added it, and
+    # returns how many there were
+    ids = vectordb.get(include=[])["ids"]
+    for start in range(0, len(ids), batch_size):
+        vectordb.delete(ids=ids[start:start + batch_size])
+    return len(ids)
+
+@metrics.instrument("rag_engine.load_rag")
+def load_rag(docs=None, persist_directory=PERSIST_DIRECTORY, workers=None):
+    # Opens the persistent Chroma index and brings it up to date: only chunks
+    # whose content hash is new get embedded, chunks that disappeared are
+    # deleted, and files whose mtime/size are unchanged are not even read.
+    # docs defaults to every .txt/.pdf in RAG_DOCS_DIR. Changed documents are
+    # extracted and chunked in parallel (see ingest.py) and embedded in
+    # batches as their chunks stream back.
+    from langchain_community.vectorstores import Chroma
+
+    if docs is None:
+        docs = ingest.discover(RAG_DOCS_DIR) if os.path.isdir(RAG_DOCS_DIR) else RAG_DOCS
+    settings = {
+        "model": MODEL_NAME, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "splitter": "ingest",
+    }
+
+    embeddings = LazyEmbeddings(MODEL_NAME)
+    vectordb = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+
+    manifest = _load_manifest(persist_directory)
+    files = manifest.get("files", {})
+    if manifest.get("settings") != settings:
+        # Different model or chunking, or no manifest at all (a collection
+        # built before manifests, whose chunks have random ids nothing here
+        # records): every stored chunk is stale
+        metrics.inc("rag_chunks_deleted", _clear_collection(vectordb))
+        files = {}
+
+    signatures = {path: _file_signature(path) for path in docs}
+    metrics.inc("rag_files_scanned", len(docs))
+    changed = [path for path in docs if files.get(path, {}).get("signature") != signatures[path]]
+    removed = [path for path in files if path not in signatures]
+    if not changed and not removed and manifest.get("settings") == settings:
+        return vectordb
+
+    to_delete = []
+    for path in removed:
+        to_delete.extend(files.pop(path)["ids"])
+
+    with tempfile.TemporaryDirectory() as spool_dir:
+        spool = functools.partial(_spool_chunks, spool_dir=spool_dir)
+        for path, spool_path in ingest.map_files(spool, changed, workers):
+            old_ids = set(files.get(path, {}).get("ids", []))
+            ids = _add_document(vectordb, path, spool_path, old_ids)
+            os.remove(spool_path)
+            to_delete.extend(old_ids.difference(ids))
+            files[path] = {"signature": signatures[path], "ids": ids}
+
+    if to_delete:
+        metrics.inc("rag_chunks_deleted", len(to_delete))
+        vectordb.delete(ids=to_delete)
+
+    if hasattr(vectordb, "persist"):
+        vectordb.persist()
+    _save_manifest(persist_directory, {"settings": settings, "files": files})
 
     return vectordb
+
+# Process-wide handle so every caller shares one opened index
+_vectordb = None
+
+def get_rag():
+    global _vectordb
+    if _vectordb is None:
+        _vectordb = load_rag()
+    return _vectordb
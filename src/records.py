@@ -0,0 +1,256 @@
+# src/records.py
+#
+# Typed records for household inputs and calculator results, as an
+# alternative to ad-hoc dicts:
+#
+#   HouseholdInputs  validated once when built: unknown keys (typos such as
+#                    "petrol_liter") raise ValueError with a suggestion,
+#                    values must be finite and non-negative, diet veg/nonveg
+#   Breakdown        the seven breakdown values of calculate_total_co2
+#   Percentages      the five category shares
+#   CarbonResult     breakdown + percentages + highest_source
+#
+# All use __slots__. For millions of rows use the NumPy structured arrays
+# instead (INPUT_DTYPE / RESULT_DTYPE): input_columns() hands their fields to
+# calculate_total_co2_batch as zero-copy views, and from_buffer() maps raw
+# bytes without copying. calculate_total_co2's dict API is unchanged and
+# shares its implementation (calculator.score_household) with calculate().
+
+import difflib
+import math
+
+import numpy as np
+
+from calculator import (
+    BREAKDOWN_KEYS,
+    CATEGORIES,
+    INPUT_DEFAULTS,
+    calculate_total_co2_batch,
+    score_household,
+)
+
+DIETS = ("veg", "nonveg")
+
+INPUT_DTYPE = np.dtype([(name, "U6" if name == "diet" else "f8") for name in INPUT_DEFAULTS])
+RESULT_DTYPE = np.dtype(
+    [(key, "f8") for key in BREAKDOWN_KEYS]
+    + [(f"{category}_pct", "f8") for category in CATEGORIES]
+    + [("highest_source", f"U{max(len(category) for category in CATEGORIES)}")]
+)
+
+
+def _unknown_key_error(kind, key, known):
+    message = f"Unknown {kind} {key!r}"
+    suggestion = difflib.get_close_matches(key, known, n=1)
+    if suggestion:
+        message += f" (did you mean {suggestion[0]!r}?)"
+    return ValueError(message)
+
+
+class _Record:
+    __slots__ = ()
+    FIELDS = ()
+    KIND = "field"
+
+    def __init__(self, *args, **kwargs):
+        if len(args) > len(self.FIELDS):
+            raise TypeError(f"{type(self).__name__} takes at most {len(self.FIELDS)} values")
+        values = dict(zip(self.FIELDS, args))
+        for key, value in kwargs.items():
+            if key not in self.FIELDS:
+                raise _unknown_key_error(self.KIND, key, self.FIELDS)
+            if key in values:
+                raise TypeError(f"{type(self).__name__} got multiple values for {key!r}")
+            values[key] = value
+        for name in self.FIELDS:
+            object.__setattr__(self, name, self._check(name, values.get(name, self._default(name))))
+
+    @classmethod
+    def _trusted(cls, values):
+        # Builds a record from already validated values (e.g. array rows)
+        record = object.__new__(cls)
+        for name, value in zip(cls.FIELDS, values):
+            object.__setattr__(record, name, value)
+        return record
+
+    def _default(self, name):
+        return 0.0
+
+    def _check(self, name, value):
+        return float(value)
+
+    @classmethod
+    def from_dict(cls, data, allow_extra=False):
+        # allow_extra keeps unrelated keys (e.g. household_id) from failing
+        # validation, but a key that looks like a misspelt field still does
+        unknown = [key for key in data if key not in cls.FIELDS]
+        for key in unknown:
+            if not allow_extra or difflib.get_close_matches(key, cls.FIELDS, n=1):
+                raise _unknown_key_error(cls.KIND, key, cls.FIELDS)
+        return cls(**{key: value for key, value in data.items() if key in cls.FIELDS})
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def astuple(self):
+        return tuple(getattr(self, name) for name in self.FIELDS)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.astuple() == self.astuple()
+
+    def __hash__(self):
+        return hash(self.astuple())
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS)
+        return f"{type(self).__name__}({fields})"
+
+
+class HouseholdInputs(_Record):
+    __slots__ = tuple(INPUT_DEFAULTS)
+    FIELDS = tuple(INPUT_DEFAULTS)
+    KIND = "input"
+
+    def _default(self, name):
+        return INPUT_DEFAULTS[name]
+
+    def _check(self, name, value):
+        if name == "diet":
+            diet = str(value).lower()
+            if diet not in DIETS:
+                raise ValueError(f"Invalid diet {value!r} (expected one of {', '.join(DIETS)})")
+            return diet
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a number, got {value!r}")
+        if not math.isfinite(number) or number < 0:
+            raise ValueError(f"{name} must be a finite, non-negative number, got {value!r}")
+        return number
+
+
+class Breakdown(_Record):
+    __slots__ = tuple(BREAKDOWN_KEYS)
+    FIELDS = tuple(BREAKDOWN_KEYS)
+    KIND = "breakdown key"
+
+
+class Percentages(_Record):
+    __slots__ = tuple(CATEGORIES)
+    FIELDS = tuple(CATEGORIES)
+    KIND = "category"
+
+
+class CarbonResult:
+    __slots__ = ("breakdown", "percentages", "highest_source")
+
+    def __init__(self, breakdown, percentages, highest_source):
+        self.breakdown = breakdown
+        self.percentages = percentages
+        self.highest_source = highest_source
+
+    def as_dicts(self):
+        # The (breakdown, percentages, highest_source) tuple returned by
+        # calculate_total_co2
+        return self.breakdown.to_dict(), self.percentages.to_dict(), self.highest_source
+
+    def to_row(self):
+        return self.breakdown.astuple() + self.percentages.astuple() + (self.highest_source,)
+
+    @classmethod
+    def from_row(cls, row):
+        values = tuple(row)
+        n = len(BREAKDOWN_KEYS)
+        return cls(
+            Breakdown._trusted(float(value) for value in values[:n]),
+            Percentages._trusted(float(value) for value in values[n:n + len(CATEGORIES)]),
+            str(values[-1]),
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, CarbonResult) and other.to_row() == self.to_row()
+
+    def __repr__(self):
+        return f"CarbonResult({self.breakdown!r}, {self.percentages!r}, {self.highest_source!r})"
+
+
+def calculate(inputs):
+    # calculate_total_co2 on a HouseholdInputs, returning a CarbonResult
+    values, shares, highest_source = score_household(*inputs.astuple())
+    return CarbonResult(Breakdown._trusted(values), Percentages._trusted(shares), highest_source)
+
+def calculate_checked(user_inputs):
+    # calculate_total_co2 with boundary validation: same dict in and out, but
+    # unknown keys and invalid values raise ValueError instead of being
+    # silently ignored or defaulted
+    return calculate(HouseholdInputs.from_dict(user_inputs)).as_dicts()
+
+
+# -----------------------------------------------------------------------------
+# Structured arrays
+# -----------------------------------------------------------------------------
+
+def inputs_to_array(records):
+    # HouseholdInputs (or dicts, validated here) -> INPUT_DTYPE array
+    rows = [
+        (record if isinstance(record, HouseholdInputs) else HouseholdInputs.from_dict(record)).astuple()
+        for record in records
+    ]
+    return np.array(rows, dtype=INPUT_DTYPE)
+
+def array_to_inputs(array):
+    return [HouseholdInputs._trusted(row.tolist()) for row in array]
+
+def validate_array(array):
+    # Vectorized HouseholdInputs validation for a whole INPUT_DTYPE array;
+    # raises ValueError naming the first bad row
+    for name in INPUT_DEFAULTS:
+        column = array[name]
+        if name == "diet":
+            bad = (column != "veg") & (column != "nonveg")
+            if bad.any():
+                # Only rows that are not already lower case pay for lower()
+                bad[bad] = ~np.isin(np.char.lower(column[bad]), DIETS)
+        else:
+            bad = ~np.isfinite(column) | (column < 0)
+        if bad.any():
+            row = int(np.argmax(bad))
+            raise ValueError(f"Invalid {name} in row {row}: {column[row]!r}")
+    return array
+
+def input_columns(array):
+    # Field name -> zero-copy view of the column, as accepted by
+    # calculate_total_co2_batch and build_feature_matrix
+    return {name: array[name] for name in array.dtype.names}
+
+def from_buffer(buffer, dtype=INPUT_DTYPE):
+    # Zero-copy view of raw record bytes (e.g. an mmap or a file read)
+    return np.frombuffer(buffer, dtype=dtype)
+
+def calculate_array(array):
+    # INPUT_DTYPE array -> RESULT_DTYPE array
+    breakdown, percentages, highest_source = calculate_total_co2_batch(input_columns(array))
+    return results_to_array(breakdown, percentages, highest_source)
+
+def results_to_array(breakdown, percentages, highest_source):
+    # calculate_total_co2_batch output -> RESULT_DTYPE array
+    out = np.empty(len(highest_source), dtype=RESULT_DTYPE)
+    for key in BREAKDOWN_KEYS:
+        out[key] = breakdown[key]
+    for category in CATEGORIES:
+        out[f"{category}_pct"] = percentages[category]
+    out["highest_source"] = highest_source
+    return out
+
+def result_columns(array):
+    # RESULT_DTYPE array -> (breakdown, percentages, highest_source) of
+    # zero-copy column views, the shape calculate_total_co2_batch returns
+    breakdown = {key: array[key] for key in BREAKDOWN_KEYS}
+    percentages = {category: array[f"{category}_pct"] for category in CATEGORIES}
+    return breakdown, percentages, array["highest_source"]
+
+def array_to_results(array):
+    return [CarbonResult.from_row(row.tolist()) for row in array]
@@ -0,0 +1,291 @@
+# src/report_store.py
+#
+# Report storage backed by a single SQLite database in WAL mode, replacing
+# one pretty-printed JSON file per save. Saves are buffered and written in
+# batches (one transaction per batch), and reports are indexed on timestamp
+# and highest_source so range queries never scan every report.
+#
+# The store also keeps one KLL quantile sketch per metric (monthly total and
+# each category) so "how do I compare?" percentiles never rescan reports.
+# Each process accumulates a delta sketch and merges it into the persisted
+# one inside the flush transaction, so workers combine correctly.
+#
+#   python src/report_store.py migrate     # import outputs/user_reports/*.json
+
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import metrics
+from sketches import KLLSketch
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, "outputs", "reports.db")
+LEGACY_REPORTS_DIR = os.path.join(BASE_DIR, "outputs", "user_reports")
+
+CATEGORIES = ["electricity", "transport", "food", "waste", "water"]
+SKETCH_METRICS = ["monthly_total"] + CATEGORIES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    highest_source TEXT NOT NULL,
+    monthly_total REAL,
+    yearly_total REAL,
+    electricity REAL,
+    transport REAL,
+    food REAL,
+    waste REAL,
+    water REAL,
+    payload TEXT NOT NULL,
+    source TEXT UNIQUE
+);
+CREATE INDEX IF NOT EXISTS idx_reports_timestamp ON reports (timestamp);
+CREATE INDEX IF NOT EXISTS idx_reports_highest_source ON reports (highest_source, timestamp);
+CREATE TABLE IF NOT EXISTS sketches (
+    metric TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+"""
+
+INSERT_SQL = (
+    "INSERT OR IGNORE INTO reports (timestamp, highest_source, monthly_total, yearly_total, "
+    "electricity, transport, food, waste, water, payload, source) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def _report_row(report, source=None):
+    breakdown = report["breakdown"]
+    return (
+        report["timestamp"],
+        report["highest_source"],
+        breakdown.get("monthly_total"),
+        breakdown.get("yearly_total"),
+        *(breakdown.get(category) for category in CATEGORIES),
+        json.dumps(report, separators=(",", ":")),
+        source,
+    )
+
+
+def _sketch_values(row):
+    # Metric values of a _report_row, in SKETCH_METRICS order
+    return (row[2],) + row[4:9]
+
+
+class ReportStore:
+    def __init__(self, path=DEFAULT_DB_PATH, flush_size=64, flush_interval=1.0):
+        # Buffered saves are written once flush_size reports are pending, or
+        # at most flush_interval seconds after the first pending save.
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+        self._buffer = []
+        self._timer = None
+        self._lock = threading.RLock()
+        self._deltas = self._empty_sketches()
+        self._backfill_sketches()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _empty_sketches():
+        return {metric: KLLSketch() for metric in SKETCH_METRICS}
+
+    def _backfill_sketches(self):
+        # Stores created before sketches existed get them built once here;
+        # afterwards they are maintained incrementally on every save. The
+        # check is repeated under BEGIN IMMEDIATE so two processes opening
+        # the same store cannot both backfill it and count every report twice.
+        if self._conn.execute("SELECT 1 FROM sketches LIMIT 1").fetchone():
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not self._conn.execute("SELECT 1 FROM sketches LIMIT 1").fetchone():
+                    sketches = self._empty_sketches()
+                    cursor = self._conn.execute(f"SELECT {', '.join(SKETCH_METRICS)} FROM reports")
+                    for row in cursor:
+                        self._add_to_sketches(sketches, row)
+                    self._merge_sketches(sketches)
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    @staticmethod
+    def _add_to_sketches(sketches, values):
+        for metric, value in zip(SKETCH_METRICS, values):
+            if value is not None:
+                sketches[metric].update(value)
+
+    def save(self, report, source=None):
+        with self._lock:
+            row = _report_row(report, source)
+            self._buffer.append(row)
+            if source is None:
+                # Rows with a source may turn out to be duplicates; they are
+                # added to the sketches at flush time, once inserted
+                self._add_to_sketches(self._deltas, _sketch_values(row))
+            if len(self._buffer) >= self.flush_size:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self, force=False):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if (not self._buffer and not force) or self._conn is None:
+                return 0
+            rows, deltas = self._buffer, self._deltas
+
+            # IMMEDIATE takes the write lock up front so the sketch
+            # read-merge-write cannot interleave with another process
+            start = time.perf_counter()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(INSERT_SQL, [row for row in rows if row[-1] is None])
+                inserted = self._empty_sketches()
+                for row in rows:
+                    if row[-1] is not None and self._conn.execute(INSERT_SQL, row).rowcount == 1:
+                        self._add_to_sketches(inserted, _sketch_values(row))
+                self._merge_sketches(deltas, inserted)
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                metrics.inc("report_flush_errors")
+                raise
+            # Detached only once committed: after a failed flush (e.g.
+            # SQLITE_BUSY from another writer) the rows and sketch deltas stay
+            # pending for the next one
+            self._buffer = []
+            self._deltas = self._empty_sketches()
+            metrics.observe("stage_duration_seconds", time.perf_counter() - start, stage="report_store.flush")
+            metrics.inc("reports_written", len(rows))
+            metrics.inc("report_bytes_written", sum(len(row[9]) for row in rows))
+            return len(rows)
+
+    def _merge_sketches(self, *deltas):
+        for metric in SKETCH_METRICS:
+            row = self._conn.execute("SELECT state FROM sketches WHERE metric = ?", (metric,)).fetchone()
+            sketch = KLLSketch.from_dict(json.loads(row[0])) if row else KLLSketch()
+            for delta in deltas:
+                sketch.merge(delta[metric])
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sketches (metric, state) VALUES (?, ?)",
+                (metric, json.dumps(sketch.to_dict(), separators=(",", ":"))),
+            )
+
+    def sketches(self):
+        # Persisted population sketches, merged across every writer
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute("SELECT metric, state FROM sketches").fetchall()
+        return {metric: KLLSketch.from_dict(json.loads(state)) for metric, state in rows}
+
+    def percentiles(self, breakdown):
+        # Percent of stored reports at or below each of this breakdown's
+        # metrics, e.g. {"monthly_total": 62.5, "electricity": 80.1, ...}
+        result = {}
+        for metric, sketch in self.sketches().items():
+            if sketch.n and breakdown.get(metric) is not None:
+                result[metric] = round(sketch.rank(breakdown[metric]) * 100, 1)
+        return result
+
+    def query(self, start=None, end=None, highest_source=None, limit=None, batch_size=1000):
+        # Reports with start <= timestamp < end (either bound optional),
+        # optionally for one highest_source, oldest first. Rows are fetched in
+        # batches so large ranges stream instead of loading at once.
+        self.flush()
+        sql, params = self._where(start, end, highest_source)
+        sql = f"SELECT id, payload FROM reports{sql} ORDER BY timestamp, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for report_id, payload in rows:
+                report = json.loads(payload)
+                report["id"] = report_id
+                yield report
+
+    def count(self, start=None, end=None, highest_source=None):
+        self.flush()
+        sql, params = self._where(start, end, highest_source)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM reports{sql}", params).fetchone()[0]
+
+    @staticmethod
+    def _where(start, end, highest_source):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(str(start))
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(str(end))
+        if highest_source is not None:
+            clauses.append("highest_source = ?")
+            params.append(highest_source)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def migrate_json_reports(self, directory=LEGACY_REPORTS_DIR):
+        # Imports report_*.json files written by earlier versions of the app.
+        # Each file is recorded as its source, so re-running is a no-op.
+        if not os.path.isdir(directory):
+            return 0
+        imported = 0
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, filename), "r") as f:
+                    report = json.load(f)
+                self.save(report, source=filename)
+                imported += 1
+            except Exception as e:
+                print(f"Error migrating {filename}: {e}")
+        self.flush()
+        return imported
+
+    def close(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            self.flush()
+            self._conn.close()
+            self._conn = None
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["migrate"]:
+        store = ReportStore()
+        start = time.perf_counter()
+        imported = store.migrate_json_reports()
+        print(f"Imported {imported} reports in {time.perf_counter() - start:.2f}s; {store.count()} stored")
+    else:
+        print("usage: python src/report_store.py migrate")
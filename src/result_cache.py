@@ -0,0 +1,162 @@
+# src/result_cache.py
+#
+# Bounded LRU + TTL memoization of calculate_total_co2 and the agent's advice
+# functions. Keys are a canonical hash of the normalized input dict plus the
+# active emission-factor table's version (and, for advice, the knowledge-base
+# generation), so a reloaded factor file or an edited rag_docs file can never
+# serve a stale result; when either version changes the cache is cleared.
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import agent
+import calculator
+import metrics
+
+
+class LRUCache:
+    def __init__(self, maxsize=4096, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+def normalize_inputs(user_inputs):
+    # Canonical form of a calculate_total_co2 input: every known key present
+    # with its default, numbers as floats and the diet folded to the two
+    # values the calculator distinguishes. Unknown keys do not affect the
+    # result and are dropped.
+    normalized = {}
+    for key, default in calculator.INPUT_DEFAULTS.items():
+        value = user_inputs.get(key, default)
+        if key == "diet":
+            normalized[key] = "veg" if str(value).lower() == "veg" else "nonveg"
+        else:
+            normalized[key] = float(value)
+    return normalized
+
+def input_key(normalized):
+    payload = json.dumps(normalized, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def factor_version():
+    # Region, effective date and content hash of the factor table in effect
+    return calculator.active_table().version
+
+def knowledge_version():
+    # Generation of the shared knowledge-base index, refreshed first so a
+    # changed rag_docs file bumps it
+    index = agent.get_knowledge_index()
+    index.refresh()
+    return index.generation
+
+
+_cache = LRUCache()
+_versions = None
+
+def _check_versions():
+    global _versions
+    versions = (factor_version(), knowledge_version())
+    if versions != _versions:
+        if _versions is not None:
+            _cache.clear()
+        _versions = versions
+    return versions
+
+def cached_calculate(user_inputs):
+    factors, _ = _check_versions()
+    normalized = normalize_inputs(user_inputs)
+    key = ("calculate", input_key(normalized), factors)
+    result = _cache.get(key)
+    metrics.inc("cache_requests", kind="calculate", result="miss" if result is None else "hit")
+    if result is None:
+        result = calculator.calculate_total_co2(normalized)
+        _cache.put(key, result)
+    breakdown, percentages, highest_source = result
+    return dict(breakdown), dict(percentages), highest_source
+
+def _build_report(normalized):
+    breakdown, percentages, highest_source = cached_calculate(normalized)
+    return {
+        "breakdown": breakdown,
+        "percentages": percentages,
+        "highest_source": highest_source,
+        "explanation": agent.explain_decision(breakdown, percentages, highest_source),
+        "advice": agent.generate_advice(breakdown, percentages, highest_source),
+        "steps": agent.generate_actionable_steps(breakdown, percentages, highest_source),
+    }
+
+def cached_report(user_inputs, compute=None):
+    # calculate_total_co2 plus explain_decision, generate_advice and
+    # generate_actionable_steps for the same inputs, as one dict. On a miss
+    # compute(normalized inputs) builds it if given (e.g. a session's
+    # incremental.ReportGraph.update); the result is shared either way.
+    factors, knowledge = _check_versions()
+    normalized = normalize_inputs(user_inputs)
+    key = ("report", input_key(normalized), factors, knowledge)
+    report = _cache.get(key)
+    metrics.inc("cache_requests", kind="report", result="miss" if report is None else "hit")
+    if report is None:
+        report = (compute or _build_report)(normalized)
+        _cache.put(key, report)
+    return dict(report, breakdown=dict(report["breakdown"]), percentages=dict(report["percentages"]))
+
+def cache_stats():
+    return _cache.stats()
+
+@metrics.register_collector
+def _cache_gauges():
+    stats = _cache.stats()
+    yield "cache_entries", stats["size"], {}
+    yield "cache_evictions", stats["evictions"], {}
+
+def clear_cache():
+    _cache.clear()
@@ -0,0 +1,422 @@
+# src/rollups.py
+#
+# Hierarchical rollups of household emissions: households tagged with a group
+# path (e.g. district -> building) are summed into every group on the path,
+# and each group gets a breakdown, percentages and highest_source in the same
+# shape as calculate_total_co2.
+#
+# Values are held as integer hundredths of a kg - the calculator's own
+# precision - so group sums are exact and do not drift however many
+# incremental updates are applied. Building sums come from partial
+# reductions over slices of the households (in forked worker processes for
+# large inputs) merged by addition; each level above is reduced from the one
+# below. After that, changing one household applies its delta to its
+# len(levels) ancestors only, so a district table over 500k households is
+# current again in microseconds.
+#
+# Group values are sums of the households' rounded breakdowns; percentages
+# and highest_source are then derived from the sums exactly as
+# calculate_total_co2 derives them for one household.
+#
+#   python src/rollups.py outputs/scored.csv --levels district,building        # per-district table
+#   python src/rollups.py outputs/scored.csv --levels district,building --group D01
+#   python src/rollups.py --synthetic 500000 --levels district,building        # build/update timings
+
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from calculator import CATEGORIES, _round2
+from history import Column
+
+SCALE = 100
+# Below this many households per worker, reducing inline is faster than
+# forking
+MIN_ROWS_PER_WORKER = 250000
+
+
+def to_cents(breakdown):
+    # (households x categories) kg values, or one breakdown dict -> int64
+    # hundredths of a kg
+    if isinstance(breakdown, dict):
+        breakdown = [[breakdown[category] for category in CATEGORIES]]
+    return np.rint(np.asarray(breakdown, dtype=np.float64) * SCALE).astype(np.int64)
+
+def group_sums(groups, cents, n_groups):
+    # (n_groups x categories) sums of cents rows by group id. bincount sums in
+    # float64, which is exact for integers below 2**53 (~9e13 kg).
+    sums = np.empty((n_groups, len(CATEGORIES)), dtype=np.int64)
+    for c in range(len(CATEGORIES)):
+        sums[:, c] = np.rint(np.bincount(groups, weights=cents[:, c], minlength=n_groups))
+    return sums
+
+
+# Arrays a forked worker reduces a slice of; set only while the pool runs
+_SHARED = None
+
+def _partial_sums(bounds):
+    groups, cents, n_groups = _SHARED
+    start, end = bounds
+    return group_sums(groups[start:end], cents[start:end], n_groups)
+
+def reduce_groups(groups, cents, n_groups, workers=None):
+    # group_sums as partial reductions over slices of the rows, merged by
+    # addition. Forked workers inherit the arrays copy-on-write and only send
+    # back their (n_groups x categories) partials.
+    global _SHARED
+    n = len(groups)
+    workers = min(workers or os.cpu_count() or 1, max(1, n // MIN_ROWS_PER_WORKER))
+    if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return group_sums(groups, cents, n_groups)
+    _SHARED = (groups, cents, n_groups)
+    try:
+        bounds = [(n * i // workers, n * (i + 1) // workers) for i in range(workers)]
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            partials = pool.map(_partial_sums, bounds)
+    finally:
+        _SHARED = None
+    return np.sum(partials, axis=0)
+
+def score_sums(cents):
+    # (groups x categories) cents -> breakdown and percentages dicts of arrays
+    # and the highest_source array, as calculate_total_co2_batch returns them
+    values = cents / SCALE
+    monthly_cents = cents.sum(axis=1)
+    monthly_total = monthly_cents / SCALE
+    breakdown = {category: values[:, c] for c, category in enumerate(CATEGORIES)}
+    breakdown["monthly_total"] = monthly_total
+    breakdown["yearly_total"] = monthly_cents * 12 / SCALE
+
+    shares = np.zeros_like(values)
+    positive = monthly_total > 0
+    shares[positive] = _round2(values[positive] / monthly_total[positive, None] * 100)
+    percentages = {category: shares[:, c] for c, category in enumerate(CATEGORIES)}
+    # argmax returns the first maximum, as score_household does
+    highest_source = np.asarray(CATEGORIES)[np.argmax(shares, axis=1)]
+    return breakdown, percentages, highest_source
+
+
+class Rollup:
+    def __init__(self, levels, capacity=1024):
+        # levels: group names from the top down, e.g. ("district", "building")
+        if not levels:
+            raise ValueError("A rollup needs at least one level")
+        self.levels = tuple(levels)
+        self.workers = None
+
+        self.ids = []
+        self._rows = {}
+        self.cents = Column(np.int64, (len(CATEGORIES),), capacity=capacity)
+        # Leaf group (last level) of every household
+        self.leaf = Column(np.int32, capacity=capacity)
+
+        # Per level: path prefix -> group id, the paths by id, each group's
+        # parent id one level up (-1 at the top), household counts and sums
+        self._group_ids = [{} for _ in self.levels]
+        self._paths = [[] for _ in self.levels]
+        self._parents = [Column(np.int32) for _ in self.levels]
+        self._counts = [Column(np.int64) for _ in self.levels]
+        self._sums = [Column(np.int64, (len(CATEGORIES),)) for _ in self.levels]
+
+    def __len__(self):
+        return len(self._rows)
+
+    # -------------------------------------------------------------------------
+    # Groups
+    # -------------------------------------------------------------------------
+
+    def _path(self, path):
+        # Group labels as a tuple of strings, one per level
+        if isinstance(path, dict):
+            path = [path[level] for level in self.levels]
+        path = tuple(str(label) for label in path)
+        if len(path) != len(self.levels):
+            raise ValueError(f"Expected a path of {len(self.levels)} labels ({', '.join(self.levels)}), got {path!r}")
+        return path
+
+    def _group(self, level, prefix):
+        # Id of the group at `level` with path `prefix`, created (with its
+        # ancestors) if new
+        group_id = self._group_ids[level].get(prefix)
+        if group_id is None:
+            parent = self._group(level - 1, prefix[:-1]) if level else -1
+            group_id = len(self._paths[level])
+            self._group_ids[level][prefix] = group_id
+            self._paths[level].append(prefix)
+            self._parents[level].extend([parent])
+            self._counts[level].extend([0])
+            self._sums[level].extend(np.zeros((1, len(CATEGORIES)), dtype=np.int64))
+        return group_id
+
+    def _ancestors(self, leaf):
+        # Group id at each level, bottom up, for a leaf group
+        group_ids = [leaf]
+        for level in range(len(self.levels) - 1, 0, -1):
+            group_ids.append(int(self._parents[level].values[group_ids[-1]]))
+        return group_ids[::-1]
+
+    def _apply(self, leaf, delta, count):
+        for level, group_id in enumerate(self._ancestors(leaf)):
+            self._sums[level].values[group_id] += delta
+            self._counts[level].values[group_id] += count
+
+    # -------------------------------------------------------------------------
+    # Loading and updates
+    # -------------------------------------------------------------------------
+
+    def load(self, household_ids, paths, breakdown, workers=None):
+        # Bulk load into an empty rollup: household ids, one path per
+        # household and a (households x categories) kg matrix (or breakdown
+        # dict of arrays, e.g. from calculate_total_co2_batch). Sums are
+        # rebuilt from scratch with parallel partial reductions.
+        if self.ids:
+            raise ValueError("load() needs an empty rollup; use set_household to update")
+        if isinstance(breakdown, dict):
+            breakdown = np.column_stack([np.asarray(breakdown[c], dtype=np.float64) for c in CATEGORIES])
+        cents = to_cents(breakdown)
+        household_ids = [str(household_id) for household_id in household_ids]
+        if len(household_ids) != len(cents):
+            raise ValueError("household_ids and breakdown have different lengths")
+        rows = {household_id: row for row, household_id in enumerate(household_ids)}
+        if len(rows) != len(household_ids):
+            raise ValueError("Duplicate household id in load()")
+
+        last = len(self.levels) - 1
+        leaf = np.fromiter((self._group(last, self._path(path)) for path in paths), dtype=np.int32,
+                           count=len(household_ids))
+        self.ids, self._rows = household_ids, rows
+        self.cents.extend(cents)
+        self.leaf.extend(leaf)
+        self.rebuild(workers)
+        return self
+
+    def rebuild(self, workers=None):
+        # Recomputes every group's sums from the households: the leaf level
+        # by (parallel) partial reductions, each level above from the one
+        # below
+        workers = workers or self.workers
+        last = len(self.levels) - 1
+        n_leaf = len(self._paths[last])
+        self._sums[last].values[:] = reduce_groups(self.leaf.values, self.cents.values, n_leaf, workers)
+        self._counts[last].values[:] = np.bincount(self.leaf.values, minlength=n_leaf)
+        for level in range(last, 0, -1):
+            parents = self._parents[level].values
+            n_parent = len(self._paths[level - 1])
+            self._sums[level - 1].values[:] = group_sums(parents, self._sums[level].values, n_parent)
+            self._counts[level - 1].values[:] = np.rint(
+                np.bincount(parents, weights=self._counts[level].values, minlength=n_parent)
+            )
+
+    def set_household(self, household_id, breakdown, path=None):
+        # Adds a household or changes its month's breakdown (and, with path,
+        # its group): only its ancestors' sums change
+        household_id = str(household_id)
+        if not isinstance(breakdown, dict):
+            # One category row, flat or as a (1 x categories) matrix
+            breakdown = np.asarray(breakdown, dtype=np.float64).reshape(-1, len(CATEGORIES))
+            if len(breakdown) != 1:
+                raise ValueError(f"set_household takes one breakdown row of {len(CATEGORIES)} categories, "
+                                 f"got {len(breakdown)} rows")
+        cents = to_cents(breakdown)[0]
+        row = self._rows.get(household_id)
+        last = len(self.levels) - 1
+        if row is None:
+            if path is None:
+                raise ValueError(f"New household {household_id!r} needs a path")
+            leaf = self._group(last, self._path(path))
+            self._rows[household_id] = len(self.ids)
+            self.ids.append(household_id)
+            self.cents.extend(cents[None])
+            self.leaf.extend([leaf])
+            self._apply(leaf, cents, 1)
+            return
+
+        old_leaf = int(self.leaf.values[row])
+        leaf = old_leaf if path is None else self._group(last, self._path(path))
+        if leaf == old_leaf:
+            self._apply(leaf, cents - self.cents.values[row], 0)
+        else:
+            self._apply(old_leaf, -self.cents.values[row], -1)
+            self._apply(leaf, cents, 1)
+            self.leaf.values[row] = leaf
+        self.cents.values[row] = cents
+
+    def set_households(self, household_ids, breakdown):
+        # Month change for many existing households at once: deltas are
+        # summed per leaf group and pushed up the tree
+        if isinstance(breakdown, dict):
+            breakdown = np.column_stack([np.asarray(breakdown[c], dtype=np.float64) for c in CATEGORIES])
+        cents = to_cents(breakdown)
+        try:
+            rows = np.fromiter((self._rows[str(h)] for h in household_ids), dtype=np.int64, count=len(cents))
+        except KeyError as e:
+            raise KeyError(f"Unknown household {e.args[0]!r}; add it with set_household and a path")
+        if len(np.unique(rows)) != len(rows):
+            raise ValueError("Duplicate household id in set_households()")
+
+        last = len(self.levels) - 1
+        deltas = cents - self.cents.values[rows]
+        self.cents.values[rows] = cents
+        group_ids = self.leaf.values[rows]
+        for level in range(last, -1, -1):
+            np.add.at(self._sums[level].values, group_ids, deltas)
+            if level:
+                group_ids = self._parents[level].values[group_ids]
+
+    def remove_household(self, household_id):
+        # Detaches the household from its groups and drops its row (the last
+        # row moves into its place, so rows stay dense); its id can be added
+        # again later with a new path
+        household_id = str(household_id)
+        row = self._rows.pop(household_id, None)
+        if row is None:
+            raise KeyError(f"Unknown household {household_id!r}")
+        self._apply(int(self.leaf.values[row]), -self.cents.values[row], -1)
+
+        last = len(self.ids) - 1
+        if row != last:
+            moved = self.ids[last]
+            self.ids[row] = moved
+            self._rows[moved] = row
+            self.cents.values[row] = self.cents.values[last]
+            self.leaf.values[row] = self.leaf.values[last]
+        self.ids.pop()
+        self.cents.size -= 1
+        self.leaf.size -= 1
+
+    # -------------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------------
+
+    def group(self, *path):
+        # Report for one group: a path prefix of 1..len(levels) labels, or no
+        # labels for the grand total
+        path = tuple(str(label) for label in path)
+        if not path:
+            cents = self._sums[0].values.sum(axis=0)[None]
+            households = len(self._rows)
+        else:
+            level = len(path) - 1
+            group_id = self._group_ids[level].get(path) if level < len(self.levels) else None
+            if group_id is None:
+                raise KeyError(f"Unknown group {path!r}")
+            cents = self._sums[level].values[group_id][None]
+            households = int(self._counts[level].values[group_id])
+        breakdown, percentages, highest_source = score_sums(cents)
+        return {
+            "path": path,
+            "households": households,
+            "breakdown": {key: float(values[0]) for key, values in breakdown.items()},
+            "percentages": {key: float(values[0]) for key, values in percentages.items()},
+            "highest_source": str(highest_source[0]),
+        }
+
+    def table(self, level, parent=None):
+        # Every group at `level` (a name or index), optionally only those under
+        # the parent path prefix: (paths, household counts, breakdown dict,
+        # percentages dict, highest_source), all vectorized
+        level = self.levels.index(level) if isinstance(level, str) else level
+        group_ids = np.arange(len(self._paths[level]))
+        if parent:
+            parent = tuple(str(label) for label in parent)
+            group_ids = np.array([g for g in group_ids if self._paths[level][g][:len(parent)] == parent], dtype=np.int64)
+        breakdown, percentages, highest_source = score_sums(self._sums[level].values[group_ids])
+        paths = [self._paths[level][g] for g in group_ids]
+        return paths, self._counts[level].values[group_ids], breakdown, percentages, highest_source
+
+    def children(self, *path):
+        level = len(path)
+        if level >= len(self.levels):
+            return []
+        path = tuple(str(label) for label in path)
+        return [p for p in self._paths[level] if p[:level] == path]
+
+
+def read_scored(path, levels, id_column="household_id"):
+    # Household ids, paths and a kg matrix from a scored CSV (the output of
+    # stream_calculator.py, whose passthrough keeps the group columns)
+    ids, paths, values = [], [], []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        missing = [name for name in (id_column,) + tuple(levels) + tuple(CATEGORIES) if name not in reader.fieldnames]
+        if missing:
+            raise ValueError(f"{path} is missing columns: {', '.join(missing)}")
+        for row in reader:
+            ids.append(row[id_column])
+            paths.append(tuple(row[level] for level in levels))
+            values.append([float(row[category]) for category in CATEGORIES])
+    return ids, paths, np.asarray(values, dtype=np.float64).reshape(-1, len(CATEGORIES))
+
+def _synthetic(n, levels, seed=0):
+    # n households spread over ~n/50 leaf groups under 40 top-level groups
+    rng = np.random.default_rng(seed)
+    leaves = max(1, n // 50)
+    leaf = rng.integers(0, leaves, n)
+    paths = [(f"D{l % 40:02d}",) + tuple(f"L{i}-{l}" for i in range(1, len(levels))) for l in leaf]
+    values = np.round(rng.gamma(2.0, [60, 40, 50, 10, 2], size=(n, len(CATEGORIES))), 2)
+    return [f"H{i}" for i in range(n)], paths, values
+
+def _print_table(rollup, level, parent=None):
+    paths, counts, breakdown, percentages, highest = rollup.table(level, parent)
+    name = rollup.levels[level] if isinstance(level, int) else level
+    print(f"{name:<16} {'households':>10} {'monthly kg':>12} {'yearly kg':>12}  highest")
+    for i, path in enumerate(paths):
+        top = highest[i]
+        print(f"{'/'.join(path):<16} {int(counts[i]):>10} {breakdown['monthly_total'][i]:>12.2f} "
+              f"{breakdown['yearly_total'][i]:>12.2f}  {top} ({percentages[top][i]:.2f}%)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Roll household emissions up a group hierarchy.")
+    parser.add_argument("scored", nargs="?", help="scored CSV with household_id, the level columns and categories")
+    parser.add_argument("--levels", default="district,building", help="group columns, top level first")
+    parser.add_argument("--id-column", default="household_id")
+    parser.add_argument("--group", help="show the children of this path (labels joined with /)")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="time build and updates on N synthetic households")
+    parser.add_argument("--workers", type=int, default=None, help="processes for the initial reduction")
+    args = parser.parse_args(argv)
+    levels = args.levels.split(",")
+
+    if args.synthetic:
+        ids, paths, values = _synthetic(args.synthetic, levels)
+    elif args.scored:
+        ids, paths, values = read_scored(args.scored, levels, args.id_column)
+    else:
+        parser.error("give a scored CSV or --synthetic N")
+
+    start = time.perf_counter()
+    rollup = Rollup(levels).load(ids, paths, values, workers=args.workers)
+    print(f"Rolled up {len(rollup)} households into "
+          + ", ".join(f"{len(rollup._paths[i])} {level}s" for i, level in enumerate(levels))
+          + f" in {time.perf_counter() - start:.3f}s", file=sys.stderr)
+
+    if args.synthetic:
+        rng = np.random.default_rng(1)
+        picks = rng.integers(0, len(ids), 1000)
+        start = time.perf_counter()
+        for i in picks:
+            rollup.set_household(ids[i], values[i] * rng.uniform(0.8, 1.2))
+            rollup.table(0)
+        elapsed = (time.perf_counter() - start) / len(picks)
+        print(f"One household's month changed + top-level table refreshed: {elapsed * 1e6:.0f} us", file=sys.stderr)
+        start = time.perf_counter()
+        rollup.set_households([ids[i] for i in np.unique(picks)], values[np.unique(picks)])
+        print(f"{len(np.unique(picks))} households updated in one batch: "
+              f"{(time.perf_counter() - start) * 1000:.2f} ms", file=sys.stderr)
+        return
+
+    if args.group:
+        parent = tuple(args.group.split("/"))
+        if len(parent) >= len(levels):
+            print(rollup.group(*parent))
+        else:
+            _print_table(rollup, len(parent), parent)
+    else:
+        _print_table(rollup, 0)
+
+if __name__ == "__main__":
+    main()
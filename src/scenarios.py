@@ -0,0 +1,158 @@
+# src/scenarios.py
+#
+# Vectorized what-if engine over the calculator's coefficient matrix.
+#
+# A scenario is one setting of every reduction lever (e.g. cut electricity
+# 20%, move half the petrol driving to an EV, make 75% of non-veg days veg).
+# Every lever is linear in the household's input features, so a scenario
+# collapses to one weight vector w_s with monthly_total = features @ w_s.
+# Stacking the vectors gives a (scenarios x features) matrix W, and every
+# scenario for every household is a single (households x features) @ W.T.
+
+import itertools
+
+import numpy as np
+
+from calculator import (
+    FEATURE_NAMES,
+    active_table,
+    build_coefficient_matrix,
+    build_feature_matrix,
+)
+
+# Lever -> the levels it can take. Cuts are fractional reductions in a
+# category's activity; ev_share is the fraction of petrol driving moved to an
+# electric vehicle; veg_share is the fraction of non-veg days made veg.
+DEFAULT_LEVERS = {
+    "electricity_cut": (0.0, 0.1, 0.2, 0.3, 0.4, 0.5),
+    "transport_cut": (0.0, 0.1, 0.2, 0.3, 0.4, 0.5),
+    "ev_share": (0.0, 0.25, 0.5, 0.75, 1.0),
+    "veg_share": (0.0, 0.25, 0.5, 0.75, 1.0),
+    "waste_cut": (0.0, 0.1, 0.2, 0.3, 0.4, 0.5),
+    "water_cut": (0.0, 0.1, 0.2, 0.3, 0.4, 0.5),
+}
+
+# Electricity an EV needs to replace one litre of petrol: ~15 km per litre
+# for a petrol car at ~0.15 kWh per km for an EV
+EV_KWH_PER_PETROL_LITER = 2.25
+
+_F = {name: i for i, name in enumerate(FEATURE_NAMES)}
+
+
+def scenario_grid(levers=None):
+    # Every combination of lever levels, as lever -> (scenarios,) array
+    levers = levers or DEFAULT_LEVERS
+    names = list(levers)
+    combos = np.array(list(itertools.product(*(levers[name] for name in names))), dtype=float)
+    return {name: combos[:, i] for i, name in enumerate(names)}
+
+def _factors(factors):
+    # (factor dict, per-feature monthly-total weights) for the given factors,
+    # or the registry's active table and its compiled total vector
+    if factors is None:
+        table = active_table()
+        return table.factors, table.total_vector
+    return factors, build_coefficient_matrix(factors).sum(axis=1)
+
+def scenario_weights(grid, factors=None):
+    # (scenarios x features) matrix W: W[s] @ features = monthly total under
+    # scenario s
+    factors, per_feature = _factors(factors)
+    n = len(next(iter(grid.values())))
+
+    def lever(name):
+        return grid.get(name, np.zeros(n))
+
+    keep_electricity = 1 - lever("electricity_cut")
+    keep_transport = 1 - lever("transport_cut")
+    ev = lever("ev_share")
+    veg = lever("veg_share")
+
+    weights = np.tile(per_feature, (n, 1))
+    weights[:, _F["electricity_kwh"]] *= keep_electricity
+    for name in ("diesel_liters", "bus_km", "train_km", "flight_km"):
+        weights[:, _F[name]] *= keep_transport
+    # Remaining petrol driving, plus the EV share charged from the grid
+    weights[:, _F["petrol_liters"]] = keep_transport * (
+        (1 - ev) * factors["petrol_liter"] + ev * EV_KWH_PER_PETROL_LITER * factors["electricity_kwh"]
+    )
+    weights[:, _F["nonveg_days"]] = (1 - veg) * factors["nonveg_day"] + veg * factors["veg_day"]
+    for name in ("plastic_kg", "ewaste_kg"):
+        weights[:, _F[name]] *= 1 - lever("waste_cut")
+    weights[:, _F["water_m3"]] *= 1 - lever("water_cut")
+    return weights
+
+def scenario_effort(grid):
+    # How much change a plan asks for: the sum of its lever levels (rounded
+    # so equal-effort plans compare equal despite float sums)
+    return np.round(sum(grid.values()), 6)
+
+def evaluate(user_inputs, levers=None, factors=None):
+    # Monthly totals for every household under every scenario. Returns
+    # (grid, baseline (households,), totals (households x scenarios)).
+    grid = scenario_grid(levers)
+    features = build_feature_matrix(user_inputs)
+    factors, per_feature = _factors(factors)
+    baseline = features @ per_feature
+    totals = features @ scenario_weights(grid, factors).T
+    return grid, baseline, totals
+
+def pareto_front(saved, effort):
+    # Indices of plans that save something and are not dominated on (more
+    # CO2 saved, less effort), best saving first
+    order = np.lexsort((-saved, effort))
+    front, best = [], 0.0
+    for i in order:
+        if saved[i] > best + 1e-9:
+            front.append(i)
+            best = saved[i]
+    return sorted(front, key=lambda i: (-saved[i], effort[i]))
+
+def pareto_plans(user_inputs, top=5, max_effort=None, levers=None, factors=None):
+    # Pareto-best reduction plans for one household dict within an optional
+    # effort budget, ranked by CO2 saved. Only levers a plan actually uses
+    # are listed.
+    grid, baseline, totals = evaluate(
+        {key: [value] for key, value in user_inputs.items()}, levers, factors
+    )
+    saved = baseline[0] - totals[0]
+    effort = scenario_effort(grid)
+    if max_effort is not None:
+        saved = np.where(effort <= max_effort + 1e-9, saved, -np.inf)
+
+    plans = []
+    for i in pareto_front(saved, effort)[:top]:
+        plans.append({
+            "levers": {name: float(values[i]) for name, values in grid.items() if values[i]},
+            "monthly_saved": round(float(saved[i]), 2),
+            "yearly_saved": round(float(saved[i]) * 12, 2),
+            "saved_pct": round(float(saved[i] / baseline[0] * 100), 2) if baseline[0] > 0 else 0,
+            "effort": round(float(effort[i]), 2),
+        })
+    return plans
+
+def best_plans_batch(user_inputs, max_effort=None, levers=None, factors=None, block_size=4096):
+    # For the nightly batch: the scenario saving the most CO2 per household,
+    # optionally within an effort budget. Households are processed in blocks
+    # to bound the (households x scenarios) intermediate. Returns the grid,
+    # best scenario index per household and its monthly saving.
+    grid = scenario_grid(levers)
+    factors, per_feature = _factors(factors)
+    weights = scenario_weights(grid, factors)
+    if max_effort is not None:
+        allowed = scenario_effort(grid) <= max_effort + 1e-9
+        weights = weights[allowed]
+        allowed_index = np.flatnonzero(allowed)
+    else:
+        allowed_index = np.arange(weights.shape[0])
+
+    features = build_feature_matrix(user_inputs)
+    best = np.empty(features.shape[0], dtype=np.intp)
+    saved = np.empty(features.shape[0])
+    for start in range(0, features.shape[0], block_size):
+        block = features[start:start + block_size]
+        totals = block @ weights.T
+        choice = totals.argmin(axis=1)
+        best[start:start + block_size] = allowed_index[choice]
+        saved[start:start + block_size] = block @ per_feature - totals[np.arange(len(block)), choice]
+    return grid, best, saved
@@ -0,0 +1,96 @@
+# src/sketches.py
+#
+# KLL streaming quantile sketch (Karnin, Lang & Liberty, 2016). Memory is
+# O(k) regardless of how many values are added, sketches built in different
+# processes can be merged, and the state round-trips through plain dicts so
+# it can be persisted as JSON. Rank error is roughly 1.7 / k (~1% at k=200).
+
+import math
+import random
+
+DEFAULT_K = 200
+_DECAY = 2 / 3
+
+
+class KLLSketch:
+    def __init__(self, k=DEFAULT_K, seed=None):
+        self.k = k
+        self.n = 0
+        # levels[h] holds items that each stand for 2**h original values
+        self.levels = [[]]
+        self._random = random.Random(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * _DECAY ** depth)))
+
+    def _size(self):
+        return sum(len(items) for items in self.levels)
+
+    def _max_size(self):
+        return sum(self._capacity(level) for level in range(len(self.levels)))
+
+    def update(self, value):
+        self.levels[0].append(float(value))
+        self.n += 1
+        if self._size() > self._max_size():
+            self._compress()
+
+    def _compress(self):
+        # Compact the lowest over-full level: sort it and promote every other
+        # item (random offset) to the next level with double the weight.
+        while self._size() > self._max_size():
+            for level, items in enumerate(self.levels):
+                if len(items) >= self._capacity(level):
+                    if level + 1 == len(self.levels):
+                        self.levels.append([])
+                    items.sort()
+                    # An odd item out stays behind at this level
+                    keep = [items.pop()] if len(items) % 2 else []
+                    offset = self._random.randint(0, 1)
+                    self.levels[level + 1].extend(items[offset::2])
+                    self.levels[level] = keep
+                    break
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.n += other.n
+        self._compress()
+        return self
+
+    def rank(self, value):
+        # Estimated fraction of added values <= value
+        if self.n == 0:
+            return 0.0
+        weight = 0
+        for level, items in enumerate(self.levels):
+            weight += sum(1 for item in items if item <= value) << level
+        return min(1.0, weight / self.n)
+
+    def quantile(self, q):
+        if self.n == 0:
+            return None
+        weighted = sorted(
+            (item, 1 << level) for level, items in enumerate(self.levels) for item in items
+        )
+        total = sum(weight for _, weight in weighted)
+        target = q * total
+        running = 0
+        for item, weight in weighted:
+            running += weight
+            if running >= target:
+                return item
+        return weighted[-1][0]
+
+    def to_dict(self):
+        return {"k": self.k, "n": self.n, "levels": self.levels}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(k=state["k"])
+        sketch.n = state["n"]
+        sketch.levels = [list(items) for items in state["levels"]] or [[]]
+        return sketch
@@ -0,0 +1,66 @@
+# src/startup.py
+#
+# Startup timing for the app and services. Lazy loaders record how long each
+# first-use load took (timed), and importtime_report() runs the equivalent of
+# `python -X importtime` in a child process so import regressions show up as
+# a ranked table.
+#
+#   python src/startup.py                 # report for the app's modules
+#   python src/startup.py pandas numpy    # report for specific modules
+
+import os
+import re
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+PROCESS_START = time.perf_counter()
+
+# Modules the Streamlit app loads, in the order it loads them
+APP_MODULES = ["streamlit", "calculator", "agent", "pandas"]
+
+# (stage, seconds since process start, duration) for every timed load
+_stages = []
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stages.append((stage, start - PROCESS_START, time.perf_counter() - start))
+
+def stages():
+    return list(_stages)
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def importtime_report(modules=None, top=15):
+    # Import each module in a fresh interpreter with -X importtime and return
+    # the `top` slowest imports as (module, self_ms, cumulative_ms, depth).
+    modules = modules or APP_MODULES
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([src_dir, os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "; ".join(f"import {m}" for m in modules)],
+        capture_output=True, text=True, env=env,
+    )
+
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us) / 1000, int(cumulative_us) / 1000, (len(indent) - 1) // 2))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:top]
+
+def format_report(rows):
+    lines = [f"{'cumulative ms':>14} {'self ms':>9}  module"]
+    for module, self_ms, cumulative_ms, depth in rows:
+        lines.append(f"{cumulative_ms:14.1f} {self_ms:9.1f}  {'  ' * depth}{module}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    print(format_report(importtime_report(sys.argv[1:] or None)))
@@ -0,0 +1,183 @@
+# src/stream_calculator.py
+#
+# Out-of-core scoring of household files (CSV or NDJSON, optionally gzipped).
+# The input is read in fixed-size chunks, each chunk is scored with
+# calculate_total_co2_batch and written out before the next one is read, so
+# memory is bounded by chunk_size * in-flight chunks, not by the file size.
+#
+#   python src/stream_calculator.py data/sample_inputs.csv outputs/scored.csv
+#   python src/stream_calculator.py big.ndjson.gz scored.ndjson --workers 8
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+from calculator import CATEGORIES, INPUT_DEFAULTS, calculate_total_co2_batch
+from factor_registry import DEFAULT_REGION
+
+RESULT_COLUMNS = (
+    CATEGORIES
+    + ["monthly_total", "yearly_total"]
+    + [f"{category}_pct" for category in CATEGORIES]
+    + ["highest_source"]
+)
+
+DEFAULT_CHUNK_SIZE = 50000
+
+def detect_format(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    if name.endswith(".csv"):
+        return "csv"
+    raise ValueError(f"Unsupported file type: {path} (expected .csv, .ndjson or .jsonl)")
+
+def open_text(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+def iter_chunks(handle, fmt, chunk_size):
+    # Yields (header, rows) with at most chunk_size rows. CSV rows are lists of
+    # strings (csv.reader handles quoted newlines); NDJSON rows are raw lines,
+    # left unparsed so the parsing work happens in the worker.
+    if fmt == "csv":
+        reader = csv.reader(handle)
+        header = next(reader, None)
+        if header is None:
+            return
+        source = reader
+    else:
+        header = None
+        source = (line for line in handle if line.strip())
+
+    while True:
+        rows = list(islice(source, chunk_size))
+        if not rows:
+            return
+        yield header, rows
+
+def records_to_columns(records):
+    # List of dicts -> column name -> list of values ("" where missing)
+    names = list(dict.fromkeys(key for record in records for key in record))
+    return {name: [record.get(name, "") for record in records] for name in names}
+
+def rows_to_columns(fmt, header, rows):
+    if fmt == "csv":
+        return {name: [row[i] if i < len(row) else "" for row in rows] for i, name in enumerate(header)}
+    return records_to_columns([json.loads(line) for line in rows])
+
+def score_columns(columns, n):
+    # Scores n households given as raw columns. Returns the output column
+    # names and the result rows: passthrough columns (anything that is not a
+    # calculator input, e.g. household_id) followed by RESULT_COLUMNS.
+    inputs = {}
+    for name, default in INPUT_DEFAULTS.items():
+        if name not in columns:
+            continue
+        values = [default if value in ("", None) else value for value in columns[name]]
+        inputs[name] = np.asarray(values, dtype=str if name == "diet" else float)
+    if not inputs:
+        inputs = {"days": np.full(n, 30.0)}
+    # An optional region column picks each household's factor table (blank:
+    # the default region); it is passed through to the output as well
+    region = None
+    if "region" in columns:
+        region = np.asarray([value or DEFAULT_REGION for value in columns["region"]], dtype=str)
+    breakdown, percentages, highest = calculate_total_co2_batch(inputs, region=region)
+
+    results = {key: breakdown[key].tolist() for key in CATEGORIES + ["monthly_total", "yearly_total"]}
+    for category in CATEGORIES:
+        results[f"{category}_pct"] = percentages[category].tolist()
+    results["highest_source"] = highest.tolist()
+
+    passthrough = [name for name in columns if name not in INPUT_DEFAULTS]
+    names = passthrough + RESULT_COLUMNS
+    values = [columns[name] for name in passthrough] + [results[name] for name in RESULT_COLUMNS]
+    return names, zip(*values)
+
+def score_rows(fmt, header, rows, out_fmt, with_header):
+    # Worker entry point: parse, score and serialise one chunk. Returns the
+    # encoded output text and the number of rows scored.
+    names, results = score_columns(rows_to_columns(fmt, header, rows), len(rows))
+
+    out = io.StringIO()
+    if out_fmt == "csv":
+        writer = csv.writer(out, lineterminator="\n")
+        if with_header:
+            writer.writerow(names)
+        writer.writerows(results)
+    else:
+        for values in results:
+            out.write(json.dumps(dict(zip(names, values))))
+            out.write("\n")
+    return out.getvalue(), len(rows)
+
+def stream_file(input_path, output_path, chunk_size=DEFAULT_CHUNK_SIZE, workers=1, progress=None):
+    fmt = detect_format(input_path)
+    out_fmt = detect_format(output_path)
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    total = 0
+    with open_text(input_path, "r") as src, open_text(output_path, "w") as dst:
+        chunks = iter_chunks(src, fmt, chunk_size)
+
+        if workers <= 1:
+            for i, (header, rows) in enumerate(chunks):
+                text, n = score_rows(fmt, header, rows, out_fmt, i == 0)
+                dst.write(text)
+                total += n
+                if progress:
+                    progress(total)
+            return total
+
+        # Keep at most 2 chunks per worker in flight and write results back in
+        # input order, so memory stays bounded however large the file is.
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = []
+            for i, (header, rows) in enumerate(chunks):
+                pending.append(pool.submit(score_rows, fmt, header, rows, out_fmt, i == 0))
+                if len(pending) >= workers * 2:
+                    text, n = pending.pop(0).result()
+                    dst.write(text)
+                    total += n
+                    if progress:
+                        progress(total)
+            for future in pending:
+                text, n = future.result()
+                dst.write(text)
+                total += n
+                if progress:
+                    progress(total)
+    return total
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a household CSV/NDJSON file in bounded memory.")
+    parser.add_argument("input", help="input file (.csv, .ndjson or .jsonl, optionally .gz)")
+    parser.add_argument("output", help="output file (.csv, .ndjson or .jsonl, optionally .gz)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per chunk")
+    parser.add_argument("--workers", type=int, default=1, help="process pool size (1 = score inline)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+
+    def report(done):
+        elapsed = time.perf_counter() - start
+        print(f"\r{done} rows ({done / max(elapsed, 1e-9):.0f} rows/s)", end="", file=sys.stderr)
+
+    total = stream_file(args.input, args.output, args.chunk_size, args.workers, progress=report)
+    print(f"\nScored {total} households in {time.perf_counter() - start:.2f}s -> {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
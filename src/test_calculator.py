@@ -1,4 +1,8 @@
-from calculator import calculate_total_co2
+import random
+
+import numpy as np
+
+from calculator import BREAKDOWN_KEYS, CATEGORIES, _round2, calculate_total_co2, calculate_total_co2_batch
 
 user = {
     "electricity_kwh": 300,
@@ -8,7 +12,70 @@ user = {
     "water_m3": 10
 }
 
-breakdown, percentages, highest = calculate_total_co2(user)
-print("Breakdown:", breakdown)
-print("Percentages:", percentages)
-print("Highest source:", highest)
+
+def assert_batch_matches_scalar(households):
+    # calculate_total_co2_batch over the households must equal
+    # calculate_total_co2 on each of them, bit for bit
+    columns = {key: [household[key] for household in households] for key in households[0]}
+    b_breakdown, b_percentages, b_highest = calculate_total_co2_batch(columns)
+    for i, household in enumerate(households):
+        breakdown, percentages, highest = calculate_total_co2(household)
+        for key in BREAKDOWN_KEYS:
+            assert float(b_breakdown[key][i]) == breakdown[key], (household, key, b_breakdown[key][i], breakdown[key])
+        for key in CATEGORIES:
+            assert float(b_percentages[key][i]) == percentages[key], (household, key, b_percentages[key][i], percentages[key])
+        assert b_highest[i] == highest, (household, b_highest[i], highest)
+
+def test_batch_matches_scalar_random():
+    rng = random.Random(0)
+    households = []
+    for _ in range(5000):
+        households.append({
+            "electricity_kwh": round(rng.uniform(0, 1500), rng.choice([0, 1, 2])),
+            "petrol_liters": round(rng.uniform(0, 120), 2),
+            "diesel_liters": rng.choice([0, round(rng.uniform(0, 80), 1)]),
+            "bus_km": rng.choice([0, rng.randint(0, 600)]),
+            "train_km": rng.choice([0, rng.randint(0, 2000)]),
+            "flight_km": rng.choice([0, rng.randint(0, 5000)]),
+            # Case-insensitive, as diet_type.lower() == "veg"
+            "diet": rng.choice(["veg", "Veg", "VEG", "nonveg", "NonVeg", "vegan"]),
+            "plastic_kg": round(rng.uniform(0, 10), 2),
+            "ewaste_kg": rng.choice([0, round(rng.uniform(0, 3), 2)]),
+            "water_m3": round(rng.uniform(0, 30), 2),
+            "days": rng.choice([30, 31, 28, rng.randint(0, 31)]),
+        })
+    assert_batch_matches_scalar(households)
+
+def test_batch_matches_scalar_on_rounding_ties():
+    # Every kWh in 0.01 steps: many products land on (or a rounding error
+    # away from) a .xx5 tie, which np.round alone gets wrong
+    households = [dict(user, electricity_kwh=i / 100) for i in range(0, 200000, 7)]
+    assert_batch_matches_scalar(households)
+
+def test_batch_zero_total():
+    # No emissions at all: percentages are 0 and the first category wins
+    households = [dict(user, electricity_kwh=0, petrol_liters=0, plastic_kg=0, water_m3=0, days=0)]
+    assert_batch_matches_scalar(households)
+    breakdown, percentages, highest = calculate_total_co2(households[0])
+    assert breakdown["monthly_total"] == 0 and highest == "electricity"
+
+def test_round2_matches_builtin_round():
+    # Ties that only exist through binary rounding error in x * 100, where
+    # np.round and round() disagree
+    edge_cases = [1249.845, 2.675, 1.005, 0.125, 0.375, 1.115, 10.005, 33.335, -2.675, -1249.845, 0.0, 1e-9]
+    assert np.round(1249.845, 2) != round(1249.845, 2)
+    values = np.array(edge_cases + [k / 1000 for k in range(5, 2000000, 10)])
+    expected = [round(value, 2) for value in values.tolist()]
+    assert _round2(values).tolist() == expected
+
+
+if __name__ == "__main__":
+    breakdown, percentages, highest = calculate_total_co2(user)
+    print("Breakdown:", breakdown)
+    print("Percentages:", percentages)
+    print("Highest source:", highest)
+
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name}: ok")
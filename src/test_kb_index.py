@@ -0,0 +1,55 @@
+import os
+import tempfile
+import threading
+import time
+
+import kb_index
+from kb_index import KnowledgeIndex
+
+
+def test_concurrent_first_build():
+    # Callers arriving while the first build is still parsing must wait for
+    # it, not answer from the empty initial state
+    read_file = kb_index._read_file
+
+    def slow_read_file(path):
+        time.sleep(0.3)
+        return read_file(path)
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "energy.txt"), "w", encoding="utf-8") as f:
+            f.write("Switch to LED bulbs\nReduce AC usage\nAdopt solar power\nImprove energy efficiency\n")
+        index = KnowledgeIndex(directory)
+        results = {}
+
+        def retrieve(name):
+            results[name] = index.retrieve(["led", "ac", "solar", "energy"])
+
+        kb_index._read_file = slow_read_file
+        try:
+            threads = [threading.Thread(target=retrieve, args=(i,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+                time.sleep(0.05)
+            for thread in threads:
+                thread.join()
+        finally:
+            kb_index._read_file = read_file
+
+        assert index.generation == 1, index.generation
+        for name in range(4):
+            assert len(results[name]) == 4, (name, results[name])
+
+def test_empty_directory_builds_once():
+    with tempfile.TemporaryDirectory() as directory:
+        index = KnowledgeIndex(directory, check_interval=float("inf"))
+        assert index.retrieve(["energy"]) == []
+        assert index.generation == 1
+        assert not index.refresh()
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name}: ok")
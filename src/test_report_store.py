@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import tempfile
+
+from report_store import ReportStore
+
+
+def report(total):
+    return {
+        "timestamp": f"2024-01-01T00:00:{int(total) % 60:02d}",
+        "highest_source": "electricity",
+        "breakdown": {
+            "electricity": total, "transport": 0.0, "food": 0.0, "waste": 0.0, "water": 0.0,
+            "monthly_total": total, "yearly_total": total * 12,
+        },
+    }
+
+
+class FailingConnection:
+    # Wraps a sqlite3 connection; executemany fails as if another process
+    # held the write lock
+    def __init__(self, conn):
+        self.conn = conn
+
+    def executemany(self, *args):
+        raise sqlite3.OperationalError("database is locked")
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+def test_failed_flush_keeps_pending_reports():
+    with tempfile.TemporaryDirectory() as directory:
+        store = ReportStore(os.path.join(directory, "reports.db"), flush_size=1000, flush_interval=60)
+        for total in range(10):
+            store.save(report(float(total)))
+        store.save(report(99.0), source="legacy_1.json")
+
+        conn = store._conn
+        store._conn = FailingConnection(conn)
+        try:
+            store.flush()
+        except sqlite3.OperationalError:
+            pass
+        else:
+            raise AssertionError("flush did not fail")
+        store._conn = conn
+
+        assert store.count() == 11
+        sketches = store.sketches()
+        assert sketches["monthly_total"].n == 11, sketches["monthly_total"].n
+        assert sketches["monthly_total"].rank(4.0) == 5 / 11
+        # Nothing is written twice by a later flush
+        assert store.flush(force=True) == 0
+        assert store.count() == 11 and store.sketches()["monthly_total"].n == 11
+        store.close()
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name}: ok")
@@ -0,0 +1,62 @@
+import numpy as np
+
+from calculator import CATEGORIES
+from rollups import Rollup, _synthetic
+
+levels = ("district", "building")
+
+
+def assert_matches_rebuild(rollup):
+    # Incrementally maintained sums must equal a full recompute
+    sums = [s.values.copy() for s in rollup._sums]
+    counts = [c.values.copy() for c in rollup._counts]
+    rollup.rebuild()
+    for level in range(len(levels)):
+        assert np.array_equal(sums[level], rollup._sums[level].values), level
+        assert np.array_equal(counts[level], rollup._counts[level].values), level
+
+def test_set_household_flat_row():
+    ids, paths, values = _synthetic(2000, levels)
+    rollup = Rollup(levels).load(ids, paths, values)
+    row = [11, 20, 30, 40, 50]
+    rollup.set_household(ids[1], row)
+    assert rollup.cents.values[rollup._rows[ids[1]]].tolist() == [1100, 2000, 3000, 4000, 5000]
+    assert_matches_rebuild(rollup)
+
+def test_set_household_row_shapes():
+    ids, paths, values = _synthetic(200, levels)
+    rollup = Rollup(levels).load(ids, paths, values)
+    rollup.set_household(ids[0], np.array([[1, 2, 3, 4, 5]]))
+    rollup.set_household(ids[1], dict(zip(CATEGORIES, [5, 4, 3, 2, 1])))
+    assert rollup.cents.values[rollup._rows[ids[1]]].tolist() == [500, 400, 300, 200, 100]
+    for bad in ([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], np.ones((2, len(CATEGORIES)))):
+        try:
+            rollup.set_household(ids[2], bad)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"accepted {bad!r}")
+    assert_matches_rebuild(rollup)
+
+def test_random_edits_match_rebuild():
+    ids, paths, values = _synthetic(3000, levels)
+    rollup = Rollup(levels).load(ids, paths, values)
+    rng = np.random.default_rng(2)
+    for step in range(2000):
+        i = int(rng.integers(0, len(ids)))
+        if ids[i] not in rollup._rows:
+            rollup.set_household(ids[i], values[i], paths[i])
+        elif step % 7 == 0:
+            rollup.remove_household(ids[i])
+        elif step % 5 == 0:
+            rollup.set_household(ids[i], values[i] * rng.uniform(0.8, 1.2), paths[int(rng.integers(0, len(ids)))])
+        else:
+            rollup.set_household(ids[i], values[i] * rng.uniform(0.8, 1.2))
+    assert_matches_rebuild(rollup)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name}: ok")